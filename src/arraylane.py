@@ -0,0 +1,181 @@
+"""
+Array-backed lane for long lanes and dense traffic.
+"""
+import numpy as np
+from models import TrafficLight, Controller, State
+from road import Vehicle
+from stats import WaitStats
+
+
+class ArrayLane(object):
+    """
+    Drop-in replacement of road.Lane keeping the lane in NumPy arrays instead of a deque of
+    Vehicle objects. Cell i of the arrays holds the vehicle at position i (if any) with its
+    ride and wait counters, so that moving the vehicles forward is a slice shift.
+    It produces the same car_in, car_out and total_wait metrics (and controller notifications) as road.Lane.
+    Constructor parameters:
+        D   (int): distance between the sensors
+        S   (int): size of the lane
+        name    (String): name of the lane
+        init_state  (State): initial state of the traffic light
+        controller  (Controller): controller of the system
+        phase   : phase of the lane, for a models.PhaseController
+    """
+    def __init__(self, controller: Controller, S=50, name='lane', D=15, init_state=State.green, phase=None):
+        self.occupied = np.zeros(S, dtype=bool)
+        self.ride = np.zeros(S, dtype=np.int64)
+        self.wait = np.zeros(S, dtype=np.int64)
+        # position of the last vehicle of the lane, 0 if the lane is empty
+        self.last = 0
+        self.name = name
+        self.id = hash(self.name)
+        self.controller = controller
+        self.D = D
+        # traffic light
+        self.light = TrafficLight(init_state=init_state)
+        # register the light to the controller (in the given phase for a PhaseController)
+        if phase is None:
+            self.controller.add_traffic_light(self.light, self.id)
+        else:
+            self.controller.add_traffic_light(self.light, self.id, phase=phase)
+        ## metrics
+        # number of cars entering the sensed area
+        self.car_in = 0
+        # number of cars going out of the sensed area (passing the traffic light)
+        self.car_out = 0
+        # total waiting time
+        self.total_wait = 0
+        # waiting time statistics of the vehicles going out
+        self.stats = WaitStats()
+
+    def append(self, v: Vehicle):
+        """
+        Add a new vehicle to the lane, with the same placement rules as road.Lane.append.
+        """
+        if self.last == 0:
+            # no vehicles, insert in position D + 1
+            v.position = self.D + 1
+        elif self.last == len(self.occupied) - 1:
+            # maximum capacity
+            return False
+        elif self.last >= self.D + 1:
+            v.position = self.last + 1
+        else:
+            v.position = self.D + 1
+        self.last = v.position
+        self.occupied[v.position] = True
+        self.ride[v.position] = v.ride
+        self.wait[v.position] = v.wait
+        return True
+
+    def step(self):
+        """
+        This function has to be called at each timestep to simulate time.
+        If the light is green, every vehicle rides forward 1 cell.
+        If the light is amber or red, the vehicles queued from position 1 wait and every
+        vehicle behind the first free cell rides forward 1 cell.
+        """
+        last = self.last
+        if last == 0:
+            return
+        occupied, ride, wait = self.occupied, self.ride, self.wait
+        # vehicles detected by the sensors at this step, notified to the controller at once
+        n_in = n_out = 0
+        if self.light.state == State.green:
+            # green light, everyone moves forward
+            if occupied[1]:
+                # out of sensored area
+                self.car_out += 1
+                self.total_wait += int(wait[1])
+                self.stats.add(int(wait[1]))
+                n_out = 1
+            first = 1
+        else:
+            # amber or red light, the vehicles queued from position 1 wait
+            first = 1 + int(np.argmin(occupied[1:last + 1]))
+            if occupied[first]:
+                # the whole lane is queued
+                wait[1:last + 1] += 1
+                return
+            wait[1:first] += 1
+            first += 1
+        if first <= self.D + 1 <= last and occupied[self.D + 1]:
+            # in sensored area
+            self.car_in += 1
+            n_in = 1
+        # shift the vehicles from position first to last 1 cell forward
+        occupied[first - 1:last] = occupied[first:last + 1]
+        ride[first - 1:last] = ride[first:last + 1]
+        wait[first - 1:last] = wait[first:last + 1]
+        occupied[last] = False
+        occupied[0] = False
+        ride[first - 1:last] += occupied[first - 1:last]
+        self.last = last - 1
+        if n_in or n_out:
+            self.controller.update_batch(self.id, n_in, n_out, self.D)
+
+    def quiet_steps(self):
+        """
+        Returns the number of upcoming steps during which no vehicle moves, as in road.Lane.
+        """
+        if self.last == 0:
+            return float('inf')
+        if not self.occupied[1:self.last + 1].all():
+            return 0
+        # every vehicle waits until the light turns green
+        return max(self.light.steps_to_green() - 1, 0)
+
+    def advance(self, steps):
+        """
+        Equivalent of calling step the given number of times, which must not
+        exceed quiet_steps(): every (queued) vehicle waits.
+        """
+        self.wait[1:self.last + 1] += steps
+
+    def occupancy(self):
+        """
+        Returns the occupancy of the cells of the lane, by position (booleans).
+        """
+        return self.occupied.copy()
+
+    def dump_state(self):
+        """
+        Returns the state of the lane, in the format of road.Lane.dump_state.
+        """
+        positions = np.flatnonzero(self.occupied)
+        return {
+            'vehicles': [(int(p), int(self.ride[p]), int(self.wait[p])) for p in positions],
+            'light': self.light.dump_state(),
+            'car_in': self.car_in,
+            'car_out': self.car_out,
+            'total_wait': self.total_wait,
+            'stats': self.stats.to_dict(),
+        }
+
+    def load_state(self, state):
+        """
+        Restores a state returned by the dump_state of a Lane or an ArrayLane of the same size.
+        """
+        self.occupied[:] = False
+        self.ride[:] = 0
+        self.wait[:] = 0
+        self.last = 0
+        for position, ride, wait in state['vehicles']:
+            self.occupied[position] = True
+            self.ride[position] = ride
+            self.wait[position] = wait
+            self.last = position
+        self.light.load_state(state['light'])
+        self.car_in = state['car_in']
+        self.car_out = state['car_out']
+        self.total_wait = state['total_wait']
+        self.stats = WaitStats.from_dict(state['stats'])
+
+    def __repr__(self):
+        s = []
+        for position in range(len(self.occupied)):
+            if self.occupied[position]:
+                s.append(('v', position, int(self.ride[position]), int(self.wait[position])))
+            else:
+                s.append('')
+        return repr(s)
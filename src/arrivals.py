@@ -0,0 +1,216 @@
+"""
+Arrival processes feeding the lanes: random processes drawn by large NumPy blocks, and
+replay of recorded sensor counts memory-mapped from disk.
+"""
+import math
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class ArrivalProcess(ABC):
+    """
+    Base class of the arrival processes: the number of vehicles arriving at each step,
+    generated by blocks of steps from the first step queried. Each block is generated once
+    and kept until the steps queried are past it, so that looking ahead with next_arrival
+    does not change the counts later returned by take. The steps must be queried in
+    non-decreasing order (take and next_arrival together).
+    Constructor parameters:
+        block   (int): number of steps generated at once
+    """
+    def __init__(self, block=4096):
+        self.block = block
+        # first step of the first block
+        self.base = None
+        # blocks generated, by index: (counts array, counts list), and number of blocks generated
+        self.blocks = {}
+        self.generated = 0
+        # index of the oldest block kept
+        self.oldest = 0
+
+    @abstractmethod
+    def generate(self, start, n):
+        """
+        Returns the counts of the n steps from start (array of ints), or fewer if the
+        process ends before.
+        """
+
+    def __locate(self, step, drop=True):
+        """
+        Returns the block holding the given step and the offset of the step in the block,
+        generating the blocks up to it in order, and dropping the blocks before it unless
+        the step is only looked ahead.
+        """
+        if self.base is None:
+            self.base = step
+        if step < self.base + self.oldest * self.block:
+            raise ValueError('step {} queried after later steps'.format(step))
+        k = (step - self.base) // self.block
+        if drop:
+            for old in range(self.oldest, k):
+                self.blocks.pop(old, None)
+            self.oldest = max(self.oldest, k)
+        while self.generated <= k:
+            start = self.base + self.generated * self.block
+            counts = np.asarray(self.generate(start, self.block), dtype=np.int64)
+            # list copy, faster to index from Python
+            self.blocks[self.generated] = (counts, counts.tolist())
+            self.generated += 1
+        return self.blocks[k], step - self.base - k * self.block
+
+    def take(self, step):
+        """
+        Returns the number of vehicles arriving at the given step.
+        """
+        (counts, values), i = self.__locate(step)
+        # 0 past the end of the process
+        return values[i] if i < len(values) else 0
+
+    def next_arrival(self, step):
+        """
+        Returns the first step from the given one with at least one arrival (inf if none).
+        """
+        drop = True
+        while True:
+            (counts, values), i = self.__locate(step, drop)
+            drop = False
+            nonzero = np.flatnonzero(counts[i:])
+            if len(nonzero) > 0:
+                return step + int(nonzero[0])
+            if len(values) < self.block:
+                # end of the process
+                return math.inf
+            step += len(values) - i
+
+
+class Bernoulli(ArrivalProcess):
+    """
+    At most one vehicle arrives at each step, with probability p.
+    Constructor parameters:
+        p   (float): arrival probability at each step
+        seed: seed of the random generator (int or tuple of ints)
+    """
+    def __init__(self, p, seed=None, block=4096):
+        super().__init__(block)
+        self.p = p
+        self.rng = np.random.default_rng(seed)
+
+    def generate(self, start, n):
+        return self.rng.random(n) < self.p
+
+
+class Poisson(ArrivalProcess):
+    """
+    The number of vehicles arriving at each step follows a Poisson distribution.
+    Constructor parameters:
+        rate    (float): mean number of arrivals per step
+        seed: seed of the random generator (int or tuple of ints)
+    """
+    def __init__(self, rate, seed=None, block=4096):
+        super().__init__(block)
+        self.rate = rate
+        self.rng = np.random.default_rng(seed)
+
+    def generate(self, start, n):
+        return self.rng.poisson(self.rate, n)
+
+
+class TimeVarying(ArrivalProcess):
+    """
+    Poisson (or Bernoulli) arrivals whose rate depends on the step.
+    Constructor parameters:
+        rate    (callable): mean number of arrivals (probability for Bernoulli) of an array of steps
+        seed: seed of the random generator (int or tuple of ints)
+        bernoulli   (bool): at most one arrival per step, with probability rate
+    """
+    def __init__(self, rate, seed=None, bernoulli=False, block=4096):
+        super().__init__(block)
+        self.rate = rate
+        self.bernoulli = bernoulli
+        self.rng = np.random.default_rng(seed)
+
+    def generate(self, start, n):
+        rates = self.rate(np.arange(start, start + n))
+        if self.bernoulli:
+            return self.rng.random(n) < rates
+        return self.rng.poisson(rates)
+
+
+def sinusoidal(mean, amplitude=0.5, period=400):
+    """
+    Returns a rate for TimeVarying oscillating around mean: mean * (1 + amplitude * sin(2 pi step / period)).
+    """
+    def rate(steps):
+        return mean * (1 + amplitude * np.sin(2 * np.pi * steps / period))
+    return rate
+
+
+def open_trace(path, columns=None, dtype=np.int32):
+    """
+    Memory-maps a trace of sensor counts, a steps x detectors array: a .npy file, or a raw
+    binary file of the given dtype with the given number of columns. Nothing is read until
+    the steps are accessed.
+    """
+    if os.path.splitext(path)[1] == '.npy':
+        data = np.load(path, mmap_mode='r')
+    else:
+        if columns is None:
+            raise ValueError('the number of columns of the raw trace {} is needed'.format(path))
+        data = np.memmap(path, dtype=dtype, mode='r')
+        data = data.reshape(-1, columns)
+    return data if data.ndim == 2 else data.reshape(-1, 1)
+
+
+def save_trace(path, counts):
+    """
+    Saves sensor counts (steps x detectors) as a trace which can be replayed by Trace.
+    """
+    np.save(path, np.asarray(counts, dtype=np.int32))
+
+
+class Trace(ArrivalProcess):
+    """
+    Replays a column of a trace of sensor counts (see open_trace), reading it block by block
+    from the memory-mapped file. The arrivals stop at the end of the trace unless loop is set.
+    Constructor parameters:
+        trace   (String or array): path of the trace, or trace opened with open_trace
+        column  (int): column of the trace replayed
+        offset  (int): step of the trace replayed at step 0
+        loop    (bool): replay the trace from its start once it ends
+        columns (int): number of columns of a raw trace file (not needed for .npy)
+    """
+    def __init__(self, trace, column=0, offset=0, loop=False, columns=None, block=65536):
+        super().__init__(block)
+        self.data = open_trace(trace, columns) if isinstance(trace, str) else trace
+        self.column = column
+        self.offset = offset
+        self.loop = loop
+
+    def generate(self, start, n):
+        length = len(self.data)
+        begin = start + self.offset
+        if self.loop:
+            # the block wraps around the end of the trace
+            steps = np.arange(begin, begin + n) % length
+            return np.take(self.data[:, self.column], steps)
+        # only this block of the file is read
+        return np.array(self.data[begin:begin + n, self.column])
+
+
+def arrival_processes(spec, seed, probabilities):
+    """
+    Returns the arrival processes of the lanes, for an arrival specification:
+    'bernoulli' or 'poisson' (with the mean arrivals per step of each lane given by
+    probabilities), 'varying' (Poisson arrivals oscillating around those means), or the path
+    of a trace whose columns are replayed on the lanes.
+    Each lane has its own random stream derived from seed.
+    """
+    seeds = [(seed, i) if seed is not None else None for i in range(len(probabilities))]
+    if spec == 'bernoulli':
+        return [Bernoulli(p, seeds[i]) for i, p in enumerate(probabilities)]
+    if spec == 'poisson':
+        return [Poisson(p, seeds[i]) for i, p in enumerate(probabilities)]
+    if spec == 'varying':
+        return [TimeVarying(sinusoidal(p), seeds[i]) for i, p in enumerate(probabilities)]
+    data = open_trace(spec, columns=len(probabilities))
+    return [Trace(data, i) for i in range(len(probabilities))]
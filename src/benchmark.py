@@ -0,0 +1,309 @@
+"""
+Benchmarks of the hot paths of the simulation.
+Results are printed and can be saved as JSON and compared against a saved baseline.
+"""
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from getopt import gnu_getopt, GetoptError
+from models import Controller, FuzzyLogicController, PhaseController, State
+from road import Vehicle, Lane
+from arraylane import ArrayLane
+import trafficLightFuzzyController as tlfc
+from engines import MamdaniEngine, SugenoEngine
+
+# registered benchmarks: name -> (unit, higher_is_better, function returning the measure)
+BENCHMARKS = {}
+
+
+def benchmark(name, unit, higher_is_better=False):
+    """
+    Decorator registering a benchmark function.
+    """
+    def register(function):
+        BENCHMARKS[name] = (unit, higher_is_better, function)
+        return function
+    return register
+
+
+def per_call(function, number, repeat=5):
+    """
+    Returns the best time per call of function, in microseconds.
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6
+
+
+def intersection(control, lane_type=Lane, S=15, D=7):
+    north2south = lane_type(control, S=S, D=D, name='North to South', init_state=State.green)
+    west2east = lane_type(control, S=S, D=D, name='West to East', init_state=State.red)
+    return north2south, west2east
+
+
+@benchmark('fuzzy_init_cold', 'us')
+def fuzzy_init_cold():
+    def build():
+        tlfc.clear_cache()
+        tlfc.traficLightFuzzyController().traffic_lights_simulation
+    return per_call(build, 5)
+
+
+@benchmark('fuzzy_init', 'us')
+def fuzzy_init():
+    return per_call(tlfc.traficLightFuzzyController, 1000)
+
+
+@benchmark('fuzzy_get_extension_uncached', 'us')
+def fuzzy_get_extension_uncached():
+    fuzzy = tlfc.traficLightFuzzyController()
+    inputs = iter(range(10 ** 9))
+
+    def extension():
+        fuzzy.system.results.clear()
+        i = next(inputs)
+        fuzzy.get_extension(i % 16, i // 16 % 16)
+    return per_call(extension, 50)
+
+
+@benchmark('fuzzy_get_extension', 'us')
+def fuzzy_get_extension():
+    fuzzy = tlfc.traficLightFuzzyController()
+    return per_call(lambda: fuzzy.get_extension(3, 5), 10000)
+
+
+@benchmark('fuzzy_get_extension_lookup', 'us')
+def fuzzy_get_extension_lookup():
+    fuzzy = tlfc.traficLightFuzzyController(lookup=True)
+    return per_call(lambda: fuzzy.get_extension(3, 5), 10000)
+
+
+@benchmark('engine_mamdani_get_extension', 'us')
+def engine_mamdani_get_extension():
+    engine = MamdaniEngine()
+    return per_call(lambda: engine.get_extension(3, 5), 10000)
+
+
+@benchmark('engine_sugeno_get_extension', 'us')
+def engine_sugeno_get_extension():
+    engine = SugenoEngine()
+    return per_call(lambda: engine.get_extension(3, 5), 10000)
+
+
+@benchmark('fuzzy_get_extension_batch', 'us')
+def fuzzy_get_extension_batch():
+    fuzzy = tlfc.traficLightFuzzyController()
+    rng = random.Random(0)
+    queue = [rng.randrange(16) for i in range(10000)]
+    arrivals = [rng.randrange(16) for i in range(10000)]
+    return per_call(lambda: fuzzy.get_extension_batch(queue, arrivals), 5) / len(queue)
+
+
+@benchmark('arrivals_uniform', 'us')
+def arrivals_uniform():
+    rng = random.Random(0)
+    return per_call(lambda: rng.uniform(0, 1) >= 0.5, 100000)
+
+
+@benchmark('arrivals_bernoulli', 'us')
+def arrivals_bernoulli():
+    from arrivals import Bernoulli
+    process = Bernoulli(0.5, 0)
+    steps = itertools.count()
+    return per_call(lambda: process.take(next(steps)), 100000)
+
+
+def lane_step(lane_type, S, density, steps=2000):
+    """
+    Time per Lane.append + Lane.step of a lane of size S, where a vehicle arrives at each
+    step with probability density, its light alternating with the default timings.
+    """
+    control = Controller()
+    lane = lane_type(control, S=S, D=S // 2, name='lane', init_state=State.green)
+    rng = random.Random(0)
+    arrivals = [rng.random() < density for i in range(steps)]
+    start = time.perf_counter()
+    for arrival in arrivals:
+        if arrival:
+            lane.append(Vehicle())
+        control.step()
+        lane.step()
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+for lane_type in (Lane, ArrayLane):
+    for S in (15, 150, 1500):
+        for density in (0.1, 0.5):
+            benchmark('{}_step_S{}_d{}'.format(lane_type.__name__, S, density), 'us')(
+                lambda lane_type=lane_type, S=S, density=density: lane_step(lane_type, S, density))
+
+
+@benchmark('Controller_step', 'us')
+def controller_step():
+    control = Controller()
+    intersection(control)
+    return per_call(control.step, 10000)
+
+
+@benchmark('FuzzyLogicController_step', 'us')
+def fuzzy_controller_step():
+    control = FuzzyLogicController()
+    intersection(control)
+    return per_call(control.step, 10000)
+
+
+@benchmark('PhaseController_step_8_lanes', 'us')
+def phase_controller_step():
+    control = PhaseController(fuzzy=True)
+    for i in range(8):
+        # 4 phases of 2 lanes
+        Lane(control, S=15, D=7, name='lane {}'.format(i), phase=i // 2)
+    return per_call(control.step, 10000)
+
+
+def intersection_steps(control, lane_type=Lane, steps=20000):
+    """
+    Steps per second of a full intersection (arrivals, controller and lanes steps).
+    """
+    north2south, west2east = intersection(control, lane_type)
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for step in range(steps):
+        if rng.uniform(0, 1) >= 0.5:
+            north2south.append(Vehicle())
+        if rng.uniform(0, 1) >= 0.8:
+            west2east.append(Vehicle())
+        control.step()
+        north2south.step()
+        west2east.step()
+    return steps / (time.perf_counter() - start)
+
+
+@benchmark('intersection_fixed', 'steps/s', higher_is_better=True)
+def intersection_fixed():
+    return intersection_steps(Controller())
+
+
+@benchmark('intersection_fuzzy', 'steps/s', higher_is_better=True)
+def intersection_fuzzy():
+    return intersection_steps(FuzzyLogicController())
+
+
+@benchmark('intersection_fuzzy_lookup', 'steps/s', higher_is_better=True)
+def intersection_fuzzy_lookup():
+    return intersection_steps(FuzzyLogicController(lookup=True))
+
+
+@benchmark('peak_memory', 'KiB')
+def peak_memory():
+    tracemalloc.start()
+    intersection_steps(FuzzyLogicController(), steps=5000)
+    intersection_steps(Controller(), ArrayLane, steps=5000)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+# runs simulation.py with the given arguments and fails if skfuzzy was imported
+STARTUP = """
+import runpy, sys
+sys.argv = ['simulation.py'] + sys.argv[1:]
+runpy.run_path('simulation.py', run_name='__main__')
+assert 'skfuzzy' not in sys.modules, 'skfuzzy imported by a fixed-time run'
+"""
+
+
+@benchmark('startup_fixed', 'ms')
+def startup_fixed():
+    """
+    Wall time of a short fixed-time run of simulation.py in a new interpreter, which must
+    not import the fuzzy control system stack.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(5):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', STARTUP, '-s', 'fixed', '--seed', '0'], cwd=here, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1e3
+
+
+def run(names=None):
+    """
+    Runs the benchmarks (all of them, or those whose name contains one of names).
+    Returns the dict name -> {'value', 'unit', 'higher_is_better'}.
+    """
+    results = {}
+    for name, (unit, higher_is_better, function) in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = {'value': function(), 'unit': unit, 'higher_is_better': higher_is_better}
+        print('{:<40} {:>14.3f} {}'.format(name, results[name]['value'], unit))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results against a baseline. Returns the list of regressions, the
+    benchmarks more than tolerance (relative) worse than their baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]['value']
+        ratio = result['value'] / reference if reference else 1.
+        if result['higher_is_better']:
+            ratio = 1 / ratio if ratio else float('inf')
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+        print('{:<40} {:>8.2f}x baseline{}'.format(name, ratio, '  REGRESSION' if ratio > 1 + tolerance else ''))
+    return regressions
+
+
+def usage():
+    s = "usage: benchmark.py [OPTIONS] [NAME ...]\n"
+    s+= "Runs the benchmarks (only those whose name contains one of the NAMEs if given).\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-o FILE\n\t save the results to FILE (JSON)\n"
+    s+= "-b FILE\n\t compare the results against the baseline saved in FILE, exits with 1 on regressions\n"
+    s+= "-t FLOAT\n\t relative slowdown tolerated before a regression is reported (default 0.25)\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    output = None
+    baseline = None
+    tolerance = 0.25
+    try:
+        opt_arg, names = gnu_getopt(sys.argv[1:], 'ho:b:t:')
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-o':
+                output = arg
+            elif opt == '-b':
+                baseline = arg
+            elif opt == '-t':
+                tolerance = float(arg)
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    results = run(names)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        if regressions:
+            print('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
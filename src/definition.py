@@ -0,0 +1,21 @@
+"""
+Definition of the fuzzy control system of the traffic light controllers, shared by the
+inference backends (trafficLightFuzzyController, engines) without importing any of them.
+"""
+
+# membership functions of each fuzzy variable: (universe size, ((term, trimf bounds), ...))
+# the universe of a variable is np.arange(0, size, 1)
+ARRIVALS = (16, (("AN", (0, 0, 2)), ("F", (1, 4, 7)), ("MY", (5, 9, 13)), ("TMY", (10, 15, 15))))
+QUEUE = (16, (("VS", (0, 0, 2)), ("S", (1, 4, 7)), ("M", (5, 9, 13)), ("L", (10, 15, 15))))
+EXTENSION = (7, (("Z", (0, 0, 2)), ("SO", (0, 2, 4)), ("ML", (2, 4, 6)), ("LO", (4, 6, 6))))
+
+# rule base of the control system: (arrivals term, queue term, extension term)
+RULES = (
+    ("AN", "VS", "Z"), ("AN", "S", "Z"), ("AN", "M", "Z"), ("AN", "L", "Z"),
+    ("F", "VS", "SO"), ("F", "S", "SO"), ("F", "M", "Z"), ("F", "L", "Z"),
+    ("MY", "VS", "ML"), ("MY", "S", "ML"), ("MY", "M", "SO"), ("MY", "L", "Z"),
+    ("TMY", "VS", "LO"), ("TMY", "S", "ML"), ("TMY", "M", "ML"), ("TMY", "L", "SO"),
+)
+
+# complete definition of the control system, also the key of the compiled systems cache
+DEFINITION = (ARRIVALS, QUEUE, EXTENSION, RULES)
@@ -0,0 +1,216 @@
+"""
+Inference engines of the fuzzy control system written in plain Python, as alternatives to
+the skfuzzy backend (trafficLightFuzzyController): a Mamdani engine computing the same
+result without the skfuzzy control graph, and a zero-order Takagi-Sugeno engine.
+Both are registered as backends of models.FuzzyLogicController ('mamdani', 'sugeno') and
+do not import skfuzzy.
+"""
+import sys
+import time
+from abc import ABC, abstractmethod
+from getopt import gnu_getopt, GetoptError
+import numpy as np
+from definition import DEFINITION
+
+
+def trimf(x, bounds):
+    """
+    Triangular membership of x for the bounds (a, b, c), like skfuzzy.trimf.
+    """
+    a, b, c = bounds
+    if x < a or x > c:
+        return 0.
+    if x < b:
+        return (x - a) / (b - a)
+    if x > b:
+        return (c - x) / (c - b)
+    return 1.
+
+
+class Engine(ABC):
+    """
+    Base class of the engines: fuzzification of the clipped inputs and rule firing (min
+    for the conjunction, max to accumulate the rules of a same consequent). Subclasses
+    define the output of the fired consequents.
+    Constructor parameters:
+        lookup  (bool): answer the integer inputs from a table of the outputs over the
+                        queue x arrivals grid
+        definition  (tuple): membership functions and rules of the control system
+    """
+    def __init__(self, lookup=False, definition=DEFINITION):
+        arrivals, queue, extension, rules = definition
+        self.definition = definition
+        self.arrivals_size, self.arrivals_terms = arrivals[0], dict(arrivals[1])
+        self.queue_size, self.queue_terms = queue[0], dict(queue[1])
+        self.extension_size, self.extension_terms = extension[0], dict(extension[1])
+        self.rules = rules
+        self.surface = None
+        if lookup:
+            self.surface = [[self.compute(q, a) for a in range(self.arrivals_size)] for q in range(self.queue_size)]
+
+    def fire(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Returns the firing strength of each consequent term.
+        """
+        queue = min(max(cars_in_queue, 0), self.queue_size - 1)
+        arrivals = min(max(cars_arriving_at_green_light, 0), self.arrivals_size - 1)
+        fuzzy_queue = {term: trimf(queue, bounds) for term, bounds in self.queue_terms.items()}
+        fuzzy_arrivals = {term: trimf(arrivals, bounds) for term, bounds in self.arrivals_terms.items()}
+        cuts = dict.fromkeys(self.extension_terms, 0.)
+        for a, q, e in self.rules:
+            cuts[e] = max(cuts[e], min(fuzzy_arrivals[a], fuzzy_queue[q]))
+        return cuts
+
+    @abstractmethod
+    def compute(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Returns the extension for the given inputs.
+        """
+
+    def get_extension(self, cars_in_queue, cars_arriving_at_green_light):
+        if self.surface is not None and cars_in_queue == int(cars_in_queue) \
+                and cars_arriving_at_green_light == int(cars_arriving_at_green_light):
+            q = min(max(int(cars_in_queue), 0), self.queue_size - 1)
+            a = min(max(int(cars_arriving_at_green_light), 0), self.arrivals_size - 1)
+            return self.surface[q][a]
+        return self.compute(cars_in_queue, cars_arriving_at_green_light)
+
+    def get_extension_batch(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Array version of get_extension, the inputs are broadcast against each other.
+        """
+        queue, arrivals = np.broadcast_arrays(np.asarray(cars_in_queue, dtype=np.float64),
+                                              np.asarray(cars_arriving_at_green_light, dtype=np.float64))
+        output = [self.get_extension(q, a) for q, a in zip(queue.ravel().tolist(), arrivals.ravel().tolist())]
+        return np.array(output, dtype=np.float64).reshape(queue.shape)
+
+
+class MamdaniEngine(Engine):
+    """
+    Mamdani inference with centroid defuzzification, computed like the skfuzzy control
+    system: the clipped consequents are aggregated over the extension universe upsampled
+    with the points where each consequent crosses its cut, and the centroid is the exact
+    one of the piecewise linear aggregate.
+    """
+    def compute(self, cars_in_queue, cars_arriving_at_green_light):
+        cuts = self.fire(cars_in_queue, cars_arriving_at_green_light)
+        points = list(range(self.extension_size))
+        for term, bounds in self.extension_terms.items():
+            cut = cuts[term]
+            if cut <= 0:
+                continue
+            m1 = trimf(0, bounds)
+            for x in range(self.extension_size - 1):
+                m2 = trimf(x + 1, bounds)
+                if (m1 >= cut) != (m2 >= cut):
+                    points.append(x + (cut - m1) / (m2 - m1))
+                m1 = m2
+        points.sort()
+        output = [max(min(cuts[term], trimf(x, bounds)) for term, bounds in self.extension_terms.items())
+                  for x in points]
+        area = moment = 0.
+        for x1, x2, y1, y2 in zip(points, points[1:], output, output[1:]):
+            width = x2 - x1
+            area += 0.5 * width * (y1 + y2)
+            moment += width * (y1 * (2 * x1 + x2) + y2 * (x1 + 2 * x2)) / 6
+        return moment / area if area > 0 else 0.
+
+
+class SugenoEngine(Engine):
+    """
+    Zero-order Takagi-Sugeno inference: each consequent term is the crisp value of the
+    peak of its membership function (Z 0, SO 2, ML 4, LO 6 with the default definition),
+    and the output is the average of the values weighted by the firing strengths.
+    """
+    def __init__(self, lookup=False, definition=DEFINITION):
+        self.values = {term: bounds[1] for term, bounds in definition[2][1]}
+        super().__init__(lookup, definition)
+
+    def compute(self, cars_in_queue, cars_arriving_at_green_light):
+        cuts = self.fire(cars_in_queue, cars_arriving_at_green_light)
+        weight = sum(cuts.values())
+        if weight == 0:
+            return 0.
+        return sum(cut * self.values[term] for term, cut in cuts.items()) / weight
+
+    def get_extension_batch(self, cars_in_queue, cars_arriving_at_green_light):
+        queue, arrivals = np.broadcast_arrays(np.asarray(cars_in_queue, dtype=np.float64),
+                                              np.asarray(cars_arriving_at_green_light, dtype=np.float64))
+        shape = queue.shape
+        queue = np.clip(queue.ravel(), 0, self.queue_size - 1)
+        arrivals = np.clip(arrivals.ravel(), 0, self.arrivals_size - 1)
+        # the membership functions are linear between the integers of the universes
+        fuzzy_queue = {term: np.interp(queue, np.arange(self.queue_size),
+                                       [trimf(x, bounds) for x in range(self.queue_size)])
+                       for term, bounds in self.queue_terms.items()}
+        fuzzy_arrivals = {term: np.interp(arrivals, np.arange(self.arrivals_size),
+                                          [trimf(x, bounds) for x in range(self.arrivals_size)])
+                          for term, bounds in self.arrivals_terms.items()}
+        cuts = {term: np.zeros(len(queue)) for term in self.extension_terms}
+        for a, q, e in self.rules:
+            np.fmax(cuts[e], np.fmin(fuzzy_arrivals[a], fuzzy_queue[q]), cuts[e])
+        weight = sum(cuts.values())
+        total = sum(cut * self.values[term] for term, cut in cuts.items())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            output = np.where(weight > 0, total / weight, 0.)
+        return output.reshape(shape)
+
+
+# engines by name, as registered in models.BACKENDS
+ENGINES = {'mamdani': MamdaniEngine, 'sugeno': SugenoEngine}
+
+
+def compare_engines(names=('mamdani', 'sugeno'), resolution=1, definition=DEFINITION):
+    """
+    Evaluates the skfuzzy control system and the given engines at every point of a grid
+    'resolution' times finer than the queue x arrivals universes (including out of range
+    points), and returns for each engine the time of the grid, its speedup over skfuzzy and
+    its maximum absolute deviation from the skfuzzy results.
+    """
+    from trafficLightFuzzyController import traficLightFuzzyController
+    grid = [(q, a) for q in np.arange(-1, definition[1][0] + 1, 1 / resolution).tolist()
+            for a in np.arange(-1, definition[0][0] + 1, 1 / resolution).tolist()]
+    reference = traficLightFuzzyController(definition=definition)
+    # every point is computed, not answered from the memoized results
+    reference.system.results.clear()
+    start = time.perf_counter()
+    expected = [reference.compute(q, a) for q, a in grid]
+    seconds = time.perf_counter() - start
+    report = {'skfuzzy': {'seconds': seconds, 'speedup': 1., 'deviation': 0.}}
+    for name in names:
+        engine = ENGINES[name](definition=definition)
+        start = time.perf_counter()
+        output = [engine.get_extension(q, a) for q, a in grid]
+        elapsed = time.perf_counter() - start
+        report[name] = {'seconds': elapsed, 'speedup': seconds / elapsed,
+                        'deviation': max(abs(x - y) for x, y in zip(output, expected))}
+    return report
+
+
+def usage():
+    s = "usage: engines.py [OPTIONS]\n"
+    s+= "Compares the inference engines with the skfuzzy control system over the input grid.\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-r INT\n\t points of the grid per unit of the universes (default 1: the integer inputs)\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    resolution = 1
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hr:')
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-r':
+                resolution = int(arg)
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    print('{:<8} {:>10} {:>9} {:>14}'.format('engine', 'time (ms)', 'speedup', 'max deviation'))
+    for name, result in compare_engines(resolution=resolution).items():
+        print('{:<8} {:>10.1f} {:>8.1f}x {:>14.6f}'.format(name, result['seconds'] * 1e3, result['speedup'],
+                                                          result['deviation']))
@@ -0,0 +1,82 @@
+"""
+Instrumentation of the simulation: per-phase timing counters and leveled logging.
+Log messages go through the logging module with lazy arguments, so that they are only
+formatted when their level is enabled.
+"""
+import logging
+import time
+
+# logger of the simulation, the modules log through its children
+logger = logging.getLogger('fuzzylogic')
+
+
+def get_logger(name):
+    """
+    Returns the logger of a module of the simulation.
+    """
+    return logger.getChild(name)
+
+
+def configure_logging(level):
+    """
+    Enables the log messages of the given level (name or number) and above.
+    """
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    logging.basicConfig(format='%(message)s')
+    logger.setLevel(level)
+
+
+class Probe(object):
+    """
+    Per-phase timing and call counters.
+    A phase is timed by surrounding it with start and stop:
+        t = probe.start()
+        ...
+        probe.stop('phase', t)
+    When the probe is disabled, start and stop return immediately.
+    """
+    def __init__(self):
+        self.enabled = False
+        # phase -> total time (s) and number of calls
+        self.time = {}
+        self.calls = {}
+
+    def start(self):
+        return time.perf_counter() if self.enabled else 0.
+
+    def stop(self, phase, start):
+        if self.enabled:
+            self.time[phase] = self.time.get(phase, 0.) + time.perf_counter() - start
+            self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def take(self):
+        """
+        Returns the counters as a dict phase -> (time, calls) and resets them.
+        """
+        counters = {phase: (self.time[phase], self.calls[phase]) for phase in self.time}
+        self.time = {}
+        self.calls = {}
+        return counters
+
+    def merge(self, counters):
+        """
+        Adds counters returned by take (e.g. by another process) to this probe.
+        """
+        for phase, (t, calls) in counters.items():
+            self.time[phase] = self.time.get(phase, 0.) + t
+            self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def summary(self):
+        """
+        Returns a table of the counters: total time, number of calls and time per call of each phase.
+        """
+        s = '{:<16} {:>12} {:>12} {:>14}\n'.format('phase', 'time (s)', 'calls', 'per call (us)')
+        for phase in sorted(self.time, key=self.time.get, reverse=True):
+            t, calls = self.time[phase], self.calls[phase]
+            s += '{:<16} {:>12.3f} {:>12} {:>14.3f}\n'.format(phase, t, calls, t / calls * 1e6)
+        return s
+
+
+# probe of this process
+probe = Probe()
@@ -0,0 +1,247 @@
+"""
+Lock-step engine advancing many independent replicas of the intersection together.
+"""
+import numpy as np
+from models import State
+from trafficLightFuzzyController import traficLightFuzzyController as TLFC
+
+# maximum duration of an extended green (and red) light, as in FuzzyLogicController.extend
+MAX_CLOCK = 20
+
+
+class LockstepSimulation(object):
+    """
+    Simulates R replicas of the intersection of simulation.py at once: the lanes of all the
+    replicas are R x L x S arrays, the lights and the controllers R x L (or R-length) arrays,
+    and each time step is a handful of array operations for all the replicas.
+    The dynamics are those of road.Lane, models.Controller and models.FuzzyLogicController,
+    the fuzzy extensions of all the replicas are evaluated with one batched call.
+    Replica i draws its arrivals from its own random stream seeded with (seed, i), so its
+    result does not depend on the number of replicas simulated with it.
+    A replica ends when one of its lanes has let 'cars' cars out or after max_steps steps.
+    Constructor parameters:
+        replicas    (int): number of replicas R
+        fuzzy   (bool): fuzzy logic controllers if True, fixed-time controllers otherwise
+        S   (int): size of the lanes
+        D   (int): distance between the sensors
+        thresholds  (tuple): for each lane, a vehicle arrives when a uniform draw is >= threshold
+        init_states (tuple): initial state of the light of each lane
+        timings (tuple): green, amber and red times of the lights
+        seed    (int): master seed of the random streams
+        cars    (int): number of cars out of a lane ending a replica
+        max_steps   (int): maximum number of steps of a replica (None for no limit)
+        block   (int): number of steps of arrivals drawn at once from each random stream
+    """
+    def __init__(self, replicas, fuzzy=False, S=15, D=7, thresholds=(0.5, 0.8),
+                 init_states=(State.green, State.red), timings=(11, 4, 15), seed=0,
+                 cars=50, max_steps=None, block=64):
+        L = len(thresholds)
+        self.replicas = replicas
+        self.fuzzy = TLFC() if fuzzy else None
+        self.S = S
+        self.D = D
+        self.thresholds = np.array(thresholds)
+        self.timings = np.array(timings, dtype=np.float64)
+        self.cars = cars
+        self.max_steps = max_steps
+        self.block = block
+        self.streams = [np.random.default_rng((seed, i)) for i in range(replicas)]
+        # replica of each row of the state arrays, rows are dropped as replicas end
+        self.index = np.arange(replicas)
+        # lanes: occupancy and waiting time of each cell, with an always empty cell S
+        self.occupied = np.zeros((replicas, L, S + 1), dtype=bool)
+        self.wait = np.zeros((replicas, L, S + 1), dtype=np.int64)
+        # position of the last vehicle of each lane, 0 if the lane is empty
+        self.last = np.zeros((replicas, L), dtype=np.int64)
+        self.car_in = np.zeros((replicas, L), dtype=np.int64)
+        self.car_out = np.zeros((replicas, L), dtype=np.int64)
+        self.total_wait = np.zeros((replicas, L), dtype=np.int64)
+        # lights: state of each light and clock of each state (column state - 1)
+        states = []
+        for s in init_states:
+            # same rule as Controller.add_traffic_light: a single green light
+            states.append(State.red if s == State.green and State.green in states else s)
+        self.state = np.tile(np.array(states, dtype=np.int64), (replicas, 1))
+        self.clocks = np.tile(self.timings, (replicas, L, 1))
+        # fuzzy logic controllers: metric counters, buffer and starvation control of FuzzyLogicController
+        self.green_in = np.zeros(replicas, dtype=np.int64)
+        self.green_out = np.zeros(replicas, dtype=np.int64)
+        self.amber_in = np.zeros(replicas, dtype=np.int64)
+        self.red_in = np.zeros(replicas, dtype=np.int64)
+        self.buffer = np.zeros(replicas, dtype=np.int64)
+        self.extended_to_max = np.zeros(replicas, dtype=bool)
+        # mapState: lane of each light state (column state - 1), -1 for none
+        self.map_state = np.full((replicas, 3), -1, dtype=np.int64)
+        for l, s in enumerate(states):
+            self.map_state[:, s - 1] = l
+        self.arrivals = None
+        # results of the ended replicas
+        self.steps = np.zeros(replicas, dtype=np.int64)
+        self.truncated = np.zeros(replicas, dtype=bool)
+        self.desynchronized = np.zeros(replicas, dtype=bool)
+        self.results = {
+            'car_in': np.zeros((replicas, L), dtype=np.int64),
+            'car_out': np.zeros((replicas, L), dtype=np.int64),
+            'total_wait': np.zeros((replicas, L), dtype=np.int64),
+        }
+
+    def draw(self, steps):
+        """
+        Returns the arrivals of the next steps of the running replicas, as a
+        (replicas, steps, lanes) boolean array.
+        """
+        L = len(self.thresholds)
+        return np.stack([self.streams[i].random((steps, L)) >= self.thresholds for i in self.index])
+
+    def append(self, arrivals):
+        """
+        Lane.append for all the lanes: a new vehicle is placed at D + 1 or right after the
+        last vehicle if it is beyond D + 1, unless the lane is full.
+        """
+        last = self.last
+        add = arrivals & (last != self.S - 1)
+        position = np.where(last >= self.D + 1, last + 1, self.D + 1)
+        r, l = np.nonzero(add)
+        p = position[r, l]
+        self.occupied[r, l, p] = True
+        self.wait[r, l, p] = 0
+        self.last[r, l] = p
+
+    def step_lights(self):
+        """
+        TrafficLight.step for all the lights.
+        """
+        r, l = np.indices(self.state.shape)
+        current = self.state - 1
+        self.clocks[r, l, current] -= 1
+        switch = self.clocks[r, l, current] == 0
+        self.clocks[r, l, current] = np.where(switch, self.timings[current], self.clocks[r, l, current])
+        self.state = np.where(switch, (current + 1) % 3 + 1, self.state)
+
+    def step_fuzzy(self):
+        """
+        FuzzyLogicController.step (after the lights step) for all the controllers.
+        Returns the mask of the controllers whose lights are desynchronized: a green light
+        to extend without a red light, where FuzzyLogicController raises
+        models.LightsDesynchronized (their state is left as is).
+        """
+        rows = np.arange(len(self.index))
+        green_lane = self.map_state[:, State.green - 1]
+        red_lane = self.map_state[:, State.red - 1]
+        has_green = green_lane >= 0
+        has_red = red_lane >= 0
+        # extend
+        extend = has_green & ~self.extended_to_max
+        desynchronized = extend & ~has_red
+        extend &= has_red
+        if extend.any():
+            r = rows[extend]
+            extension = np.rint(self.fuzzy.get_extension_batch(self.red_in[r], self.green_in[r] - self.green_out[r]))
+            green_clock = np.minimum(MAX_CLOCK, self.clocks[r, green_lane[r], State.green - 1] + extension)
+            self.extended_to_max[r] = green_clock == MAX_CLOCK
+            red_clock = np.minimum(MAX_CLOCK, self.clocks[r, red_lane[r], State.red - 1] + extension)
+            self.clocks[r, red_lane[r], State.red - 1] = red_clock
+            self.clocks[r, green_lane[r], State.green - 1] = green_clock
+        # green light turned amber
+        switch_green = has_green & (self.state[rows, green_lane] != State.green)
+        self.buffer = np.where(switch_green, self.green_in - self.green_out, self.buffer)
+        # red light turned green
+        switch_red = ~has_green & has_red & (self.state[rows, red_lane] != State.red)
+        self.green_in = np.where(switch_red, self.red_in, self.green_in)
+        self.green_out = np.where(switch_red, 0, self.green_out)
+        self.red_in = np.where(switch_red, self.buffer + self.amber_in, self.red_in)
+        self.buffer = np.where(switch_red, 0, self.buffer)
+        self.amber_in = np.where(switch_red, 0, self.amber_in)
+        # refresh
+        self.map_state[:] = -1
+        for l in range(self.state.shape[1]):
+            for s in State:
+                self.map_state[:, s - 1] = np.where(self.state[:, l] == s, l, self.map_state[:, s - 1])
+        return desynchronized
+
+    def step_lanes(self):
+        """
+        Lane.step for all the lanes.
+        On green every vehicle moves forward, on amber or red the vehicles queued from
+        position 1 wait and every vehicle behind the first free cell moves forward.
+        """
+        occupied, wait, S, D = self.occupied, self.wait, self.S, self.D
+        green = self.state == State.green
+        # first cell from which vehicles move forward (0 on green)
+        first = np.where(green, 0, 1 + np.argmin(occupied[:, :, 1:], axis=2))
+        # sensors
+        out = green & occupied[:, :, 1]
+        crossing = occupied[:, :, D + 1] & (first <= D)
+        self.car_out += out
+        self.total_wait += np.where(out, wait[:, :, 1], 0)
+        self.car_in += crossing
+        if self.fuzzy is not None:
+            self.green_out += out.sum(axis=1)
+            self.green_in += (crossing & green).sum(axis=1)
+            self.amber_in += (crossing & (self.state == State.amber)).sum(axis=1)
+            self.red_in += (crossing & (self.state == State.red)).sum(axis=1)
+        # vehicles in front of the first free cell wait
+        cells = np.arange(S + 1)
+        blocked = cells < first[:, :, None]
+        wait += blocked & occupied
+        # the others move 1 cell forward
+        source = np.where(blocked, cells, np.minimum(cells + 1, S))
+        self.occupied = np.take_along_axis(occupied, source, axis=2)
+        self.occupied[:, :, 0] = False
+        self.wait = np.take_along_axis(wait, source, axis=2)
+        self.last = np.where(first < self.last, self.last - 1, self.last)
+
+    def end(self, ended, step):
+        """
+        Stores the results of the ended replicas and drops them from the state arrays.
+        """
+        index = self.index[ended]
+        self.steps[index] = step
+        self.results['car_in'][index] = self.car_in[ended]
+        self.results['car_out'][index] = self.car_out[ended]
+        self.results['total_wait'][index] = self.total_wait[ended]
+        keep = ~ended
+        for name in ('index', 'occupied', 'wait', 'last', 'car_in', 'car_out', 'total_wait', 'state',
+                     'clocks', 'green_in', 'green_out', 'amber_in', 'red_in', 'buffer', 'extended_to_max',
+                     'map_state', 'arrivals'):
+            if getattr(self, name) is not None:
+                setattr(self, name, getattr(self, name)[keep])
+
+    def run(self):
+        """
+        Runs all the replicas until they end. Returns the dict of the per-replica results:
+        'steps', 'truncated' (replicas stopped by max_steps or by desynchronized lights),
+        'desynchronized' (replicas stopped where simulation.simulate stops on
+        models.LightsDesynchronized, before their lanes step) and the per-lane 'car_in',
+        'car_out' and 'total_wait'.
+        """
+        step = 0
+        while len(self.index) > 0:
+            # same ending conditions as the loop of simulation.py
+            ended = (self.car_out >= self.cars).any(axis=1)
+            if self.max_steps is not None and step >= self.max_steps:
+                self.truncated[self.index[~ended]] = True
+                ended[:] = True
+            if ended.any():
+                self.end(ended, step)
+                if len(self.index) == 0:
+                    break
+            if step % self.block == 0:
+                self.arrivals = self.draw(self.block)
+            self.append(self.arrivals[:, step % self.block])
+            self.step_lights()
+            if self.fuzzy is not None:
+                desynchronized = self.step_fuzzy()
+                if desynchronized.any():
+                    self.truncated[self.index[desynchronized]] = True
+                    self.desynchronized[self.index[desynchronized]] = True
+                    self.end(desynchronized, step)
+                    if len(self.index) == 0:
+                        break
+            self.step_lanes()
+            step += 1
+        results = dict(self.results)
+        results['steps'] = self.steps
+        results['truncated'] = self.truncated
+        results['desynchronized'] = self.desynchronized
+        return results
@@ -1,10 +1,50 @@
 """
 Contains the base classes for the simulation.
 """
-import numpy as np
 from enum import IntEnum
 from abc import ABCMeta, abstractmethod
-from trafficLightFuzzyController import traficLightFuzzyController as TLFC
+from importlib import import_module
+from instrument import get_logger, probe
+
+logger = get_logger('models')
+
+# fuzzy control system backends: name -> factory taking lookup, or 'module:attribute' of the
+# factory, imported when a controller first uses the backend (the default one pulls in
+# skfuzzy, numpy and scipy, which fixed-time simulations do not need)
+BACKENDS = {
+    'skfuzzy': 'trafficLightFuzzyController:traficLightFuzzyController',
+    # inference engines without skfuzzy
+    'mamdani': 'engines:MamdaniEngine',
+    'sugeno': 'engines:SugenoEngine',
+}
+
+
+def register_backend(name, factory):
+    """
+    Registers a fuzzy control system backend: a factory (or its 'module:attribute' path)
+    taking lookup and returning an object with get_extension(queue, arrival).
+    """
+    BACKENDS[name] = factory
+
+
+def load_backend(name='skfuzzy'):
+    """
+    Returns the factory of the given backend, importing its module on first use.
+    """
+    factory = BACKENDS[name]
+    if isinstance(factory, str):
+        module, attribute = factory.split(':')
+        factory = BACKENDS[name] = getattr(import_module(module), attribute)
+    return factory
+
+
+class LightsDesynchronized(RuntimeError):
+    """
+    Raised by FuzzyLogicController when its extensions desynchronized the lights: no red
+    light while a light is green, or a vehicle crossing on amber/red. The green and red
+    clocks are both capped at 20 steps, so extensions that push the green clock above 16
+    before reaching the cap let the red light end first.
+    """
 
 
 class State(IntEnum):
@@ -54,14 +94,47 @@ class TrafficLight(object):
         """
         self.clocks[self.state] -= 1
         if log:
-            print('({}) clock: {}'.format(self.state,  self.clocks[self.state]))
+            logger.debug('(%s) clock: %s', self.state, self.clocks[self.state])
         if self.clocks[self.state] == 0:
             # reset
             self.clocks[self.state] = self.__clock_reset[self.state]
             # next state 
             self.state = self.__next_state()
             if log:
-                print('switch to: {}'.format(self.state))
+                logger.debug('switch to: %s', self.state)
+
+    def advance(self, steps):
+        """
+        Equivalent of calling step the given number of times, switching state as many
+        times as needed.
+        """
+        while steps >= self.clocks[self.state]:
+            steps -= self.clocks[self.state]
+            self.clocks[self.state] = self.__clock_reset[self.state]
+            self.state = self.__next_state()
+        self.clocks[self.state] -= steps
+
+    def steps_to_green(self):
+        """
+        Returns the number of steps after which the light will be green (0 if it is green).
+        """
+        steps = 0
+        state = self.state
+        while state != State.green:
+            steps += self.clocks[state]
+            state = State(state % 3 + 1)
+        return int(steps)
+
+    def dump_state(self):
+        """
+        Returns the state of the light (see load_state).
+        """
+        return {'state': int(self.state), 'clocks': {int(k): v for k, v in self.clocks.items()}}
+
+    def load_state(self, state):
+        self.state = State(state['state'])
+        # the keys are strings once the state went through JSON
+        self.clocks = {State(int(k)): v for k, v in state['clocks'].items()}
 
 
 class Controller(object):
@@ -98,6 +171,35 @@ class Controller(object):
         for lane_id, light in self.lights.items():
             light.step(self.log)
 
+    def quiet_steps(self):
+        """
+        Returns the number of upcoming steps which can be skipped with advance, as long as 
+        no vehicle is detected by the sensors. The lights of a fixed-time controller do not 
+        depend on the traffic, any number of steps can be skipped.
+        """
+        return float('inf')
+
+    def advance(self, steps):
+        """
+        Equivalent of calling step the given number of times, which must not 
+        exceed quiet_steps().
+        """
+        for lane_id, light in self.lights.items():
+            light.advance(steps)
+
+    def dump_state(self):
+        """
+        Returns the state of the controller, besides the state of its lights (see load_state).
+        """
+        return {}
+
+    def load_state(self, state):
+        """
+        Restores a state returned by dump_state, once the lights are restored. state is None
+        when it was dumped by another type of controller: the controller then resumes from
+        the state of its lights.
+        """
+
     def update(self, id, position):
         """
         A call to this function notifies the controller of a vehicle detected 
@@ -105,45 +207,60 @@ class Controller(object):
         """
         # print("car detected on lane {}, position {}".format(id, position))
 
+    def update_batch(self, id, n_in, n_out, position):
+        """
+        Notifies the controller of the vehicles detected by the sensors of a lane at a step:
+        n_in vehicles by the sensor at the given position and n_out by the sensor at the
+        light (position 0). Calls update for each vehicle, the vehicles going out first.
+        """
+        for i in range(n_out):
+            self.update(id, 0)
+        for i in range(n_in):
+            self.update(id, position)
+
 
 class FuzzyLogicController(Controller):
-    def __init__(self, log=False):
+    """
+    Controller extending the green light according to the fuzzy control system.
+    Setting lookup answers the fuzzy control system from its precomputed control surface.
+    backend is the name of the fuzzy control system backend or inference engine (see
+    register_backend: 'skfuzzy', 'mamdani' or 'sugeno'), definition the membership
+    functions and rules of its control system (the backend default if None).
+    """
+
+    def __init__(self, log=False, lookup=False, backend='skfuzzy', definition=None):
         super().__init__(log=log)
         # map light_state -> lane_id to keep track of which lane is green or not
         self.mapState = {}
-        # car_in, car_out metrics used to compute Arrival and Queue 
-        self.metrics = {
-            State.green: {
-                'in': 0,
-                'out': 0
-            },
-            State.amber: {  # this is treated as a buffer
-                'in': 0,
-                'out': 0
-            },
-            State.red: {
-                'in': 0,
-                'out': 0
-            }
-        }
+        # car_in, car_out metrics used to compute Arrival and Queue, by light state of the
+        # lane (only the vehicles of a green lane go out; amber is treated as a buffer)
+        self.green_in = 0
+        self.green_out = 0
+        self.amber_in = 0
+        self.red_in = 0
         # buffer for the state switch
         self.buffer = 0
         # control variable to avoid lane starvation 
         self.extended_to_max = False
+        # extension of the green light at the last step (None if not extended)
+        self.last_extension = None
 		# fuzzy logic 
-        self.fuzzy = TLFC()
+        if definition is None:
+            self.fuzzy = load_backend(backend)(lookup=lookup)
+        else:
+            self.fuzzy = load_backend(backend)(lookup=lookup, definition=definition)
 
     def get_arrival(self):
         """
         Returns the Arrival value.
         """
-        return self.metrics[State.green]['in'] - self.metrics[State.green]['out']
+        return self.green_in - self.green_out
 
     def get_queue(self):
         """
         Returns the Queue value.
         """
-        return self.metrics[State.red]['in']
+        return self.red_in
 
     def refresh(self):
         """
@@ -161,7 +278,7 @@ class FuzzyLogicController(Controller):
         """
         queue = self.get_arrival()
         self.buffer = queue
-        # self.metrics[State.red]['in'] = queue
+        # self.red_in = queue
 
     def switch_red(self):
         """
@@ -169,12 +286,12 @@ class FuzzyLogicController(Controller):
         converting waiting vehicles in current red lane to arrival
         """
         arrival = self.get_queue()
-        self.metrics[State.green]['in'] = arrival
-        self.metrics[State.green]['out'] = 0  # metrics[red][out]
-        self.metrics[State.red]['in'] = self.buffer + self.metrics[State.amber]['in']
+        self.green_in = arrival
+        self.green_out = 0  # red out
+        self.red_in = self.buffer + self.amber_in
         # reset the buffers
         self.buffer = 0
-        self.metrics[State.amber]['in'] = 0
+        self.amber_in = 0
 
     def add_traffic_light(self, tlight, lane_id):
         super().add_traffic_light(tlight, lane_id)
@@ -187,21 +304,49 @@ class FuzzyLogicController(Controller):
         2) extend its duration with the right amount, depending on the Arrival 
             and the Queue variables
         """
-        super().update(lane_id, position)
+        if position == 0:
+            self.update_batch(lane_id, 0, 1, position)
+        else:
+            self.update_batch(lane_id, 1, 0, position)
 
+    def update_batch(self, lane_id, n_in, n_out, position):
+        """
+        Updates the metrics of the lane with the vehicles detected at a step.
+        """
         state = self.lights[lane_id].state
         # update metrics 
-        if position == 0:
-            assert state == State.green, "car crossing while amber/red light"
-            self.metrics[state]['out'] += 1
-        else:
-            self.metrics[state]['in'] += 1
+        if n_out:
+            if state != State.green:
+                raise LightsDesynchronized('car crossing while amber/red light')
+            self.green_out += n_out
+        if n_in:
+            if state == State.green:
+                self.green_in += n_in
+            elif state == State.red:
+                self.red_in += n_in
+            else:
+                self.amber_in += n_in
         # print('[FLC] arrival: {} queue: {}'.format(self.get_arrival(), self.get_queue()))
         # compute the extend period based on arrival and queue metrics
 
-    def extend(self):
+    def dump_state(self):
+        return {
+            'metrics': [self.green_in, self.green_out, self.amber_in, self.red_in],
+            'buffer': self.buffer,
+            'extended_to_max': self.extended_to_max,
+        }
+
+    def load_state(self, state):
+        if state is not None:
+            self.green_in, self.green_out, self.amber_in, self.red_in = state['metrics']
+            self.buffer = state['buffer']
+            self.extended_to_max = state['extended_to_max']
+        self.refresh()
+
+    def extend(self, extension=None):
         """
         Extend the time of the green light (and the red light) according to the value retured by the Fuzzy Control System.
+        The extension can be given if it was already computed for the current Queue and Arrival values.
         """
         # id of the lane with green and red light on
         greenL = self.mapState[State.green]
@@ -209,7 +354,14 @@ class FuzzyLogicController(Controller):
         assert greenL is not None, 'no green light'
 
         if not self.extended_to_max:
-            extension = np.rint(self.fuzzy.get_extension(self.get_queue(), self.get_arrival()))
+            if redL is None:
+                raise LightsDesynchronized('no red light')
+            if extension is None:
+                t = probe.start()
+                extension = self.fuzzy.get_extension(self.get_queue(), self.get_arrival())
+                probe.stop('fuzzy', t)
+            extension = round(extension)
+            self.last_extension = extension
             green_clock = self.lights[greenL].clocks[State.green]
             green_clock = min(20, green_clock + extension)
             self.extended_to_max = True if green_clock == 20 else False
@@ -221,13 +373,47 @@ class FuzzyLogicController(Controller):
             self.lights[redL].clocks[State.red] = red_clock
             self.lights[greenL].clocks[State.green] = green_clock
 
-    def step(self):
+    def quiet_steps(self):
+        """
+        Metrics are updated when a light switches, only the steps before the next switch 
+        can be skipped. While a lane is green and the extension is not at its maximum, the 
+        green light is extended at each step: no step can be skipped unless the extension 
+        is 0 (metrics do not change while no vehicle is detected).
+        """
+        greenLane = self.mapState[State.green]
+        if greenLane is not None and not self.extended_to_max:
+            t = probe.start()
+            extension = round(self.fuzzy.get_extension(self.get_queue(), self.get_arrival()))
+            probe.stop('fuzzy', t)
+            if extension != 0:
+                return 0
+        return int(min(light.clocks[light.state] for light in self.lights.values())) - 1
+
+    def advance(self, steps):
+        super().advance(steps)
+        self.refresh()
+
+    def prepare(self):
+        """
+        First half of step: steps the lights, and returns the (Queue, Arrival) inputs of
+        the fuzzy control system if the green light is extended at this step, None otherwise.
+        The extensions of many controllers can then be computed at once before calling complete.
+        """
         super().step()
+        if self.mapState[State.green] is not None and not self.extended_to_max:
+            return self.get_queue(), self.get_arrival()
+        return None
+
+    def complete(self, extension=None):
+        """
+        Second half of step, given the extension computed for the inputs returned by prepare.
+        """
+        self.last_extension = None
         # if there has been a switch, reset metrics properly
         greenLane = self.mapState[State.green]
         redLane = self.mapState[State.red]
         if greenLane is not None:
-            self.extend()
+            self.extend(extension)
             if self.lights[greenLane].state != State.green:
                 # green light turned amber
                 # print('[FLC] green -> amber')
@@ -238,3 +424,179 @@ class FuzzyLogicController(Controller):
             # print('[FLC] red -> green')
             self.switch_red()
         self.refresh()
+
+    def step(self):
+        inputs = self.prepare()
+        if inputs is None:
+            self.complete()
+        else:
+            t = probe.start()
+            extension = self.fuzzy.get_extension(*inputs)
+            probe.stop('fuzzy', t)
+            self.complete(extension)
+
+
+class PhaseController(Controller):
+    """
+    Controller cycling through phases, groups of lanes whose lights are green together.
+    The phases are green one at a time in the order of their registration: green for
+    green_t steps, amber for amber_t steps, then the next phase turns green; the lights
+    of the other phases are red.
+    A single phase clock is decreased at each step and the lights are only updated when a
+    phase switches, so a step costs the same whatever the number of lanes. The phase of
+    each lane and the lanes of each phase are indexed, and the sensor metrics are kept by
+    phase: the Arrival of the green phase and the Queue of the next phase (number of
+    vehicles between the sensors of their lanes) drive the fuzzy extension if enabled.
+    Constructor parameters:
+        green_t (int): green time of a phase
+        amber_t (int): amber time of a phase
+        fuzzy   (bool): extend the green time of the phases with the fuzzy control system
+        lookup  (bool): answer the fuzzy control system from its control surface
+        backend (String): fuzzy control system backend (see register_backend)
+    """
+
+    def __init__(self, green_t=11, amber_t=4, log=False, fuzzy=False, lookup=False, backend='skfuzzy'):
+        super().__init__(log=log)
+        self.green_t = green_t
+        self.amber_t = amber_t
+        # phases in cycle order, phase -> lane ids and lane id -> phase
+        self.phases = []
+        self.phase_lanes = {}
+        self.lane_phase = {}
+        # index of the current phase, its state (green or amber) and clock
+        self.current = 0
+        self.state = State.green
+        self.clock = green_t
+        # steps since the current phase turned green
+        self.elapsed = 0
+        # phase -> {'in', 'out'} counts of the vehicles detected by the sensors of its lanes
+        self.metrics = {}
+        # control variable to avoid lane starvation
+        self.extended_to_max = False
+        self.fuzzy = load_backend(backend)(lookup=lookup) if fuzzy else None
+
+    def add_traffic_light(self, tlight: TrafficLight, lane_id, phase=None):
+        """
+        Register the given traffic light to this controller, in the given phase (a new
+        phase of its own if None). The state of the light is set to the one of its phase.
+        """
+        if phase is None:
+            phase = ('lane', lane_id)
+        if phase not in self.phase_lanes:
+            self.phases.append(phase)
+            self.phase_lanes[phase] = []
+            self.metrics[phase] = {'in': 0, 'out': 0}
+        self.phase_lanes[phase].append(lane_id)
+        self.lane_phase[lane_id] = phase
+        self.lights[lane_id] = tlight
+        tlight.state = self.state if phase == self.phases[self.current] else State.red
+
+    def __set_state(self, phase, state):
+        for lane_id in self.phase_lanes[phase]:
+            self.lights[lane_id].state = state
+
+    def occupancy(self, phase):
+        """
+        Returns the number of vehicles between the sensors of the lanes of the phase.
+        """
+        return self.metrics[phase]['in'] - self.metrics[phase]['out']
+
+    def get_arrival(self):
+        """
+        Returns the Arrival value: vehicles between the sensors of the green phase.
+        """
+        return self.occupancy(self.phases[self.current])
+
+    def get_queue(self):
+        """
+        Returns the Queue value: vehicles between the sensors of the next phase.
+        """
+        return self.occupancy(self.phases[(self.current + 1) % len(self.phases)])
+
+    def update(self, lane_id, position):
+        phase = self.lane_phase[lane_id]
+        if position == 0:
+            assert self.lights[lane_id].state == State.green, "car crossing while amber/red light"
+            self.metrics[phase]['out'] += 1
+        else:
+            self.metrics[phase]['in'] += 1
+
+    def update_batch(self, lane_id, n_in, n_out, position):
+        metrics = self.metrics[self.lane_phase[lane_id]]
+        if n_out:
+            assert self.lights[lane_id].state == State.green, "car crossing while amber/red light"
+            metrics['out'] += n_out
+        metrics['in'] += n_in
+
+    def dump_state(self):
+        return {
+            'current': self.current,
+            'state': int(self.state),
+            'clock': self.clock,
+            'elapsed': self.elapsed,
+            'metrics': [dict(self.metrics[phase]) for phase in self.phases],
+            'extended_to_max': self.extended_to_max,
+        }
+
+    def load_state(self, state):
+        if state is not None:
+            self.current = state['current']
+            self.state = State(state['state'])
+            self.clock = state['clock']
+            self.elapsed = state['elapsed']
+            for phase, metrics in zip(self.phases, state['metrics']):
+                self.metrics[phase] = dict(metrics)
+            self.extended_to_max = state['extended_to_max']
+        # the lights follow the phases
+        for i, phase in enumerate(self.phases):
+            self.__set_state(phase, self.state if i == self.current else State.red)
+
+    def extend(self):
+        """
+        Extend the green time of the current phase according to the value returned by the Fuzzy Control System,
+        a phase is green for at most 20 steps.
+        """
+        if not self.extended_to_max:
+            t = probe.start()
+            extension = round(self.fuzzy.get_extension(self.get_queue(), self.get_arrival()))
+            probe.stop('fuzzy', t)
+            self.clock = min(20 - self.elapsed, self.clock + extension)
+            self.extended_to_max = self.clock == 20 - self.elapsed
+
+    def step(self):
+        """
+        This function has to be called at each timestep to simulate time.
+        """
+        if not self.phases:
+            return
+        self.clock -= 1
+        self.elapsed += 1
+        if self.clock == 0:
+            phase = self.phases[self.current]
+            if self.state == State.green:
+                self.state = State.amber
+                self.clock = self.amber_t
+                self.__set_state(phase, State.amber)
+            else:
+                self.__set_state(phase, State.red)
+                self.current = (self.current + 1) % len(self.phases)
+                self.state = State.green
+                self.clock = self.green_t
+                self.elapsed = 0
+                self.extended_to_max = False
+                self.__set_state(self.phases[self.current], State.green)
+            if self.log:
+                logger.debug('phase %s: %s', self.phases[self.current], self.state)
+        elif self.fuzzy is not None and self.state == State.green:
+            self.extend()
+
+    def quiet_steps(self):
+        """
+        The lights are driven by the phase clock instead of their own clocks, which the lanes
+        rely on to skip steps: no step can be skipped.
+        """
+        return 0
+
+    def advance(self, steps):
+        for i in range(steps):
+            self.step()
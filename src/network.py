@@ -0,0 +1,289 @@
+"""
+Road network of intersections on a grid, steppable as a whole or by column strips in
+worker processes.
+"""
+import random
+import sys
+import time
+from getopt import gnu_getopt, GetoptError
+from multiprocessing import Pipe, Process
+from models import Controller, State, FuzzyLogicController
+from road import Vehicle, Lane
+from stats import WaitStats
+
+
+class Intersection(object):
+    """
+    Intersection of a North-to-South and a West-to-East lane with its own controller,
+    as in simulation.py.
+    Constructor parameters:
+        row (int): row of the intersection in the grid
+        col (int): column of the intersection in the grid
+        fuzzy   (bool): fuzzy logic controller if True, fixed-time controller otherwise
+        lookup  (bool): answer the fuzzy controller from its control surface
+        lane_type   (class): road.Lane or arraylane.ArrayLane
+        S   (int): size of the lanes
+        D   (int): distance between the sensors
+    """
+    def __init__(self, row, col, fuzzy=False, lookup=False, lane_type=Lane, S=15, D=7):
+        self.row = row
+        self.col = col
+        self.control = FuzzyLogicController(lookup=lookup) if fuzzy else Controller()
+        self.north2south = lane_type(self.control, S=S, D=D, name='North to South', init_state=State.green)
+        self.west2east = lane_type(self.control, S=S, D=D, name='West to East', init_state=State.red)
+
+    def step(self):
+        self.control.step()
+        self.north2south.step()
+        self.west2east.step()
+
+
+class Network(object):
+    """
+    Grid of rows x cols intersections. The vehicles leaving the West-to-East lane of an
+    intersection enter the West-to-East lane of the intersection on its east, the vehicles
+    leaving the North-to-South lane enter the North-to-South lane of the intersection on its
+    south (they are lost if that lane is full). Vehicles arrive from outside the network on
+    the lanes of the west column and of the north row, and leave it from the east column
+    and the south row.
+    A vehicle leaving a lane enters the downstream lane at the next step.
+    A Network can hold only the columns first to last - 1 of the grid (a partition): the
+    vehicles entering its west column from the previous partition are then passed to step,
+    which returns the vehicles leaving its east column.
+    Each source of arrivals has its own random stream derived from the seed and its place in
+    the grid, so the results do not depend on the partitioning.
+    Constructor parameters:
+        rows    (int): number of rows of the grid
+        cols    (int): number of columns of the grid
+        columns (tuple): (first, last) columns held by this network, the whole grid if None
+        probabilities   (tuple): arrival probability at each step on the North-to-South and West-to-East lanes
+        seed    (int): seed of the random streams
+        fuzzy, lookup, lane_type, S, D: parameters of the intersections
+    """
+    def __init__(self, rows, cols, columns=None, probabilities=(0.5, 0.2), seed=0, fuzzy=False, lookup=False,
+                 lane_type=Lane, S=15, D=7):
+        self.rows = rows
+        self.cols = cols
+        self.first, self.last = columns if columns is not None else (0, cols)
+        self.probabilities = probabilities
+        self.grid = [[Intersection(r, c, fuzzy, lookup, lane_type, S, D) for c in range(self.first, self.last)]
+                     for r in range(rows)]
+        # random streams of the arrivals from outside the network: (lane, probability, rng)
+        self.sources = []
+        for c in range(self.first, self.last):
+            self.sources.append((self.grid[0][c - self.first].north2south, probabilities[0],
+                                 random.Random('{}-n2s-{}'.format(seed, c))))
+        if self.first == 0:
+            for r in range(rows):
+                self.sources.append((self.grid[r][0].west2east, probabilities[1],
+                                     random.Random('{}-w2e-{}'.format(seed, r))))
+        # links (upstream lane, downstream lane or None, row of the next partition or None)
+        self.links = []
+        for r in range(rows):
+            for i, intersection in enumerate(self.grid[r]):
+                south = self.grid[r + 1][i].north2south if r + 1 < rows else None
+                east = self.grid[r][i + 1].west2east if i + 1 < len(self.grid[r]) else None
+                boundary = r if east is None and self.last < cols else None
+                self.links.append((intersection.north2south, south, None))
+                self.links.append((intersection.west2east, east, boundary))
+        # car_out of each lane already passed downstream
+        self.sent = {id(lane): 0 for lane, downstream, boundary in self.links}
+        # vehicles passed downstream at the previous step
+        self.pending = []
+        ## metrics
+        # vehicles entering and leaving the network, and lost at a full lane
+        self.entered = 0
+        self.exited = 0
+        self.blocked = 0
+        self.steps = 0
+
+    def __enter_lane(self, lane, n):
+        # returns the number of vehicles which entered the lane, the others are blocked
+        entered = 0
+        for i in range(n):
+            if lane.append(Vehicle()):
+                entered += 1
+            else:
+                self.blocked += 1
+        return entered
+
+    def step(self, inflow=None):
+        """
+        Simulates one step of the network. inflow is, for each row, the number of vehicles
+        entering the west column from the previous partition (left by its east column at the
+        previous step). Returns, for each row, the number of vehicles leaving the east column.
+        """
+        # arrivals from outside the network
+        for lane, p, rng in self.sources:
+            if rng.uniform(0, 1) >= 1 - p:
+                self.entered += self.__enter_lane(lane, 1)
+        # vehicles that left their lane at the previous step
+        if inflow is not None:
+            for r, n in enumerate(inflow):
+                self.__enter_lane(self.grid[r][0].west2east, n)
+        for lane, n in self.pending:
+            self.__enter_lane(lane, n)
+        for row in self.grid:
+            for intersection in row:
+                intersection.step()
+        # vehicles leaving their lane
+        self.pending = []
+        outflow = [0] * self.rows
+        for lane, downstream, boundary in self.links:
+            n = lane.car_out - self.sent[id(lane)]
+            if n:
+                self.sent[id(lane)] = lane.car_out
+                if downstream is not None:
+                    self.pending.append((downstream, n))
+                elif boundary is not None:
+                    # to the next partition
+                    outflow[boundary] += n
+                else:
+                    self.exited += n
+        self.steps += 1
+        return outflow
+
+    def run(self, steps):
+        for i in range(steps):
+            self.step()
+        return self.summary()
+
+    def summary(self):
+        """
+        Returns the metrics of the network: steps, vehicles entered, exited and blocked,
+        car_in, car_out and total_wait of all the lanes and their waiting time statistics.
+        """
+        stats = WaitStats()
+        s = {'steps': self.steps, 'entered': self.entered, 'exited': self.exited, 'blocked': self.blocked,
+             'car_in': 0, 'car_out': 0, 'total_wait': 0}
+        for row in self.grid:
+            for intersection in row:
+                for lane in (intersection.north2south, intersection.west2east):
+                    s['car_in'] += lane.car_in
+                    s['car_out'] += lane.car_out
+                    s['total_wait'] += lane.total_wait
+                    stats.merge(lane.stats)
+        s['wait_stats'] = stats.to_dict()
+        return s
+
+
+def merge_summaries(summaries):
+    """
+    Merges the summaries of the partitions of a network.
+    """
+    merged = {'steps': summaries[0]['steps']}
+    for key in ('entered', 'exited', 'blocked', 'car_in', 'car_out', 'total_wait'):
+        merged[key] = sum(s[key] for s in summaries)
+    stats = WaitStats()
+    for s in summaries:
+        stats.merge(WaitStats.from_dict(s['wait_stats']))
+    merged['wait_stats'] = stats.to_dict()
+    return merged
+
+
+def strips(cols, partitions):
+    """
+    Returns the (first, last) columns of each of the partitions of a grid in column strips.
+    """
+    bounds = [round(i * cols / partitions) for i in range(partitions + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(partitions) if bounds[i] < bounds[i + 1]]
+
+
+def run_partition(rows, cols, columns, options, steps, inbound, outbound, results):
+    """
+    Worker process stepping the partition of the given columns. At each step, it receives
+    from inbound the vehicles that left the previous partition at the previous step, and
+    sends to outbound the vehicles leaving its east column. The summary is sent to results.
+    """
+    network = Network(rows, cols, columns=columns, **options)
+    for t in range(steps):
+        inflow = inbound.recv() if inbound is not None and t > 0 else None
+        outflow = network.step(inflow)
+        if outbound is not None and t < steps - 1:
+            outbound.send(outflow)
+    results.send(network.summary())
+    results.close()
+
+
+def run_parallel(rows, cols, steps, partitions, **options):
+    """
+    Simulates a grid of rows x cols intersections for the given number of steps, split in
+    column strips stepped by as many worker processes. Neighbour partitions only exchange,
+    at each step, the number of vehicles crossing their boundary on each row.
+    Returns the same summary as Network.run.
+    """
+    columns = strips(cols, partitions)
+    # pipe from each partition to the next one
+    pipes = [Pipe(duplex=False) for i in range(len(columns) - 1)]
+    workers = []
+    for i, c in enumerate(columns):
+        inbound = pipes[i - 1][0] if i > 0 else None
+        outbound = pipes[i][1] if i < len(pipes) else None
+        receiver, sender = Pipe(duplex=False)
+        worker = Process(target=run_partition, args=(rows, cols, c, options, steps, inbound, outbound, sender))
+        worker.start()
+        workers.append((worker, receiver))
+    summaries = [receiver.recv() for worker, receiver in workers]
+    for worker, receiver in workers:
+        worker.join()
+    return merge_summaries(summaries)
+
+
+def usage():
+    s = "usage: network.py [OPTIONS]\n"
+    s+= "Simulates a grid of intersections.\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-r INT\n\t number of rows of the grid (default 10)\n"
+    s+= "-c INT\n\t number of columns of the grid (default 10)\n"
+    s+= "-t INT\n\t number of steps (default 1000)\n"
+    s+= "-s 'fixed' or 'fuzzy'\n\t controllers of the intersections (default fixed)\n"
+    s+= "-j INT\n\t number of partitions (column strips) stepped by worker processes\n"
+    s+= "-a\n\t use the array-backed lanes (arraylane.ArrayLane)\n"
+    s+= "--seed INT\n\t seed of the arrivals\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    rows, cols, steps, partitions = 10, 10, 1000, 1
+    options = {}
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hr:c:t:s:j:a', ['seed='])
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-r':
+                rows = int(arg)
+            elif opt == '-c':
+                cols = int(arg)
+            elif opt == '-t':
+                steps = int(arg)
+            elif opt == '-s':
+                if arg not in ('fixed', 'fuzzy'):
+                    raise GetoptError('unknown controller')
+                options['fuzzy'] = arg == 'fuzzy'
+            elif opt == '-j':
+                partitions = int(arg)
+            elif opt == '-a':
+                from arraylane import ArrayLane
+                options['lane_type'] = ArrayLane
+            elif opt == '--seed':
+                options['seed'] = int(arg)
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    start = time.perf_counter()
+    if partitions > 1:
+        summary = run_parallel(rows, cols, steps, partitions, **options)
+    else:
+        summary = Network(rows, cols, **options).run(steps)
+    wall_time = time.perf_counter() - start
+    stats = WaitStats.from_dict(summary.pop('wait_stats')).summary(summary['steps'])
+    for key, value in summary.items():
+        print('{:<12} {}'.format(key, value))
+    if stats['vehicles']:
+        print('wait time: mean {:.2f}, P50 {:.1f}, P95 {:.1f}, P99 {:.1f}, max {}'.format(
+            stats['mean'], stats['p50'], stats['p95'], stats['p99'], stats['max']))
+    print('{:.0f} intersection steps/s'.format(rows * cols * steps / wall_time))
@@ -0,0 +1,249 @@
+"""
+Per-step traces of a simulation for offline playback: the occupancy of the lanes (bitmaps),
+the states and clocks of their lights, and the inputs and extension of the controller,
+written to a directory of compressed NumPy chunks which can be read back step by step.
+"""
+import bisect
+import json
+import math
+import os
+import sys
+from getopt import gnu_getopt, GetoptError
+import numpy as np
+from models import State
+
+# metadata file of a trace directory
+META = 'trace.json'
+
+
+class TraceWriter(object):
+    """
+    Records the state of an intersection at each step, by chunks of steps saved as
+    compressed .npz files. The metadata (lanes, chunks) is rewritten with each chunk, so
+    that a trace is readable even if the run does not close it.
+    With ring, only the last ring steps are kept on disk: the steps of a new chunk beyond
+    the ring are not written, the oldest chunks are dropped and the oldest chunk kept is
+    trimmed to its last steps. The chunk size does not depend on the ring, so that a small
+    ring is still written once every chunk steps (the last steps are buffered in memory
+    until then), and trimming never rewrites more than a chunk.
+    Constructor parameters:
+        path    (String): directory of the trace, created if missing
+        control (Controller): controller of the intersection
+        lanes   (list): lanes of the intersection (road.Lane or arraylane.ArrayLane)
+        chunk   (int): number of steps of a chunk
+        ring    (int): number of last steps kept (None keeps every step)
+    """
+    def __init__(self, path, control, lanes, chunk=4096, ring=None):
+        self.path = path
+        self.control = control
+        self.lanes = lanes
+        self.chunk = chunk
+        self.ring = ring
+        os.makedirs(path, exist_ok=True)
+        self.sizes = [len(lane.occupancy()) for lane in lanes]
+        width = (max(self.sizes) + 7) // 8
+        n = len(lanes)
+        # buffers of the current chunk
+        self.step = np.zeros(chunk, dtype=np.int64)
+        self.occupancy = np.zeros((chunk, n, width), dtype=np.uint8)
+        self.state = np.zeros((chunk, n), dtype=np.int8)
+        self.clock = np.zeros((chunk, n), dtype=np.int16)
+        self.arrival = np.zeros(chunk, dtype=np.int16)
+        self.queue = np.zeros(chunk, dtype=np.int16)
+        self.extension = np.zeros(chunk, dtype=np.float32)
+        self.rows = 0
+        # [index, first step, last step, rows] of the chunks on disk
+        self.chunks = []
+        self.index = 0
+
+    def record(self, step):
+        """
+        Records the state of the intersection at the given step (after it was simulated).
+        The steps must be recorded in increasing order, steps may be skipped.
+        """
+        i = self.rows
+        self.step[i] = step
+        for k, lane in enumerate(self.lanes):
+            bits = np.packbits(np.asarray(lane.occupancy(), dtype=bool))
+            self.occupancy[i, k, :len(bits)] = bits
+            self.state[i, k] = lane.light.state
+            self.clock[i, k] = lane.light.clocks[lane.light.state]
+        if hasattr(self.control, 'get_arrival'):
+            self.arrival[i] = self.control.get_arrival()
+            self.queue[i] = self.control.get_queue()
+        else:
+            # fixed-time controller
+            self.arrival[i] = self.queue[i] = -1
+        extension = getattr(self.control, 'last_extension', None)
+        self.extension[i] = math.nan if extension is None else extension
+        self.rows += 1
+        if self.rows == self.chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Saves the steps recorded since the last chunk as a new chunk.
+        """
+        n = self.rows
+        if n == 0:
+            return
+        # with a ring smaller than the chunk, only the last ring steps are written
+        i = max(n - self.ring, 0) if self.ring is not None else 0
+        np.savez_compressed(os.path.join(self.path, chunk_name(self.index)), step=self.step[i:n],
+                            occupancy=self.occupancy[i:n], state=self.state[i:n], clock=self.clock[i:n],
+                            arrival=self.arrival[i:n], queue=self.queue[i:n], extension=self.extension[i:n])
+        self.chunks.append([self.index, int(self.step[i]), int(self.step[n - 1]), n - i])
+        self.index += 1
+        self.rows = 0
+        if self.ring is not None:
+            # drop the oldest chunks while the others hold the last ring steps
+            while len(self.chunks) > 1 and sum(c[3] for c in self.chunks[1:]) >= self.ring:
+                os.remove(os.path.join(self.path, chunk_name(self.chunks.pop(0)[0])))
+            excess = sum(c[3] for c in self.chunks) - self.ring
+            if excess > 0:
+                self.__trim(self.chunks[0], excess)
+        meta = {
+            'lanes': [lane.name for lane in self.lanes],
+            'sizes': self.sizes,
+            'controller': type(self.control).__name__,
+            'chunks': self.chunks,
+        }
+        with open(os.path.join(self.path, META), 'w') as f:
+            json.dump(meta, f)
+
+    def __trim(self, chunk, rows):
+        # drops the first rows of a chunk on disk
+        name = os.path.join(self.path, chunk_name(chunk[0]))
+        with np.load(name) as data:
+            arrays = {key: data[key][rows:] for key in data.files}
+        np.savez_compressed(name, **arrays)
+        chunk[1] = int(arrays['step'][0])
+        chunk[3] -= rows
+
+    def close(self):
+        self.flush()
+
+
+def chunk_name(index):
+    return 'chunk-{:06d}.npz'.format(index)
+
+
+class TraceReader(object):
+    """
+    Reads a trace written by TraceWriter. Only the chunk holding the requested step is
+    loaded, so any step of a long trace can be read at once.
+    reader[step] returns the state recorded at the last step at or before the given one
+    (steps skipped by the next-event time advance return the state of the step before).
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+        self.lanes = meta['lanes']
+        self.sizes = meta['sizes']
+        self.controller = meta['controller']
+        self.chunks = meta['chunks']
+        self.firsts = [c[1] for c in self.chunks]
+        # last chunk loaded
+        self.loaded = None
+        self.data = None
+
+    @property
+    def first(self):
+        """
+        First step of the trace (later than 0 for a ring trace).
+        """
+        return self.chunks[0][1]
+
+    @property
+    def last(self):
+        return self.chunks[-1][2]
+
+    def __len__(self):
+        return sum(c[3] for c in self.chunks)
+
+    def __load(self, k):
+        if self.loaded != k:
+            with np.load(os.path.join(self.path, chunk_name(self.chunks[k][0]))) as data:
+                self.data = {name: data[name] for name in data.files}
+            self.loaded = k
+
+    def __getitem__(self, step):
+        if not self.chunks or step < self.first:
+            raise IndexError('step {} not in the trace'.format(step))
+        k = bisect.bisect_right(self.firsts, step) - 1
+        self.__load(k)
+        data = self.data
+        i = int(np.searchsorted(data['step'], step, side='right')) - 1
+        extension = float(data['extension'][i])
+        return {
+            'step': int(data['step'][i]),
+            'occupancy': [np.unpackbits(data['occupancy'][i, l])[:size].astype(bool)
+                          for l, size in enumerate(self.sizes)],
+            'states': [State(int(s)) for s in data['state'][i]],
+            'clocks': data['clock'][i].tolist(),
+            'arrival': int(data['arrival'][i]),
+            'queue': int(data['queue'][i]),
+            'extension': None if math.isnan(extension) else extension,
+        }
+
+    def steps(self, start=None, stop=None):
+        """
+        Yields the recorded states of the steps from start (included) to stop (excluded).
+        """
+        start = self.first if start is None else max(start, self.first)
+        stop = self.last + 1 if stop is None else stop
+        for k, (index, first, last, rows) in enumerate(self.chunks):
+            if last < start or first >= stop:
+                continue
+            self.__load(k)
+            for step in self.data['step'].tolist():
+                if start <= step < stop:
+                    yield self[step]
+
+    def render(self, step):
+        """
+        Returns a text picture of the lanes at a step: one line per lane, from position 0
+        (the light) to the end of the lane, '#' for a vehicle.
+        """
+        state = self[step]
+        lines = ['step {} arrival {} queue {} extension {}'.format(state['step'], state['arrival'],
+                                                                   state['queue'], state['extension'])]
+        for name, cells, light, clock in zip(self.lanes, state['occupancy'], state['states'], state['clocks']):
+            lines.append('{:<16} {:<5} {:>2} |{}'.format(name, light.name, clock,
+                                                          ''.join('#' if c else '.' for c in cells)))
+        return '\n'.join(lines)
+
+
+def usage():
+    s = "usage: recorder.py [OPTIONS] DIRECTORY\n"
+    s+= "Prints the steps of a trace recorded by simulation.py --trace.\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-s INT\n\t first step printed (default: first step of the trace)\n"
+    s+= "-n INT\n\t number of steps printed (default 1)\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    start, count = None, 1
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hs:n:')
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-s':
+                start = int(arg)
+            elif opt == '-n':
+                count = int(arg)
+        if len(args) != 1:
+            raise GetoptError('no trace directory')
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    reader = TraceReader(args[0])
+    start = reader.first if start is None else start
+    for state in reader.steps(start, start + count):
+        print(reader.render(state['step']))
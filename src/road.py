@@ -1,5 +1,6 @@
 from models import TrafficLight, Controller, State
 from collections import deque
+from stats import WaitStats
 
 class Vehicle(object):
     """
@@ -25,18 +26,22 @@ class Lane(object):
         name    (String): name of the lane
         init_state  (State): initial state of the traffic light
         controller  (Controller): controller of the system
+        phase   : phase of the lane, for a models.PhaseController
     """
-    def __init__(self, controller: Controller,S=50, name='lane', D=15,init_state=State.green):
+    def __init__(self, controller: Controller,S=50, name='lane', D=15,init_state=State.green, phase=None):
         self.lane = deque([None for i in range(S)], S)
-        self.v = [] # contains the actual vehicles
+        self.v = deque() # contains the actual vehicles, first one ahead
         self.name = name
         self.id = hash(self.name) 
         self.controller = controller
         self.D = D
         # traffic light
         self.light = TrafficLight(init_state=init_state)
-        # register the light to the controller
-        self.controller.add_traffic_light(self.light, self.id)
+        # register the light to the controller (in the given phase for a PhaseController)
+        if phase is None:
+            self.controller.add_traffic_light(self.light, self.id)
+        else:
+            self.controller.add_traffic_light(self.light, self.id, phase=phase)
         ## metrics 
         # number of cars entering the sensed area
         self.car_in = 0
@@ -44,12 +49,15 @@ class Lane(object):
         self.car_out = 0
         # total waiting time
         self.total_wait = 0
+        # waiting time statistics of the vehicles going out
+        self.stats = WaitStats()
 
     def append(self, v: Vehicle):
         """
         Add a new vehicle to the lane.
         When a new vehicle is added to the lane, it is appended right after the second sensor except if 
         there already are some vehicles after the second sensor, in which case the new vehicle is appended after the last vehicle.
+        Returns False if the lane is full and the vehicle could not be added.
         """
         if len(self.v) == 0:
             # no vehicles, insert in position D + 1
@@ -62,7 +70,7 @@ class Lane(object):
             if pos_last_v == len(self.lane)-1:
                 # maximum capacity
                 #print('[{}] maximum capacity !'.format(self.name))
-                return 
+                return False
             elif pos_last_v >= self.D+1: 
                 v.position = pos_last_v+1
                 self.lane[v.position] = v
@@ -71,9 +79,7 @@ class Lane(object):
                 v.position  = self.D+1 
                 self.lane[ v.position] = v
                 self.v.append(v)
-
-    def __notify_controller(self, position):
-        self.controller.update(self.id, position)
+        return True
 
     def __ride(self, v: Vehicle):
         """
@@ -86,12 +92,11 @@ class Lane(object):
             # out of sensored area
             self.car_out += 1 
             self.total_wait += v.wait 
+            self.stats.add(v.wait)
             remove = True#self.v.remove(v)
-            self.__notify_controller(0)
         elif v.position == self.D:
             # in sensored area
             self.car_in += 1
-            self.__notify_controller(self.D)
         return remove
 
     def step(self):
@@ -102,18 +107,17 @@ class Lane(object):
         If the light is amber or red, a vehicle rides forward if there are no vehicles in front of it and 
         if the vehicle is not in position 0, otherwise it waits.
         When a vehicle reaches position 0, it is removed from the lane.
+        The vehicles detected by the sensors at this step are notified to the controller at once.
         """
-        
+        car_in, car_out = self.car_in, self.car_out
         if self.light.state == State.green:
             #green light, everyone moves forward
             #print("[{}] green light, everyone moves forward".format(self.name))
             
             # update structure
-            remove = [False for i in range(len(self.v))]
-            for i in range(len(self.v)):
-                remove[i] = self.__ride(self.v[i])
+            remove = [self.__ride(v) for v in self.v]
             if len(remove) > 0 and remove[0]:
-                self.v.pop(0)
+                self.v.popleft()
             # shift list 1 index to the left
             self.lane[1] = None 
             self.lane.rotate(-1)
@@ -135,8 +139,68 @@ class Lane(object):
                     else:
                         # car ahead, this car has to wait
                         v.wait += 1
+        if self.car_in != car_in or self.car_out != car_out:
+            self.controller.update_batch(self.id, self.car_in - car_in, self.car_out - car_out, self.D)
                     
     
+    def quiet_steps(self):
+        """
+        Returns the number of upcoming steps during which no vehicle moves, as long as 
+        no vehicle is added: unlimited if the lane is empty, until the light turns green 
+        if all the vehicles are queued from position 1, none otherwise.
+        """
+        if len(self.v) == 0:
+            return float('inf')
+        if self.v[-1].position != len(self.v):
+            return 0
+        # every vehicle waits until the light turns green
+        return max(self.light.steps_to_green() - 1, 0)
+
+    def advance(self, steps):
+        """
+        Equivalent of calling step the given number of times, which must not 
+        exceed quiet_steps(): every (queued) vehicle waits.
+        """
+        for v in self.v:
+            v.wait += steps
+
+    def occupancy(self):
+        """
+        Returns the occupancy of the cells of the lane, by position (booleans).
+        """
+        return [c is not None for c in self.lane]
+
+    def dump_state(self):
+        """
+        Returns the state of the lane: its vehicles (position, ride, wait), light and metrics.
+        """
+        return {
+            'vehicles': [(v.position, v.ride, v.wait) for v in self.v],
+            'light': self.light.dump_state(),
+            'car_in': self.car_in,
+            'car_out': self.car_out,
+            'total_wait': self.total_wait,
+            'stats': self.stats.to_dict(),
+        }
+
+    def load_state(self, state):
+        """
+        Restores a state returned by the dump_state of a Lane or an ArrayLane of the same size.
+        """
+        self.lane = deque([None for i in range(len(self.lane))], len(self.lane))
+        self.v = deque()
+        for position, ride, wait in state['vehicles']:
+            v = Vehicle(position)
+            v.ride = ride
+            v.wait = wait
+            self.lane[position] = v
+            self.v.append(v)
+        self.light.load_state(state['light'])
+        self.car_in = state['car_in']
+        self.car_out = state['car_out']
+        self.total_wait = state['total_wait']
+        self.stats = WaitStats.from_dict(state['stats'])
+
     def __repr__(self):
         s= []
         for c in self.lane:
@@ -0,0 +1,335 @@
+"""
+Controller service: runs fuzzy logic controllers for many intersections behind a local
+socket, and a load generator client simulating the intersections.
+
+The protocol is made of JSON lines. Client to service:
+    {"op": "register", "intersection": ID, "lanes": [[LANE, STATE], ...]}
+    {"op": "sensor", "intersection": ID, "lane": LANE, "position": POSITION}
+    {"op": "tick"}
+    {"op": "stats"}
+Service to client:
+    {"op": "registered", "intersection": ID, "lights": [[LANE, STATE], ...]}
+    {"op": "lights", "tick": N, "changes": [[ID, LANE, STATE], ...], "failed": [[ID, MESSAGE], ...]}
+    {"op": "stats", "ticks": N, "intersections": N, "latency_ms": {...}}
+    {"op": "error", "message": MESSAGE}
+where STATE is 'green', 'amber' or 'red'. A sensor event is what Controller.update
+receives. The intersection IDs are those of the client, two clients may use the same.
+A tick of a client steps the intersections of that client only, and only that client
+receives the light changes. If the service ticks by itself (period), its clock is the only
+source of ticks: it steps every intersection and each client receives the light changes
+of its intersections, while a tick of a client is answered with an error.
+An intersection whose controller fails during a tick (its lights desynchronized) is listed
+in "failed" and unregistered, the other intersections are stepped normally.
+"""
+import asyncio
+import json
+import random
+import sys
+import time
+from getopt import gnu_getopt, GetoptError
+from instrument import get_logger
+from models import Controller, FuzzyLogicController, LightsDesynchronized, State, TrafficLight, load_backend
+from road import Vehicle, Lane
+from stats import Welford, QuantileSketch
+
+# default path of the service socket
+SOCKET = '/tmp/fuzzylogic.sock'
+
+logger = get_logger('service')
+
+
+class Intersection(object):
+    """
+    Controller of an intersection registered by a client, with its lights.
+    """
+    def __init__(self, control, writer):
+        self.control = control
+        self.writer = writer
+        # lane -> state of its light after the last tick
+        self.states = {}
+
+
+class ControllerService(object):
+    """
+    Service stepping the fuzzy logic controllers of the registered intersections.
+    The controllers are stepped in two halves (FuzzyLogicController.prepare and complete):
+    the extensions of all the intersections extending their green light at a tick are
+    computed with one batched inference.
+    Ticks are sent by the clients (each one stepping its own intersections), or by the
+    service itself every period seconds (for all the intersections).
+    Constructor parameters:
+        period  (float): seconds between ticks, 0 to only tick on the clients' requests
+        lookup  (bool): answer the fuzzy control system from its control surface
+    """
+    def __init__(self, period=0, lookup=False):
+        self.period = period
+        self.lookup = lookup
+        # fuzzy control system shared by the controllers for the batched inference
+        self.fuzzy = load_backend()(lookup=lookup)
+        # registered intersections, by (client writer, intersection ID)
+        self.intersections = {}
+        self.ticks = 0
+        # tick latencies (ms)
+        self.latency = Welford()
+        self.latency_sketch = QuantileSketch()
+
+    def register(self, message, writer):
+        control = FuzzyLogicController(lookup=self.lookup)
+        intersection = Intersection(control, writer)
+        for lane, state in message['lanes']:
+            light = TrafficLight(init_state=State[state])
+            control.add_traffic_light(light, lane)
+        for lane, light in control.lights.items():
+            intersection.states[lane] = light.state
+        self.intersections[(writer, message['intersection'])] = intersection
+        return {'op': 'registered', 'intersection': message['intersection'],
+                'lights': [[lane, state.name] for lane, state in intersection.states.items()]}
+
+    def tick(self, writer=None):
+        """
+        Steps the intersections of the client writer (every intersection if None) and sends
+        the light changes to their clients; the client requesting the tick receives them
+        even if none of its lights changed. An intersection whose controller fails to
+        complete the step is reported to its client and unregistered.
+        """
+        start = time.perf_counter()
+        intersections = [((w, i), intersection) for (w, i), intersection in self.intersections.items()
+                         if writer is None or w is writer]
+        inputs = [intersection.control.prepare() for i, intersection in intersections]
+        pending = [k for k, x in enumerate(inputs) if x is not None]
+        extensions = [None] * len(inputs)
+        if pending:
+            batch = self.fuzzy.get_extension_batch([inputs[k][0] for k in pending], [inputs[k][1] for k in pending])
+            for k, extension in zip(pending, batch.tolist()):
+                extensions[k] = extension
+        changes = {}
+        failed = {}
+        for ((w, i), intersection), extension in zip(intersections, extensions):
+            try:
+                intersection.control.complete(extension)
+            except (LightsDesynchronized, AssertionError) as e:
+                # this controller cannot go on, the other intersections complete their step
+                failed.setdefault(w, []).append([i, '{}: {}'.format(type(e).__name__, e)])
+                del self.intersections[(w, i)]
+                continue
+            for lane, light in intersection.control.lights.items():
+                if light.state != intersection.states[lane]:
+                    intersection.states[lane] = light.state
+                    changes.setdefault(w, []).append([i, lane, light.state.name])
+        self.ticks += 1
+        writers = {w for (w, i), intersection in intersections} if writer is None else {writer}
+        for w in writers:
+            send(w, {'op': 'lights', 'tick': self.ticks, 'changes': changes.get(w, []), 'failed': failed.get(w, [])})
+        latency = (time.perf_counter() - start) * 1e3
+        self.latency.add(latency)
+        self.latency_sketch.add(latency)
+
+    def stats(self):
+        return {'op': 'stats', 'ticks': self.ticks, 'intersections': len(self.intersections),
+                'latency_ms': latency_summary(self.latency, self.latency_sketch)}
+
+    async def handle(self, reader, writer):
+        """
+        Serves the messages of a client until it disconnects.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    op = message['op']
+                    if op == 'sensor':
+                        self.intersections[(writer, message['intersection'])].control.update(
+                            message['lane'], message['position'])
+                    elif op == 'tick':
+                        if self.period > 0:
+                            raise ValueError('the service ticks every {:g} s'.format(self.period))
+                        self.tick(writer)
+                    elif op == 'register':
+                        send(writer, self.register(message, writer))
+                    elif op == 'stats':
+                        send(writer, self.stats())
+                    else:
+                        raise ValueError('unknown operation {}'.format(op))
+                except (ValueError, KeyError, AssertionError, LightsDesynchronized) as e:
+                    send(writer, {'op': 'error', 'message': '{}: {}'.format(type(e).__name__, e)})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for key in [key for key in self.intersections if key[0] is writer]:
+                del self.intersections[key]
+            writer.close()
+
+    async def clock(self):
+        while True:
+            await asyncio.sleep(self.period)
+            try:
+                self.tick()
+            except Exception:
+                # a failed tick must not stop the clock of the other intersections
+                logger.exception('tick %s failed', self.ticks + 1)
+
+    async def serve(self, path=SOCKET, port=None):
+        if port is not None:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+        else:
+            server = await asyncio.start_unix_server(self.handle, path)
+        if self.period > 0:
+            asyncio.ensure_future(self.clock())
+        async with server:
+            await server.serve_forever()
+
+
+def send(writer, message):
+    writer.write((json.dumps(message) + '\n').encode())
+
+
+def latency_summary(moments, sketch):
+    if moments.count == 0:
+        return {}
+    return {'mean': moments.mean, 'p50': sketch.quantile(0.5), 'p95': sketch.quantile(0.95),
+            'p99': sketch.quantile(0.99), 'max': moments.max}
+
+
+class RemoteController(Controller):
+    """
+    Client side stand-in of the controller of an intersection: the sensor events of its
+    lanes are queued to be sent to the service, and its lights are set from the changes
+    sent back.
+    """
+    def __init__(self, intersection):
+        super().__init__()
+        self.intersection = intersection
+        self.events = []
+
+    def step(self):
+        # the lights are stepped by the service
+        pass
+
+    def update(self, id, position):
+        self.events.append({'op': 'sensor', 'intersection': self.intersection, 'lane': id, 'position': position})
+
+
+async def load(intersections, steps, path=SOCKET, port=None, seed=0):
+    """
+    Load generator: simulates intersections like simulation.py, whose controllers run in
+    the service, for the given number of steps. Returns the metrics of the lanes, the
+    round trip latencies of the ticks and the intersections whose controller failed in the
+    service (their simulation stops there).
+    """
+    if port is not None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(path)
+    rng = random.Random(seed)
+    controls = {}
+    lanes = []
+    for i in range(intersections):
+        control = controls[i] = RemoteController(i)
+        north2south = Lane(control, S=15, D=7, name='North to South', init_state=State.green)
+        west2east = Lane(control, S=15, D=7, name='West to East', init_state=State.red)
+        lanes.append((north2south, west2east))
+        send(writer, {'op': 'register', 'intersection': i,
+                      'lanes': [[lane.id, lane.light.state.name] for lane in (north2south, west2east)]})
+    await writer.drain()
+    for i in range(intersections):
+        reply = json.loads(await reader.readline())
+        for lane, state in reply['lights']:
+            controls[reply['intersection']].lights[lane].state = State[state]
+    latency = Welford()
+    sketch = QuantileSketch()
+    # intersection -> error of its controller
+    failed = {}
+    for step in range(steps):
+        for i, (north2south, west2east) in enumerate(lanes):
+            # the arrivals of the failed intersections are drawn too, so that the others do not change
+            if rng.uniform(0, 1) >= 0.5 and i not in failed:
+                north2south.append(Vehicle())
+            if rng.uniform(0, 1) >= 0.8 and i not in failed:
+                west2east.append(Vehicle())
+        start = time.perf_counter()
+        send(writer, {'op': 'tick'})
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        if reply['op'] != 'lights':
+            raise RuntimeError(reply)
+        for i, lane, state in reply['changes']:
+            controls[i].lights[lane].state = State[state]
+        for i, message in reply['failed']:
+            failed[i] = message
+            del controls[i]
+        elapsed = (time.perf_counter() - start) * 1e3
+        latency.add(elapsed)
+        sketch.add(elapsed)
+        for i, (north2south, west2east) in enumerate(lanes):
+            if i not in failed:
+                north2south.step()
+                west2east.step()
+        # sensor events of this step, received by the service before the next tick
+        for control in controls.values():
+            for event in control.events:
+                send(writer, event)
+            control.events = []
+    send(writer, {'op': 'stats'})
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    total_wait = sum(lane.total_wait for pair in lanes for lane in pair)
+    car_out = sum(lane.car_out for pair in lanes for lane in pair)
+    return {'car_out': car_out, 'total_wait': total_wait, 'round_trip_ms': latency_summary(latency, sketch),
+            'failed': failed, 'service': stats}
+
+
+def usage():
+    s = "usage: service.py [OPTIONS]\n"
+    s+= "Runs the controller service, or the load generator client with -c.\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-u PATH\n\t path of the unix socket (default {})\n".format(SOCKET)
+    s+= "-p PORT\n\t use a local TCP socket on PORT instead\n"
+    s+= "-t FLOAT\n\t seconds between the ticks of the service (default 0: the clients send the ticks)\n"
+    s+= "-f\n\t answer the fuzzy control system from its control surface\n"
+    s+= "-c INT\n\t run the load generator with INT intersections\n"
+    s+= "-n INT\n\t number of steps of the load generator (default 1000)\n"
+    s+= "--seed INT\n\t seed of the load generator\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    path, port, period, lookup = SOCKET, None, 0, False
+    client, steps, seed = None, 1000, 0
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hu:p:t:fc:n:', ['seed='])
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-u':
+                path = arg
+            elif opt == '-p':
+                port = int(arg)
+            elif opt == '-t':
+                period = float(arg)
+            elif opt == '-f':
+                lookup = True
+            elif opt == '-c':
+                client = int(arg)
+            elif opt == '-n':
+                steps = int(arg)
+            elif opt == '--seed':
+                seed = int(arg)
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    if client is not None:
+        print(json.dumps(asyncio.run(load(client, steps, path, port, seed)), indent=2))
+    else:
+        service = ControllerService(period, lookup)
+        try:
+            asyncio.run(service.serve(path, port))
+        except KeyboardInterrupt:
+            print(json.dumps(service.stats()))
@@ -1,8 +1,22 @@
+import logging
+import math
+import os
 import random
 import sys
-from models import Controller, State, FuzzyLogicController
+import time
+from multiprocessing import Pool
+from models import Controller, State, FuzzyLogicController, LightsDesynchronized, BACKENDS
 from road import Vehicle, Lane
 from getopt import gnu_getopt, GetoptError
+from sink import ResultSink, read_results
+from stats import WaitStats, PairedDifference
+from snapshot import capture, restore, save, load
+from instrument import configure_logging, get_logger, probe
+
+logger = get_logger('simulation')
+
+# default step limit of a simulation
+MAX_STEPS = 400
 
 
 
@@ -11,27 +25,419 @@ def usage():
     s = "usage: simulation.py [OPTIONS] \n"
     s+= "By default, simulation.py launches 1 simulation for each type of controller. \n"
     s+= "The following options may be provided:\n"
-    s+= "-l\n\t enables logs\n"
+    s+= "-l\n\t enables logs (same as --log-level debug)\n"
+    s+= "--log-level LEVEL\n\t enables the logs of LEVEL and above: debug (every step), info (every simulation), warning\n"
+    s+= "-p, --profile\n\t time the phases of the simulations and print a summary at the end\n"
     s+= "-h\n\t print this help\n"
     s+= "-n INT\n\t define the number of simulation\n"
     s+= "-s 'fixed' or 'fuzzy' \n\t launch the simulation with only fixed-time or fuzzy controller\n"
+    s+= "-a\n\t use the array-backed lanes (arraylane.ArrayLane)\n"
+    s+= "-v\n\t run all the simulations together with the lock-step engine (lockstep.LockstepSimulation),\n\t without -a, -f, -e, -j, -o, --resume, --warmup, --snapshot, --arrivals, --trace, --backend or -c\n\t (only the total wait times are reported, not the statistics of the vehicles)\n"
+    s+= "-f FILE\n\t answer the fuzzy controller from the control surface saved in FILE (.npz), created if missing\n"
+    s+= "--max-steps INT\n\t step limit of a simulation (default {}), the simulations reaching it are reported\n".format(MAX_STEPS)
+    s+= "--backend NAME\n\t inference backend of the fuzzy controller: 'skfuzzy' (default), 'mamdani' or 'sugeno' (see engines.py)\n"
+    s+= "-e, --events\n\t next-event time advance: skip the steps where nothing but the light clocks changes\n"
+    s+= "-j INT, --jobs INT\n\t number of worker processes running the simulations\n"
+    s+= "--seed INT\n\t master seed from which the seed of each simulation is derived\n"
+    s+= "-o FILE, --output FILE\n\t stream the result of each simulation to FILE (JSON lines, or CSV if FILE ends with .csv)\n"
+    s+= "--resume\n\t skip the simulations of the batch already in the output FILE (requires --seed and -o)\n"
+    s+= "--arrivals SPEC\n\t arrival processes: 'bernoulli', 'poisson', 'varying' (time-varying Poisson) or the path of a trace to replay (.npy, or raw int32 with 2 columns)\n"
+    s+= "--warmup INT\n\t warm the intersection up for INT steps (fixed-time controller, master seed) and start every simulation from there\n"
+    s+= "--snapshot FILE\n\t start every simulation from the snapshot saved in FILE, or save the --warmup snapshot to FILE if missing\n"
+    s+= "--trace DIR\n\t record the state of every step of each simulation in DIR/CONTROLLER-SEED (see recorder.py)\n"
+    s+= "--trace-ring INT\n\t only keep the last INT steps of the traces\n"
+    s+= "-c, --compare\n\t compare the controllers on pairs of simulations sharing their arrivals, until the difference\n\t of their total wait times is estimated with --precision, or is significant (confidence sequence)\n"
+    s+= "--precision FLOAT\n\t stop the comparison once the confidence interval half width is at most FLOAT\n\t (default: stop once the interval excludes 0)\n"
+    s+= "--alpha FLOAT\n\t confidence level 1 - FLOAT of the comparison interval (default 0.05)\n"
+    s+= "--max-pairs INT\n\t maximum number of pairs of simulations of the comparison (default 10000)\n"
     print(s)
 
+
+def replica_seeds(master_seed, n):
+    """
+    Yields the seeds of the n simulations, derived from the master seed.
+    The seed of a simulation only depends on its index, not on the number of workers.
+    """
+    rng = random.Random(master_seed)
+    for i in range(n):
+        yield rng.getrandbits(32)
+
+
+def replicas(master_seed, n, mono, controller_fuzzy):
+    """
+    Yields (fuzzy, seed) for the n simulations: the controllers alternate between fixed-time
+    and fuzzy logic, unless mono is set, in which case only the controller_fuzzy one is used.
+    """
+    for i, seed in enumerate(replica_seeds(master_seed, n)):
+        yield (controller_fuzzy if mono else i % 2 == 1), seed
+
+
+def steps_to_arrival(rng, p):
+    """
+    Returns the number of steps before the next arrival of a vehicle, when a vehicle arrives 
+    at each step with probability p (geometric distribution).
+    """
+    return int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
+
+
+def build(fuzzy, lookup=False, array_lanes=False, log=False, definition=None, backend='skfuzzy'):
+    """
+    Creates the intersection: returns its controller and its North-to-South and West-to-East lanes.
+    definition is the fuzzy control system definition of the fuzzy controller (default if None),
+    backend its inference backend (see models.register_backend).
+    """
+    lane_type = Lane
+    if array_lanes:
+        from arraylane import ArrayLane
+        lane_type = ArrayLane
+
+    # create a controller
+    if fuzzy:
+        control = FuzzyLogicController(log=log, lookup=lookup, backend=backend, definition=definition)
+    else:
+        control = Controller(log=log)
+
+    # create North-to-South and West-to-East lanes
+    north2south = lane_type(control, S=15, D=7, name='North to South', init_state=State.green)
+    west2east = lane_type(control, S=15, D=7, name='West to East', init_state=State.red)
+    return control, north2south, west2east
+
+
+def warm_up(seed, steps, fuzzy=False, lookup=False, array_lanes=False):
+    """
+    Simulates the intersection for the given number of steps and returns the snapshot of
+    its state, from which simulations can be started (see simulate). The metrics of the
+    lanes and the step are reset, so that the warm-up is not counted by the simulations.
+    """
+    rng = random.Random(seed)
+    control, north2south, west2east = build(fuzzy, lookup, array_lanes)
+    for step in range(steps):
+        for lane, p in ((north2south, 0.5), (west2east, 0.2)):
+            if rng.uniform(0, 1) >= 1 - p:
+                lane.append(Vehicle())
+        control.step()
+        north2south.step()
+        west2east.step()
+    for lane in (north2south, west2east):
+        lane.car_in = lane.car_out = lane.total_wait = 0
+        lane.stats = WaitStats()
+    return capture(0, rng, control, (north2south, west2east))
+
+
+def simulate(fuzzy, seed, lookup=False, array_lanes=False, events=False, snapshot=None, arrivals=None,
+             definition=None, trace=None, trace_ring=None, backend='skfuzzy', max_steps=MAX_STEPS):
+    """
+    Runs one simulation of the intersection with a fixed-time or a fuzzy logic controller
+    (of the given fuzzy control system definition, the default one if None, and inference
+    backend),
+    drawing the arrivals from a random generator seeded with seed, or from the arrival
+    processes of the given specification (see arrivals.arrival_processes).
+    If a snapshot is given, the simulation starts from its state instead of an empty
+    intersection, with the random generator of the snapshot if seed is None: many
+    simulations (controllers, seeds) can be forked from one snapshot.
+    With events, the simulation jumps from an event to the next one (arrival, light switch, 
+    vehicle moving): the arrivals are drawn from the geometric distribution of the steps 
+    between arrivals, which gives the same results in distribution.
+    The simulation stops once a lane has let 50 vehicles out, or after max_steps steps
+    (the record is then marked as truncated), or if the extensions of the fuzzy controller
+    desynchronize the lights (see models.LightsDesynchronized; the record is then marked
+    as truncated and desynchronized).
+    If trace is given, the state of the intersection at each step is recorded in that
+    directory (see recorder.TraceWriter), keeping only the last trace_ring steps if set.
+    Returns the result record of the simulation: seed, controller, number of steps,
+    whether the simulation was truncated and desynchronized, wall time, the metrics of each
+    lane and the waiting time statistics of all the vehicles (WaitStats.to_dict).
+    """
+    start = time.perf_counter()
+    # step by step logs
+    log = logger.isEnabledFor(logging.DEBUG)
+    rng = random.Random(seed)
+    control, north2south, west2east = build(fuzzy, lookup, array_lanes, log, definition, backend)
+
+    if log:
+        logger.debug("Intersection created")
+
+    step = 0
+    if snapshot is not None:
+        step = restore(snapshot, rng, control, (north2south, west2east))
+        if seed is not None:
+            rng.seed(seed)
+
+    # arrival probability of each lane, and step of its next arrival with events
+    lanes = [(north2south, 0.5), (west2east, 0.2)]
+    sources = None
+    if arrivals is not None:
+        from arrivals import arrival_processes
+        sources = arrival_processes(arrivals, seed, [p for lane, p in lanes])
+    if not events:
+        next_arrival = None
+    elif sources is not None:
+        next_arrival = [source.next_arrival(step) for source in sources]
+    else:
+        next_arrival = [step + steps_to_arrival(rng, p) for lane, p in lanes]
+
+    writer = None
+    if trace is not None:
+        from recorder import TraceWriter
+        writer = TraceWriter(trace, control, (north2south, west2east), ring=trace_ring)
+
+    truncated = desynchronized = False
+    while (north2south.car_out < 50) and (west2east.car_out < 50):
+        if step > max_steps:
+            truncated = True
+            break
+        if events:
+            # jump to the next event
+            t = probe.start()
+            quiet = min(min(next_arrival) - step, control.quiet_steps(), north2south.quiet_steps(),
+                        west2east.quiet_steps(), max_steps + 1 - step)
+            if quiet > 0:
+                if log:
+                    logger.debug('[STEP %s] skip %s steps', step, quiet)
+                control.advance(quiet)
+                north2south.advance(quiet)
+                west2east.advance(quiet)
+                step += quiet
+                probe.stop('events', t)
+                continue
+            probe.stop('events', t)
+        if log:
+            logger.debug('[STEP %s]', step)
+        t = probe.start()
+        for i, (lane, p) in enumerate(lanes):
+            if sources is not None:
+                # number of vehicles arriving
+                arrival = sources[i].take(step)
+                if events and arrival:
+                    next_arrival[i] = sources[i].next_arrival(step + 1)
+            elif events:
+                arrival = next_arrival[i] == step
+                if arrival:
+                    next_arrival[i] = step + 1 + steps_to_arrival(rng, p)
+            else:
+                # coin toss to generate a new car or not (fewer cars on lane west2east)
+                arrival = rng.uniform(0, 1) >= 1 - p
+            for k in range(arrival):
+                if log:
+                    logger.debug('new vehicle in lane %s', lane.name)
+                lane.append(Vehicle())
+        probe.stop('arrivals', t)
+
+        try:
+            t = probe.start()
+            control.step()
+            probe.stop('controller', t)
+            t = probe.start()
+            north2south.step()
+            west2east.step()
+            probe.stop('lanes', t)
+        except LightsDesynchronized:
+            # the fuzzy extensions broke the light cycle, the simulation cannot go on
+            truncated = desynchronized = True
+            break
+
+        if log:
+            # the lanes are only formatted if the messages are emitted
+            logger.debug("N2S\n%r\nW2E\n%r\n", north2south, west2east)
+        if writer is not None:
+            writer.record(step)
+
+        step += 1
+    if writer is not None:
+        writer.close()
+
+    record = {
+        'seed': seed,
+        'controller': 'fuzzy' if fuzzy else 'fixed',
+        'steps': step,
+        'truncated': truncated,
+        'desynchronized': desynchronized,
+        'wall_time': time.perf_counter() - start,
+    }
+    for key, lane in (('north2south', north2south), ('west2east', west2east)):
+        record[key + '_car_in'] = lane.car_in
+        record[key + '_car_out'] = lane.car_out
+        record[key + '_total_wait'] = lane.total_wait
+    record['wait_stats'] = WaitStats().merge(north2south.stats).merge(west2east.stats).to_dict()
+    logger.info('%s simulation (seed %s): %s steps, total wait time %s', record['controller'], seed, step,
+                north2south.total_wait + west2east.total_wait)
+    return record
+
+
+def total_wait_time(record):
+    """
+    Returns the total wait time of all the lanes of a result record.
+    """
+    return record['north2south_total_wait'] + record['west2east_total_wait']
+
+
+def add_record(record, wait_sum, wait_count, wait_stats, steps):
+    """
+    Adds the result record of a simulation to the running sums, counts and statistics of its controller.
+    """
+    fuzzy = record['controller'] == 'fuzzy'
+    wait_sum[fuzzy] += total_wait_time(record)
+    wait_count[fuzzy] += 1
+    steps[fuzzy] += record['steps']
+    if 'wait_stats' in record:
+        wait_stats[fuzzy].merge(WaitStats.from_dict(record['wait_stats']))
+
+
+def report_stats(name, stats, steps):
+    """
+    Prints the waiting time statistics of the vehicles of the simulations of a controller.
+    """
+    if stats.count == 0:
+        return
+    s = stats.summary(steps)
+    print("wait time of the {} vehicles of {} controller: mean {:.2f}, std {:.2f}, P50 {:.1f}, P95 {:.1f}, "
+          "P99 {:.1f}, max {}, throughput {:.3f} vehicles/step".format(s['vehicles'], name, s['mean'], s['std'],
+          s['p50'], s['p95'], s['p99'], s['max'], s['throughput']))
+
+
+def init_worker(surface, level, profile):
+    """
+    Initializer of the worker processes: loads the control surface of the fuzzy controllers, 
+    sets the log level and enables the probe.
+    """
+    if surface is not None:
+        from trafficLightFuzzyController import load_surface
+        load_surface(surface)
+    configure_logging(level)
+    probe.enabled = profile
+
+
+def run_replica(task):
+    """
+    Runs the simulation described by task = (fuzzy, seed, options) and returns its record.
+    A trace directory option is the parent of the trace of each simulation (CONTROLLER-SEED).
+    When profiling, the record holds the probe counters of the simulation under 'profile'.
+    """
+    fuzzy, seed, options = task
+    if options.get('trace') is not None:
+        # one trace directory per simulation
+        trace = os.path.join(options['trace'], '{}-{}'.format('fuzzy' if fuzzy else 'fixed', seed))
+        options = dict(options, trace=trace)
+    record = simulate(fuzzy, seed, **options)
+    if probe.enabled:
+        record['profile'] = probe.take()
+    return record
+
+
+def run_pair(task):
+    """
+    Runs the fixed-time and fuzzy simulations of task = (seed, options) and returns their
+    records. Both simulations draw the same arrivals from the seed (common random numbers).
+    """
+    seed, options = task
+    return run_replica((False, seed, options)), run_replica((True, seed, options))
+
+
+def compare(master_seed, options, precision=None, alpha=0.05, min_pairs=10, max_pairs=10000, pool=None, sink=None):
+    """
+    Sequential comparison of the controllers: pairs of fixed-time and fuzzy simulations on
+    the same arrivals are run until the confidence interval of the mean difference of their
+    total wait times (fixed - fuzzy) has a half width of at most precision (the difference
+    is then tested once, at the end) or, without precision, until the confidence sequence
+    of the difference excludes 0 (see stats.PairedDifference: unlike the fixed interval,
+    it stays valid when checked after every pair). At least min_pairs and at most
+    max_pairs pairs are run.
+    The pairs are added in the order of their seeds, so that the number of pairs does not
+    depend on the number of workers. The pairs with a simulation reaching the step limit
+    are left out of the difference. Returns the PairedDifference and the number of these
+    truncated pairs.
+    """
+    difference = PairedDifference()
+    tasks = ((seed, options) for seed in replica_seeds(master_seed, max_pairs))
+    results = pool.imap(run_pair, tasks) if pool is not None else map(run_pair, tasks)
+    truncated = 0
+    for pair in results:
+        for record in pair:
+            if 'profile' in record:
+                probe.merge(record.pop('profile'))
+            if sink is not None:
+                sink.write(record)
+        if pair[0]['truncated'] or pair[1]['truncated']:
+            # step limit reached or lights desynchronized, the other pairs go on
+            truncated += 1
+            logger.warning('pair (seed %s) reached the step limit or desynchronized the lights', pair[0]['seed'])
+            continue
+        difference.add(total_wait_time(pair[0]), total_wait_time(pair[1]))
+        if difference.count >= min_pairs:
+            if precision is not None and difference.half_width(alpha) <= precision:
+                break
+            if precision is None and difference.significant(alpha, sequential=True):
+                break
+    if pool is not None:
+        # the pairs still running are not needed
+        pool.terminate()
+    return difference, truncated
+
+
+def report_comparison(difference, alpha, truncated, sequential=False):
+    """
+    Prints the result of compare, with the confidence sequence if the comparison stopped on
+    it (no precision) or the confidence interval otherwise.
+    """
+    if truncated:
+        print("{} pairs reached the step limit or desynchronized the lights and were left out of the "
+              "comparison".format(truncated))
+    if difference.count < 2:
+        return
+    low, high = difference.interval(alpha, sequential)
+    print("{} pairs of simulations: average total wait time {:.2f} (fixed), {:.2f} (fuzzy)".format(
+        difference.count, difference.x.mean, difference.y.mean))
+    print("difference (fixed - fuzzy): {:.2f}, {:g} % confidence {} [{:.2f}, {:.2f}]".format(
+        difference.difference.mean, 100 * (1 - alpha), 'sequence' if sequential else 'interval', low, high))
+    if low > 0 or high < 0:
+        print("the {} controller waits less".format('fuzzy' if low > 0 else 'fixed'))
+    else:
+        print("no significant difference")
+    print("variance reduction of the pairing: {:.1f}x".format(difference.variance_reduction()))
+
+
 if __name__ == '__main__':
-    wait_fuzzy = []
-    wait_fixed = []
     simulations = 1
     mono = False
     controller_fuzzy = False
-    log = False
-    wait = []
+    level = logging.WARNING
+    profile = False
+    lookup = False
+    surface = None
+    array_lanes = False
+    vectorized = False
+    jobs = 1
+    master_seed = None
+    output = None
+    resume = False
+    events = False
+    warmup = None
+    snapshot_file = None
+    arrivals = None
+    comparison = False
+    precision = None
+    alpha = 0.05
+    max_pairs = 10000
+    trace = None
+    trace_ring = None
+    backend = 'skfuzzy'
+    max_steps = MAX_STEPS
 
-    options = 'hln:s:'
+    options = 'hln:s:f:avj:o:epc'
     try:
-        opt_arg, args =  gnu_getopt(sys.argv[1:], options)
+        opt_arg, args =  gnu_getopt(sys.argv[1:], options, ['jobs=', 'seed=', 'output=', 'resume', 'events',
+                                                            'log-level=', 'profile', 'warmup=', 'snapshot=',
+                                                            'arrivals=', 'compare', 'precision=', 'alpha=',
+                                                            'max-pairs=', 'trace=', 'trace-ring=', 'backend=', 'max-steps='])
         for opt, arg in opt_arg:
             if opt == '-l':
-                log = True
+                level = logging.DEBUG
+            elif opt == '--log-level':
+                level = arg.upper()
+                if not isinstance(logging.getLevelName(level), int):
+                    raise GetoptError('unknown log level')
+            elif opt in ('-p', '--profile'):
+                profile = True
             elif opt == '-n':
                 simulations = int(arg)
             elif opt == '-h':
@@ -46,77 +452,177 @@ if __name__ == '__main__':
                     simulations /= 2
                 else:
                     raise GetoptError()
-    except GetoptError:
+            elif opt == '-a':
+                array_lanes = True
+            elif opt == '-v':
+                vectorized = True
+            elif opt == '-f':
+                from trafficLightFuzzyController import load_surface, save_surface
+                lookup = True
+                surface = arg
+                if os.path.exists(arg):
+                    load_surface(arg)
+                else:
+                    save_surface(arg)
+            elif opt in ('-j', '--jobs'):
+                jobs = int(arg)
+            elif opt == '--seed':
+                master_seed = int(arg)
+            elif opt in ('-o', '--output'):
+                output = arg
+            elif opt == '--resume':
+                resume = True
+            elif opt in ('-e', '--events'):
+                events = True
+            elif opt == '--warmup':
+                warmup = int(arg)
+            elif opt == '--snapshot':
+                snapshot_file = arg
+            elif opt == '--arrivals':
+                arrivals = arg
+            elif opt == '--max-steps':
+                max_steps = int(arg)
+            elif opt == '--backend':
+                if arg not in BACKENDS:
+                    raise GetoptError('unknown backend')
+                backend = arg
+            elif opt == '--trace':
+                trace = arg
+            elif opt == '--trace-ring':
+                trace_ring = int(arg)
+            elif opt in ('-c', '--compare'):
+                comparison = True
+            elif opt == '--precision':
+                precision = float(arg)
+            elif opt == '--alpha':
+                alpha = float(arg)
+            elif opt == '--max-pairs':
+                max_pairs = int(arg)
+        if resume and (master_seed is None or output is None):
+            # the simulations of the batch are only known from the master seed
+            raise GetoptError('--resume requires --seed and -o')
+        if vectorized:
+            # the lock-step engine only simulates the default intersection in memory
+            unsupported = {'-a', '-f', '-e', '--events', '-j', '--jobs', '-o', '--output', '--resume', '--warmup',
+                           '--snapshot', '--arrivals', '--trace', '--trace-ring', '--backend', '-c', '--compare'}
+            if unsupported.intersection(opt for opt, arg in opt_arg):
+                raise GetoptError('option not supported with -v')
+    except (GetoptError, ValueError):
         usage()
         sys.exit(-1)
 
+    configure_logging(level)
+    probe.enabled = profile
+    if master_seed is None:
+        master_seed = random.getrandbits(32)
+    total = int(simulations * 2)
+    # running sums and counts of the total wait time, by controller (fuzzy or not)
+    wait_sum = {False: 0, True: 0}
+    wait_count = {False: 0, True: 0}
+    # waiting time statistics of the vehicles and number of steps, by controller
+    wait_stats = {False: WaitStats(), True: WaitStats()}
+    steps = {False: 0, True: 0}
+    # number of simulations which reached the step limit, or desynchronized the lights
+    truncated = 0
+    desynchronized = 0
 
-    #simulations = 5 if len(sys.argv) == 1 else int(sys.argv[1])
-    for i in range(int(simulations * 2)):
-        # create a controller
-        if mono:
-            control = FuzzyLogicController(log=log) if controller_fuzzy else Controller(log=log)
-        else:
-            control = Controller(log=log) if i % 2 == 0 else FuzzyLogicController(log=log)
-        
-        # create North-to-South and West-to-East lanes
-        north2south = Lane(control, S=15, D=7, name='North to South', init_state=State.green)
-        west2east = Lane(control, S=15, D=7, name='West to East', init_state=State.red)
-
-        lanes = {
-            north2south.id: north2south,
-            west2east.id: west2east
-        }
-
-        if log:
-            print("Intersection created")
-
-        step = 0
-        while (north2south.car_out < 50) and (west2east.car_out < 50):
-            if step > 400:
-                sys.exit(0)
-            if log:
-                print('[STEP {}]'.format(step))
-            # coin toss to generate a new car or not
-            if random.uniform(0, 1) >= 0.5:  #
-                if log:
-                    print('new vehicle in lane {}'.format(north2south.name))
-                north2south.append(Vehicle())
-            if random.uniform(0, 1) >= 0.8:  # fewer cars on lane west2east
-                if log:
-                    print('new vehicle in lane {}'.format(west2east.name))
-                west2east.append(Vehicle())
-
-            control.step()
-            north2south.step()
-            west2east.step()
+    run_options = {'lookup': lookup, 'array_lanes': array_lanes, 'events': events, 'arrivals': arrivals,
+                   'trace': trace, 'trace_ring': trace_ring, 'backend': backend,
+                   'max_steps': max_steps}
+    if snapshot_file is not None and os.path.exists(snapshot_file):
+        run_options['snapshot'] = load(snapshot_file)
+    elif warmup is not None and not vectorized:
+        # warm up once, every simulation forks from the snapshot
+        run_options['snapshot'] = warm_up(master_seed, warmup, array_lanes=array_lanes)
+        if snapshot_file is not None:
+            save(snapshot_file, run_options['snapshot'])
 
-            if log:
-                print("N2S")
-                print(north2south) #comment to avoid printing the lane
-                print("W2E")
-                print(west2east) #comment to avoid printing the lane
-                print('\n')
+    if comparison:
+        sink = ResultSink(output) if output is not None else None
+        pool = Pool(jobs, init_worker, (surface, level, profile)) if jobs > 1 else None
+        difference, truncated = compare(master_seed, run_options, precision, alpha, max_pairs=max_pairs,
+                                        pool=pool, sink=sink)
+        if sink is not None:
+            sink.close()
+        report_comparison(difference, alpha, truncated, sequential=precision is None)
+        if profile:
+            print(probe.summary())
+        sys.exit(0)
 
-            step += 1
+    if vectorized:
+        from lockstep import LockstepSimulation
+        # same step limit as simulate()
+        runs = [(controller_fuzzy, total)] if mono else [(False, simulations), (True, simulations)]
+        for fuzzy, replicas in runs:
+            results = LockstepSimulation(replicas, fuzzy=fuzzy, max_steps=max_steps + 1, seed=master_seed).run()
+            wait_sum[fuzzy] += int(results['total_wait'].sum())
+            wait_count[fuzzy] += replicas
+            name = 'fuzzy' if fuzzy else 'fixed'
+            for i in results['desynchronized'].nonzero()[0].tolist():
+                # stopped as simulate() stops on LightsDesynchronized
+                desynchronized += 1
+                logger.warning('%s lock-step replica %s desynchronized the lights', name, i)
+            for i in (results['truncated'] & ~results['desynchronized']).nonzero()[0].tolist():
+                truncated += 1
+                logger.warning('%s lock-step replica %s reached the step limit', name, i)
+    else:
+        sink = ResultSink(output) if output is not None else None
+        batch = set((seed, fuzzy) for fuzzy, seed in replicas(master_seed, total, mono, controller_fuzzy))
+        # simulations of the batch already in the output file (other records are ignored)
+        done = set()
+        if resume:
+            for record in read_results(output):
+                key = (record['seed'], record['controller'] == 'fuzzy')
+                if key in batch and key not in done:
+                    done.add(key)
+                    if record.get('desynchronized'):
+                        desynchronized += 1
+                    elif record['truncated']:
+                        truncated += 1
+                    add_record(record, wait_sum, wait_count, wait_stats, steps)
+        tasks = ((fuzzy, seed, run_options) for fuzzy, seed in replicas(master_seed, total, mono, controller_fuzzy)
+                 if (seed, fuzzy) not in done)
+        pool = Pool(jobs, init_worker, (surface, level, profile)) if jobs > 1 else None
+        results = pool.imap_unordered(run_replica, tasks) if pool is not None else map(run_replica, tasks)
+        # reduce the results as they arrive
+        for record in results:
+            if 'profile' in record:
+                probe.merge(record.pop('profile'))
+            if sink is not None:
+                sink.write(record)
+            if record.get('desynchronized'):
+                # the fuzzy extensions broke the light cycle, the other simulations go on
+                desynchronized += 1
+                logger.warning('%s simulation (seed %s) desynchronized the lights', record['controller'],
+                               record['seed'])
+            elif record['truncated']:
+                # step limit reached, the other simulations go on
+                truncated += 1
+                logger.warning('%s simulation (seed %s) reached the step limit', record['controller'],
+                               record['seed'])
+            add_record(record, wait_sum, wait_count, wait_stats, steps)
+            print(" {} % of the way there".format(round((wait_count[False] + wait_count[True]) / total * 100, 2)))
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if sink is not None:
+            sink.close()
 
-        total_wait_time = north2south.total_wait + west2east.total_wait
-        if not mono:
-            if i % 2 == 0:
-                wait_fixed.append(total_wait_time)
-            else:
-                wait_fuzzy.append(total_wait_time)
-        else:
-            wait.append(total_wait_time)
-        print(" {} % of the way there".format(round(i / (simulations * 2) * 100, 2)))
-    
     print(" 100 % of the way there")
     if not mono:
         print("total average wait time for {} simulations of fixed controller was {}".format(simulations,
-            sum(wait_fixed) / len(wait_fixed)))
+            wait_sum[False] / wait_count[False]))
         print("total average wait time for {} simulations of fuzzy controller was {}".format(simulations,
-            sum(wait_fuzzy) / len(wait_fuzzy)))
+            wait_sum[True] / wait_count[True]))
     else:
          print("total average wait time for {} simulations of controller was {}".format(simulations,
-            sum(wait) / len(wait)))
-
+            wait_sum[controller_fuzzy] / wait_count[controller_fuzzy]))
+    if truncated:
+        print("{} simulations reached the step limit of {} steps".format(truncated, max_steps))
+    if desynchronized:
+        print("{} simulations were stopped when the fuzzy extensions desynchronized the lights".format(
+            desynchronized))
+    for fuzzy in (False, True):
+        report_stats('fuzzy' if fuzzy else 'fixed', wait_stats[fuzzy], steps[fuzzy])
+    if profile:
+        print(probe.summary())
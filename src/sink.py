@@ -0,0 +1,106 @@
+"""
+Append-only results files of the simulations.
+"""
+import csv
+import json
+import os
+
+
+def is_csv(path):
+    return os.path.splitext(path)[1].lower() == '.csv'
+
+
+def parse_field(value):
+    """
+    Converts a CSV field back to the number, boolean or string it was written from.
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def read_results(path):
+    """
+    Yields the records of a results file written by ResultSink (JSON lines, or CSV if the
+    path ends with .csv). A truncated last line, left by an interrupted run, is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, newline='') as f:
+        if is_csv(path):
+            for row in csv.DictReader(f):
+                if None in row.values() or None in row:
+                    # incomplete row
+                    continue
+                yield {k: parse_field(v) for k, v in row.items()}
+        else:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # incomplete line
+                    continue
+
+
+class ResultSink(object):
+    """
+    Streams the result records (flat dicts) of the simulations to an append-only file,
+    as JSON lines or as CSV if the path ends with .csv.
+    Records are written by batches of 'buffer' records, so that an interrupted run loses
+    at most the last batch.
+    Constructor parameters:
+        path    (String): results file, created if missing
+        buffer  (int): number of records kept in memory before writing them
+    """
+    def __init__(self, path, buffer=100):
+        self.path = path
+        self.buffer = buffer
+        self.pending = []
+        self.csv = is_csv(path)
+        self.fields = None
+        if self.csv and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline='') as f:
+                self.fields = next(csv.reader(f))
+        self.file = open(path, 'a', newline='')
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # end the line left incomplete by an interrupted run
+                    self.file.write('\n')
+
+    def write(self, record):
+        """
+        Adds a record, the pending records are written once the buffer is full.
+        """
+        self.pending.append(record)
+        if len(self.pending) >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the pending records to the file.
+        """
+        if self.csv:
+            if self.fields is None and self.pending:
+                self.fields = list(self.pending[0])
+                csv.writer(self.file).writerow(self.fields)
+            writer = csv.DictWriter(self.file, self.fields)
+            for record in self.pending:
+                writer.writerow({k: v if isinstance(v, str) else json.dumps(v) for k, v in record.items()})
+        else:
+            for record in self.pending:
+                self.file.write(json.dumps(record) + '\n')
+        self.pending = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
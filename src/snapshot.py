@@ -0,0 +1,68 @@
+"""
+Snapshots of the state of a simulation: compressed JSON documents that can be saved, and
+restored into freshly built objects to continue (or fork) the simulation. A snapshot only
+holds data, so that restoring a file never runs code from it.
+"""
+import json
+import zlib
+
+# version of the snapshot format
+VERSION = 3
+
+
+def capture(step, rng, control, lanes):
+    """
+    Returns the snapshot of a simulation at the given step: the state of the random
+    generator (random.Random), of the controller and of the lanes (with their lights).
+    """
+    state = {
+        'version': VERSION,
+        'step': step,
+        'rng': rng.getstate(),
+        'controller': (type(control).__name__, control.dump_state()),
+        'lanes': [lane.dump_state() for lane in lanes],
+    }
+    return zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+
+
+def restore(snapshot, rng, control, lanes):
+    """
+    Restores a snapshot into the random generator, the controller and the lanes of a
+    simulation built like the captured one. The controller may be of another type than the
+    captured one, in which case it resumes from the state of the lights and is notified of
+    the vehicles between the sensors, as if they had just been detected. Returns the step.
+    """
+    try:
+        state = json.loads(zlib.decompress(snapshot))
+    except (zlib.error, UnicodeDecodeError):
+        raise ValueError('not a snapshot')
+    version = state.get('version') if isinstance(state, dict) else None
+    if version != VERSION:
+        raise ValueError('unsupported snapshot version {}'.format(version))
+    if len(state['lanes']) != len(lanes):
+        raise ValueError('snapshot of {} lanes restored into {} lanes'.format(len(state['lanes']), len(lanes)))
+    # JSON turns the tuples of the state of the generator into lists
+    rng_version, internal, gauss = state['rng']
+    rng.setstate((rng_version, tuple(internal), gauss))
+    for lane, lane_state in zip(lanes, state['lanes']):
+        lane.load_state(lane_state)
+    controller, controller_state = state['controller']
+    if controller == type(control).__name__:
+        control.load_state(controller_state)
+    else:
+        control.load_state(None)
+        for lane, lane_state in zip(lanes, state['lanes']):
+            detected = sum(1 for position, ride, wait in lane_state['vehicles'] if position <= lane.D)
+            if detected:
+                control.update_batch(lane.id, detected, 0, lane.D)
+    return state['step']
+
+
+def save(path, snapshot):
+    with open(path, 'wb') as f:
+        f.write(snapshot)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return f.read()
@@ -0,0 +1,162 @@
+"""
+Soak runs: one intersection simulated for a long horizon (a number of steps or of vehicles
+leaving it) in constant memory, reporting its progress and recording windowed metrics.
+"""
+import json
+import random
+import sys
+import time
+from getopt import gnu_getopt, GetoptError
+from models import BACKENDS
+from road import Vehicle
+from simulation import build
+from stats import WaitStats, WindowSeries
+
+# steps between two checks of the progress clock
+CHECK = 4096
+
+
+def soak(fuzzy, seed=None, steps=None, vehicles=None, window=1000, points=1024, every=10., lookup=False,
+         array_lanes=False, arrivals=None, backend='skfuzzy', out=sys.stderr):
+    """
+    Simulates the intersection like simulation.simulate, without its step limit, until
+    the given number of steps or of vehicles leaving the lanes (the first reached; at
+    least one of them must be given).
+    Every 'every' seconds, the progress and throughput are written to out (None to disable).
+    The metrics are recorded by windows of steps (see stats.WindowSeries): vehicles out,
+    their total wait time, and the number of vehicles between the sensors (summed over the
+    steps of the window, divide by the window for the average queue).
+    Returns the result record: seed, controller, steps, wall time, metrics of each lane,
+    waiting time statistics of the vehicles and the series.
+    """
+    if steps is None and vehicles is None:
+        raise ValueError('a soak run needs a number of steps or of vehicles')
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    control, north2south, west2east = build(fuzzy, lookup, array_lanes, backend=backend)
+    lanes = [(north2south, 0.5), (west2east, 0.2)]
+    sources = None
+    if arrivals is not None:
+        from arrivals import arrival_processes
+        sources = arrival_processes(arrivals, seed, [p for lane, p in lanes])
+    series = WindowSeries(('vehicles', 'wait', 'queue'), window, points)
+    steps = float('inf') if steps is None else steps
+    vehicles = float('inf') if vehicles is None else vehicles
+
+    step = out_before = wait_before = 0
+    last_report, last_step, last_out = start, 0, 0
+    while step < steps and out_before < vehicles:
+        for i, (lane, p) in enumerate(lanes):
+            if sources is not None:
+                arrival = sources[i].take(step)
+            else:
+                arrival = rng.uniform(0, 1) >= 1 - p
+            for k in range(arrival):
+                lane.append(Vehicle())
+        control.step()
+        north2south.step()
+        west2east.step()
+        step += 1
+
+        car_out = north2south.car_out + west2east.car_out
+        total_wait = north2south.total_wait + west2east.total_wait
+        queue = north2south.car_in - north2south.car_out + west2east.car_in - west2east.car_out
+        series.add(car_out - out_before, total_wait - wait_before, queue)
+        out_before, wait_before = car_out, total_wait
+
+        if out is not None and step % CHECK == 0:
+            now = time.perf_counter()
+            if now - last_report >= every:
+                elapsed = now - last_report
+                print('step {}, {} vehicles out: {:.0f} steps/s, {:.0f} vehicles/s'.format(
+                    step, car_out, (step - last_step) / elapsed, (car_out - last_out) / elapsed), file=out)
+                out.flush()
+                last_report, last_step, last_out = now, step, car_out
+
+    record = {
+        'seed': seed,
+        'controller': 'fuzzy' if fuzzy else 'fixed',
+        'steps': step,
+        'wall_time': time.perf_counter() - start,
+    }
+    for key, lane in (('north2south', north2south), ('west2east', west2east)):
+        record[key + '_car_in'] = lane.car_in
+        record[key + '_car_out'] = lane.car_out
+        record[key + '_total_wait'] = lane.total_wait
+    record['wait_stats'] = WaitStats().merge(north2south.stats).merge(west2east.stats).to_dict()
+    record['series'] = series.to_dict()
+    return record
+
+
+def usage():
+    s = "usage: soak.py [OPTIONS]\n"
+    s+= "Simulates the intersection for a long horizon in constant memory, and prints the result\n"
+    s+= "record with the windowed series of the metrics (JSON).\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-s 'fixed' or 'fuzzy'\n\t controller (default fixed)\n"
+    s+= "-t INT\n\t number of steps\n"
+    s+= "-n INT\n\t number of vehicles leaving the intersection (the run stops at the first limit reached)\n"
+    s+= "-w INT\n\t initial number of steps of a window of the series (default 1000)\n"
+    s+= "-m INT\n\t maximum number of windows of the series, even (default 1024)\n"
+    s+= "-r FLOAT\n\t seconds between progress reports (default 10)\n"
+    s+= "-f\n\t answer the fuzzy controller from its control surface\n"
+    s+= "-a\n\t use the array-backed lanes (arraylane.ArrayLane)\n"
+    s+= "-o FILE\n\t write the result record to FILE instead of the standard output\n"
+    s+= "--arrivals SPEC\n\t arrival processes (see simulation.py)\n"
+    s+= "--backend NAME\n\t inference backend of the fuzzy controller (see simulation.py)\n"
+    s+= "--seed INT\n\t seed of the arrivals\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    options = {}
+    fuzzy, output = False, None
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hs:t:n:w:m:r:fao:', ['arrivals=', 'backend=', 'seed='])
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-s':
+                if arg not in ('fixed', 'fuzzy'):
+                    raise GetoptError('unknown controller')
+                fuzzy = arg == 'fuzzy'
+            elif opt == '-t':
+                options['steps'] = int(arg)
+            elif opt == '-n':
+                options['vehicles'] = int(arg)
+            elif opt == '-w':
+                options['window'] = int(arg)
+            elif opt == '-m':
+                options['points'] = int(arg)
+                if options['points'] < 2 or options['points'] % 2:
+                    raise GetoptError('invalid number of windows')
+            elif opt == '-r':
+                options['every'] = float(arg)
+            elif opt == '-f':
+                options['lookup'] = True
+            elif opt == '-a':
+                options['array_lanes'] = True
+            elif opt == '-o':
+                output = arg
+            elif opt == '--arrivals':
+                options['arrivals'] = arg
+            elif opt == '--backend':
+                if arg not in BACKENDS:
+                    raise GetoptError('unknown backend')
+                options['backend'] = arg
+            elif opt == '--seed':
+                options['seed'] = int(arg)
+        if 'steps' not in options and 'vehicles' not in options:
+            raise GetoptError('no horizon')
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    record = soak(fuzzy, **options)
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(record, f)
+    else:
+        print(json.dumps(record))
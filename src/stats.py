@@ -0,0 +1,326 @@
+"""
+Online statistics with constant memory, mergeable across lanes, replicas and processes.
+"""
+import math
+from statistics import NormalDist
+
+
+class Welford(object):
+    """
+    Running count, mean, variance, minimum and maximum (Welford's algorithm).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        # sum of squared differences to the mean
+        self.m2 = 0.
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        """
+        Adds the values summarized by another Welford (Chan et al. parallel formula).
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class PairedDifference(object):
+    """
+    Online confidence interval of the mean difference x - y of paired observations (e.g.
+    two controllers simulated on the same arrivals), with the normal approximation.
+    The fixed interval (sequential=False) is only valid at a number of pairs chosen in
+    advance. The confidence sequence (sequential=True) holds at every number of pairs at
+    once (asymptotic normal mixture confidence sequence, Waudby-Smith et al. 2021), so that
+    it can be checked after every pair and the observations stopped once it excludes 0.
+    """
+    def __init__(self):
+        self.x = Welford()
+        self.y = Welford()
+        self.difference = Welford()
+
+    def add(self, x, y):
+        self.x.add(x)
+        self.y.add(y)
+        self.difference.add(x - y)
+
+    @property
+    def count(self):
+        return self.difference.count
+
+    def half_width(self, alpha=0.05):
+        """
+        Returns the half width of the 1 - alpha confidence interval of the mean difference.
+        """
+        if self.count < 2:
+            return math.inf
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        return z * self.difference.std() / math.sqrt(self.count)
+
+    def sequence_half_width(self, alpha=0.05, tuning=100):
+        """
+        Returns the half width of the 1 - alpha confidence sequence of the mean difference,
+        tightest around tuning pairs.
+        """
+        n = self.count
+        if n < 2:
+            return math.inf
+        rho2 = (-2 * math.log(alpha) + math.log(-2 * math.log(alpha) + 1)) / tuning
+        return self.difference.std() * math.sqrt(2 * (n * rho2 + 1) / (n * n * rho2)
+                                                 * math.log(math.sqrt(n * rho2 + 1) / alpha))
+
+    def interval(self, alpha=0.05, sequential=False):
+        h = self.sequence_half_width(alpha) if sequential else self.half_width(alpha)
+        return self.difference.mean - h, self.difference.mean + h
+
+    def significant(self, alpha=0.05, sequential=False):
+        """
+        Returns True if the 1 - alpha confidence interval (or sequence) of the mean
+        difference excludes 0.
+        """
+        low, high = self.interval(alpha, sequential)
+        return low > 0 or high < 0
+
+    def variance_reduction(self):
+        """
+        Returns the ratio of the variance of the difference of independent observations to
+        the variance of the paired difference: independent samples would need about this
+        many times more pairs for the same precision.
+        """
+        variance = self.difference.variance()
+        return (self.x.variance() + self.y.variance()) / variance if variance > 0 else math.inf
+
+
+class Histogram(object):
+    """
+    Histogram with fixed-width bins over [0, bins * width), values beyond fall in an
+    overflow bin. Only histograms with the same bins can be merged.
+    Constructor parameters:
+        width   (float): width of a bin
+        bins    (int): number of bins
+    """
+    def __init__(self, width=1, bins=256):
+        self.width = width
+        self.counts = [0] * (bins + 1)
+
+    def add(self, x):
+        self.counts[min(int(x // self.width), len(self.counts) - 1)] += 1
+
+    def merge(self, other):
+        assert self.width == other.width and len(self.counts) == len(other.counts), 'incompatible histograms'
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def edges(self):
+        """
+        Returns the lower edge of each bin (the last one is the overflow bin).
+        """
+        return [i * self.width for i in range(len(self.counts))]
+
+
+class QuantileSketch(object):
+    """
+    Streaming quantile sketch with a relative accuracy guarantee (DDSketch): positive values
+    are counted in logarithmic buckets, so that any quantile is estimated within a relative
+    error alpha. Memory is bounded by max_buckets: when exceeded, the lowest buckets are
+    collapsed, which only degrades the accuracy of the lowest quantiles.
+    Constructor parameters:
+        alpha   (float): relative accuracy
+        max_buckets (int): maximum number of buckets
+    """
+    def __init__(self, alpha=0.01, max_buckets=2048):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        # bucket index -> count, values <= 0 are counted apart
+        self.buckets = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        if x <= 0:
+            self.zero += 1
+            return
+        k = math.ceil(math.log(x) / self.log_gamma)
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self.__collapse()
+
+    def __collapse(self):
+        # merge the lowest buckets into the lowest kept one
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        target = keys[excess]
+        for k in keys[:excess]:
+            self.buckets[target] += self.buckets.pop(k)
+
+    def merge(self, other):
+        assert self.gamma == other.gamma, 'incompatible sketches'
+        self.count += other.count
+        self.zero += other.zero
+        for k, n in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + n
+        if len(self.buckets) > self.max_buckets:
+            self.__collapse()
+
+    def quantile(self, q):
+        """
+        Returns the estimated q-quantile (0 <= q <= 1), None if no value was added.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return 2 * self.gamma ** k / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class WaitStats(object):
+    """
+    Statistics of the waiting times of the vehicles leaving a lane: mean and variance,
+    histogram and quantile sketch. Memory is constant, whatever the number of vehicles.
+    """
+    def __init__(self):
+        self.moments = Welford()
+        self.histogram = Histogram()
+        self.sketch = QuantileSketch()
+
+    def add(self, wait):
+        self.moments.add(wait)
+        self.histogram.add(wait)
+        self.sketch.add(wait)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.sketch.merge(other.sketch)
+        return self
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def to_dict(self):
+        """
+        Returns the state of the statistics as a JSON serializable dict (see from_dict),
+        so that they can be written to a results file and merged later.
+        """
+        m = self.moments
+        return {
+            'moments': [m.count, m.mean, m.m2, m.min if m.count else None, m.max if m.count else None],
+            'histogram': {str(i): n for i, n in enumerate(self.histogram.counts) if n},
+            'sketch': [self.sketch.zero, {str(k): n for k, n in self.sketch.buckets.items()}],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        m = stats.moments
+        m.count, m.mean, m.m2, m.min, m.max = d['moments']
+        if m.count == 0:
+            m.min, m.max = math.inf, -math.inf
+        for i, n in d['histogram'].items():
+            stats.histogram.counts[int(i)] = n
+        stats.sketch.zero, buckets = d['sketch']
+        stats.sketch.buckets = {int(k): n for k, n in buckets.items()}
+        stats.sketch.count = m.count
+        return stats
+
+    def summary(self, steps=None):
+        """
+        Returns a dict of the statistics: number of vehicles, mean, standard deviation,
+        P50, P95, P99 and maximum wait, and the throughput (vehicles per step) if the
+        number of simulated steps is given.
+        """
+        s = {
+            'vehicles': self.count,
+            'mean': self.moments.mean,
+            'std': self.moments.std(),
+            'p50': self.sketch.quantile(0.5),
+            'p95': self.sketch.quantile(0.95),
+            'p99': self.sketch.quantile(0.99),
+            'max': self.moments.max if self.count > 0 else None,
+        }
+        if steps:
+            s['throughput'] = self.count / steps
+        return s
+
+
+class WindowSeries(object):
+    """
+    Time series of sums of per-step values (channels) by windows of steps, in bounded
+    memory: once points windows are complete, adjacent windows are merged in pairs and the
+    window doubles, so that the series always covers the whole run with at most points
+    windows.
+    Constructor parameters:
+        channels    (tuple): names of the summed values
+        window  (int): initial number of steps of a window
+        points  (int): maximum number of complete windows kept (even, at least 2)
+    """
+    def __init__(self, channels, window=1000, points=1024):
+        if points < 2 or points % 2:
+            raise ValueError('the number of windows must be even and at least 2')
+        self.channels = tuple(channels)
+        self.window = window
+        self.points = points
+        # sums of the complete windows, by channel
+        self.sums = [[] for c in self.channels]
+        # current window: number of steps and sums
+        self.steps = 0
+        self.current = [0] * len(self.channels)
+
+    def add(self, *values):
+        """
+        Adds the values of the channels at one step.
+        """
+        current = self.current
+        for i, value in enumerate(values):
+            current[i] += value
+        self.steps += 1
+        if self.steps == self.window:
+            for sums, value in zip(self.sums, current):
+                sums.append(value)
+            self.steps = 0
+            self.current = [0] * len(self.channels)
+            if len(self.sums[0]) == self.points:
+                self.sums = [[s[i] + s[i + 1] for i in range(0, len(s), 2)] for s in self.sums]
+                self.window *= 2
+
+    def to_dict(self):
+        """
+        Returns the series as a JSON serializable dict: the window, and the sums of each
+        channel by window (the last one partial, over 'last' steps).
+        """
+        d = {'window': self.window, 'last': self.steps}
+        for name, sums, value in zip(self.channels, self.sums, self.current):
+            d[name] = sums + ([value] if self.steps else [])
+        return d
@@ -1,81 +1,271 @@
 import numpy as np
 import skfuzzy as fuzz
 from skfuzzy import control as ctrl
+from definition import ARRIVALS, QUEUE, EXTENSION, RULES, DEFINITION
 
+# compiled control systems of this process, by definition
+_systems = {}
 
-class traficLightFuzzyController():
-    def __init__(self):
+
+class CompiledSystem(object):
+    """
+    Fuzzy variables, rules and control system built from a definition. 
+    A compiled system is shared by all the controllers of the process using the same 
+    definition, together with its control surface and the results already computed.
+    Use compile_system to get the compiled system of a definition.
+    """
+    # maximum number of memoized results
+    max_results = 65536
+
+    def __init__(self, definition):
+        arrivals, queue, extension, rules = definition
         # first we need to design the membership functions
+        self.arrivals = self.__variable(ctrl.Antecedent, 'arrivals', arrivals)
+        self.queue = self.__variable(ctrl.Antecedent, 'queue', queue)
+        self.extension = self.__variable(ctrl.Consequent, 'extension', extension)
+        self.rules = rules
+        self.definition = definition
+        # the skfuzzy control system is only built when a controller needs it
+        self.__control = None
+        # control surface indexed by [queue, arrivals], computed on demand
+        self.surface = None
+        # memoized results of the control system, by (queue, arrivals)
+        self.results = {}
 
-        # The arrival membership function
+    @staticmethod
+    def __variable(kind, label, definition):
         # assign the bounds of the membership function
-        arrivals = ctrl.Antecedent(np.arange(0, 16, 1), 'arrivals')
-
+        size, terms = definition
+        variable = kind(np.arange(0, size, 1), label)
         # assign the bounds of every fuzzy member
-        arrivals["AN"] = fuzz.trimf(arrivals.universe, [0, 0, 2])
-        arrivals["F"] = fuzz.trimf(arrivals.universe, [1,4 , 7])
-        arrivals["MY"] = fuzz.trimf(arrivals.universe, [5, 9, 13])
-        arrivals["TMY"] = fuzz.trimf(arrivals.universe, [10, 15, 15])
-
-        # the queue membership function
-        # assign the bounds of the queue membership function
-        queue = ctrl.Antecedent(np.arange(0, 16, 1), 'queue')
-
-        # assign the the bounds of each fuzzy member
-        queue["VS"] = fuzz.trimf(queue.universe, [0, 0, 2])
-        queue["S"] = fuzz.trimf(queue.universe, [1, 4, 7])
-        queue["M"] = fuzz.trimf(queue.universe, [5, 9, 13])
-        queue["L"] = fuzz.trimf(queue.universe, [10, 15, 15])
-
-        # the extension membership function
-        # assign the bounds of the extension membership function
-        extension = ctrl.Consequent(np.arange(0, 7, 1), 'extension')
-
-        # assign the bounds of each fuzzy member
-        extension["Z"] = fuzz.trimf(extension.universe, [0, 0, 2])
-        extension["SO"] = fuzz.trimf(extension.universe, [0, 2, 4])
-        extension["ML"] = fuzz.trimf(extension.universe, [2, 4, 6])
-        extension["LO"] = fuzz.trimf(extension.universe, [4, 6, 6])
-        self.extension =  extension
-
-        # implement all the rules available
-        rule1 = ctrl.Rule(arrivals["AN"] & queue["VS"], extension["Z"])
-        rule2 = ctrl.Rule(arrivals["AN"] & queue["S"], extension["Z"])
-        rule3 = ctrl.Rule(arrivals["AN"] & queue["M"], extension["Z"])
-        rule4 = ctrl.Rule(arrivals["AN"] & queue["L"], extension["Z"])
-        rule5 = ctrl.Rule(arrivals["F"] & queue["VS"], extension["SO"])
-        rule6 = ctrl.Rule(arrivals["F"] & queue["S"], extension["SO"])
-        rule7 = ctrl.Rule(arrivals["F"] & queue["M"], extension["Z"])
-        rule8 = ctrl.Rule(arrivals["F"] & queue["L"], extension["Z"])
-        rule9 = ctrl.Rule(arrivals["MY"] & queue["VS"], extension["ML"])
-        rule10 = ctrl.Rule(arrivals["MY"] & queue["S"], extension["ML"])
-        rule11 = ctrl.Rule(arrivals["MY"] & queue["M"], extension["SO"])
-        rule12 = ctrl.Rule(arrivals["MY"] & queue["L"], extension["Z"])
-        rule13 = ctrl.Rule(arrivals["TMY"] & queue["VS"], extension["LO"])
-        rule14 = ctrl.Rule(arrivals["TMY"] & queue["S"], extension["ML"])
-        rule15 = ctrl.Rule(arrivals["TMY"] & queue["M"], extension["ML"])
-        rule16 = ctrl.Rule(arrivals["TMY"] & queue["L"], extension["SO"])
-
-        # implement the control system that does the fuzzification, composition inference and defuzzification for us
-        traffic_lights_ctrl = ctrl.ControlSystem(rules=
-                                                 [rule1, rule2, rule3, rule4, rule5, rule6, rule7, rule8, rule9, rule10,
-                                                  rule11,
-                                                  rule12, rule13, rule14, rule15,
-                                                  rule16])
+        for term, bounds in terms:
+            variable[term] = fuzz.trimf(variable.universe, list(bounds))
+        return variable
+
+    @property
+    def control(self):
+        """
+        skfuzzy control system, which does the fuzzification, composition inference 
+        and defuzzification for us.
+        """
+        if self.__control is None:
+            # implement all the rules available
+            rules = [ctrl.Rule(self.arrivals[a] & self.queue[q], self.extension[e]) for a, q, e in self.rules]
+            self.__control = ctrl.ControlSystem(rules=rules)
+        return self.__control
+
+
+def compile_system(definition=DEFINITION):
+    """
+    Returns the compiled control system of the definition, it is built once per process.
+    """
+    system = _systems.get(definition)
+    if system is None:
+        system = _systems[definition] = CompiledSystem(definition)
+    return system
+
+
+def clear_cache(definition=None):
+    """
+    Drops the compiled control system of the definition (all of them if None), with its
+    control surface and memoized results: it is built again by the next controller using it.
+    """
+    if definition is None:
+        _systems.clear()
+    else:
+        _systems.pop(definition, None)
+
+
+def save_surface(path, definition=DEFINITION):
+    """
+    Saves the control surface of the definition to a .npz file.
+    """
+    surface = traficLightFuzzyController(lookup=True, definition=definition).surface
+    np.savez(path, surface=surface, definition=repr(definition))
+
+
+def load_surface(path, definition=DEFINITION):
+    """
+    Loads a control surface saved with save_surface, lookup controllers of this definition 
+    then use it instead of computing it. 
+    Raises a ValueError if the file holds the surface of another definition.
+    """
+    with np.load(path) as data:
+        if str(data['definition']) != repr(definition):
+            raise ValueError('{} does not hold the control surface of this definition'.format(path))
+        compile_system(definition).surface = data['surface']
+
+
+class traficLightFuzzyController():
+    """
+    Fuzzy control system computing the green light extension from the number of
+    cars in the queue and the number of cars arriving at the green light.
+    The compiled control system is shared by all the controllers of a same definition, 
+    each controller only creates its own skfuzzy simulation when it needs one.
+    Constructor parameters:
+        lookup  (bool): if True, the control surface is computed once over the
+                        queue x arrivals grid and get_extension answers from that table
+        definition  (tuple): membership functions and rules of the control system
+    """
+    def __init__(self, lookup=False, definition=DEFINITION):
+        self.system = compile_system(definition)
+        self.arrivals = self.system.arrivals
+        self.queue = self.system.queue
+        self.extension = self.system.extension
+        self.rules = self.system.rules
         if graphs:
-            extension.view()
-            arrivals.view()
-            queue.view()
-            traffic_lights_ctrl.view()
+            self.extension.view()
+            self.arrivals.view()
+            self.queue.view()
+            self.system.control.view()
+        self.__simulation = None
 
-        self.traffic_lights_simulation = ctrl.ControlSystemSimulation(traffic_lights_ctrl)
+        # precomputed control surface, indexed by [queue, arrivals]
+        if lookup and self.system.surface is None:
+            self.system.surface = self.compute_surface()
+        self.surface = self.system.surface if lookup else None
 
-    def get_extension(self, cars_in_queue, cars_arriving_at_green_light):
+    @property
+    def traffic_lights_simulation(self):
+        """
+        skfuzzy simulation of this controller. Results are memoized by the compiled 
+        system rather than by the simulation, as skfuzzy simulations sharing a control 
+        system also share their cache.
+        """
+        if self.__simulation is None:
+            self.__simulation = ctrl.ControlSystemSimulation(self.system.control, cache=False)
+        return self.__simulation
+
+    def compute(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Runs the full Mamdani inference of the skfuzzy control system.
+        """
+        key = (cars_in_queue, cars_arriving_at_green_light)
+        results = self.system.results
+        if key in results and not graphs:
+            return results[key]
         self.traffic_lights_simulation.inputs({"arrivals":cars_arriving_at_green_light,"queue":cars_in_queue})
         self.traffic_lights_simulation.compute()
         if graphs:
             self.extension.view(sim=self.traffic_lights_simulation)
-        return self.traffic_lights_simulation.output["extension"]
+        if len(results) >= CompiledSystem.max_results:
+            results.clear()
+        results[key] = self.traffic_lights_simulation.output["extension"]
+        return results[key]
+
+    def compute_surface(self):
+        """
+        Evaluates the control system at every point of the queue x arrivals grid.
+        """
+        queue, arrivals = np.meshgrid(self.queue.universe, self.arrivals.universe, indexing='ij')
+        return self.get_extension_batch(queue, arrivals)
+
+    def lookup(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Reads the extension from the precomputed surface. Integer inputs are answered 
+        with a table lookup, fractional inputs with a bilinear interpolation. 
+        Out of range inputs are clipped to the universe bounds, as skfuzzy does.
+        """
+        i, fq = self.__grid_position(self.queue.universe, cars_in_queue)
+        j, fa = self.__grid_position(self.arrivals.universe, cars_arriving_at_green_light)
+        if fq == 0 and fa == 0:
+            return float(self.surface[i, j])
+        # the upper neighbours are only read with a non-zero weight
+        i1 = i + 1 if fq > 0 else i
+        j1 = j + 1 if fa > 0 else j
+        s = self.surface
+        return float((1 - fq) * ((1 - fa) * s[i, j] + fa * s[i, j1])
+                     + fq * ((1 - fa) * s[i1, j] + fa * s[i1, j1]))
+
+    @staticmethod
+    def __grid_position(universe, value):
+        """
+        Returns the index of the grid cell containing value and the offset within the cell.
+        """
+        value = min(max(value, universe[0]), universe[-1])
+        offset = (value - universe[0]) / (universe[1] - universe[0])
+        index = min(int(offset), len(universe) - 2)
+        return index, offset - index
+
+    def check_surface(self, tolerance=0.75, resolution=4):
+        """
+        Compares the table lookup against the live Mamdani inference on a grid 
+        'resolution' times finer than the universes (including out of range points). 
+        Integer inputs match up to rounding, fractional inputs deviate by the bilinear 
+        interpolation error. Returns the maximum absolute deviation, raises an 
+        AssertionError if it exceeds the tolerance.
+        """
+        if self.surface is None:
+            self.surface = self.compute_surface()
+        deviation = 0.
+        for q in np.arange(-1, len(self.queue.universe) + 1, 1 / resolution):
+            for a in np.arange(-1, len(self.arrivals.universe) + 1, 1 / resolution):
+                deviation = max(deviation, abs(self.lookup(q, a) - self.compute(q, a)))
+        assert deviation <= tolerance, \
+            'lookup table deviates from the control system by {}'.format(deviation)
+        return deviation
+
+    def get_extension_batch(self, cars_in_queue, cars_arriving_at_green_light):
+        """
+        Array version of get_extension: runs the same Mamdani inference (min/max rule 
+        firing and centroid defuzzification) for every pair of queue/arrivals values 
+        with NumPy array operations. The inputs are broadcast against each other.
+        """
+        queue = np.asarray(cars_in_queue, dtype=np.float64)
+        arrivals = np.asarray(cars_arriving_at_green_light, dtype=np.float64)
+        queue, arrivals = np.broadcast_arrays(queue, arrivals)
+        shape = queue.shape
+        # fuzzification of the clipped inputs
+        queue = np.clip(queue.ravel(), self.queue.universe.min(), self.queue.universe.max())
+        arrivals = np.clip(arrivals.ravel(), self.arrivals.universe.min(), self.arrivals.universe.max())
+        fuzzy_queue = {label: np.interp(queue, self.queue.universe, term.mf)
+                       for label, term in self.queue.terms.items()}
+        fuzzy_arrivals = {label: np.interp(arrivals, self.arrivals.universe, term.mf)
+                          for label, term in self.arrivals.terms.items()}
+        # rule firing: min for the conjunction, max to accumulate the rules of a same consequent
+        cuts = {label: np.zeros(len(queue)) for label in self.extension.terms}
+        for a, q, e in self.rules:
+            np.fmax(cuts[e], np.fmin(fuzzy_arrivals[a], fuzzy_queue[q]), cuts[e])
+        # upsample the universe with the points where each consequent crosses its cut
+        x = self.extension.universe.astype(np.float64)
+        points = [np.broadcast_to(x, (len(queue), len(x)))]
+        for label, term in self.extension.terms.items():
+            cut = cuts[label][:, None]
+            m1, m2 = term.mf[:-1], term.mf[1:]
+            crossing = ((m1 >= cut) != (m2 >= cut)) & (cut > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xx = x[:-1] + (cut - m1) * (x[1:] - x[:-1]) / (m2 - m1)
+            points.append(np.where(crossing, xx, x[:-1]))
+        points = np.sort(np.concatenate(points, axis=1), axis=1)
+        # aggregation of the clipped consequents
+        output = np.zeros_like(points)
+        for label, term in self.extension.terms.items():
+            mf = np.interp(points, x, term.mf)
+            np.fmax(output, np.fmin(cuts[label][:, None], mf), output)
+        return self.__centroid(points, output).reshape(shape)
+
+    @staticmethod
+    def __centroid(x, mfx):
+        """
+        Row-wise centroid of piecewise linear membership functions, computed like 
+        skfuzzy.defuzzify.centroid (exact area of each trapezoid).
+        """
+        x1, x2 = x[:, :-1], x[:, 1:]
+        y1, y2 = mfx[:, :-1], mfx[:, 1:]
+        width = x2 - x1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moment = np.where(y1 == y2, 0.5 * (x1 + x2),
+                     np.where(y1 == 0, 2.0 / 3.0 * width + x1,
+                     np.where(y2 == 0, 1.0 / 3.0 * width + x1,
+                              2.0 / 3.0 * width * (y2 + 0.5 * y1) / (y1 + y2) + x1)))
+        area = 0.5 * width * (y1 + y2)
+        area[((y1 == 0) & (y2 == 0)) | (width == 0)] = 0.
+        return (moment * area).sum(axis=1) / np.fmax(area.sum(axis=1), np.finfo(float).eps)
+
+    def get_extension(self, cars_in_queue, cars_arriving_at_green_light):
+        if self.surface is not None:
+            return self.lookup(cars_in_queue, cars_arriving_at_green_light)
+        return self.compute(cars_in_queue, cars_arriving_at_green_light)
 
 
 #fuzzy_controller = traficLightFuzzyController()
@@ -85,4 +275,8 @@ class traficLightFuzzyController():
 #        print("the controller will extend green with {0} seconds".format(fuzzy_controller.get_extension(i,j)))
 graphs = False
 # fuzzycontroller= traficLightFuzzyController()
-# fuzzycontroller.get_extension(6,12)
\ No newline at end of file
+# fuzzycontroller.get_extension(6,12)
+
+if __name__ == '__main__':
+    # check the precomputed control surface against the live control system
+    print('maximum lookup deviation: {}'.format(traficLightFuzzyController(lookup=True).check_surface()))
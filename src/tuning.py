@@ -0,0 +1,320 @@
+"""
+Tuning of the fuzzy control system: search of the membership functions and rule
+consequents minimizing the waiting time of the simulations.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import sys
+from getopt import gnu_getopt, GetoptError
+from multiprocessing import Pool
+import trafficLightFuzzyController as tlfc
+from engines import trimf
+from instrument import configure_logging, get_logger
+from simulation import simulate, replica_seeds
+from stats import WaitStats
+
+logger = get_logger('tuning')
+
+# names of the variables of a definition, in the order of the definition
+VARIABLES = ('arrivals', 'queue', 'extension')
+
+
+def to_params(definition=tlfc.DEFINITION):
+    """
+    Returns the parameters of a definition as a flat dict: 'variable.term' -> trimf bounds
+    and 'rule.arrivals term.queue term' -> extension term.
+    """
+    params = {}
+    for name, (size, terms) in zip(VARIABLES, definition[:3]):
+        for term, bounds in terms:
+            params['{}.{}'.format(name, term)] = tuple(bounds)
+    for a, q, e in definition[3]:
+        params['rule.{}.{}'.format(a, q)] = e
+    return params
+
+
+def to_definition(params, base=tlfc.DEFINITION):
+    """
+    Returns the definition of the given parameters (see to_params), the parameters
+    missing are taken from base.
+    """
+    variables = []
+    for name, (size, terms) in zip(VARIABLES, base[:3]):
+        variables.append((size, tuple((term, tuple(params.get('{}.{}'.format(name, term), bounds)))
+                                      for term, bounds in terms)))
+    rules = tuple((a, q, params.get('rule.{}.{}'.format(a, q), e)) for a, q, e in base[3])
+    return tuple(variables) + (rules,)
+
+
+def mutate(definition, rng, scale=2, rate=0.2):
+    """
+    Returns a random neighbour of a definition: each trimf bound moves by up to scale
+    (the bounds stay sorted, in the universe, and the outer terms keep covering the
+    universe ends), and each rule consequent changes with probability rate.
+    """
+    variables = []
+    for size, terms in definition[:3]:
+        mutated = []
+        for i, (term, bounds) in enumerate(terms):
+            bounds = sorted(min(max(b + rng.randint(-scale, scale), 0), size - 1) for b in bounds)
+            # the outer terms peak at the ends of the universe, so that they cover them
+            if i == 0:
+                bounds[0] = bounds[1] = 0
+            if i == len(terms) - 1:
+                bounds[1] = bounds[2] = size - 1
+            mutated.append((term, tuple(sorted(bounds))))
+        variables.append((size, tuple(mutated)))
+    consequents = [term for term, bounds in definition[2][1]]
+    rules = tuple((a, q, rng.choice(consequents) if rng.random() < rate else e) for a, q, e in definition[3])
+    return tuple(variables) + (rules,)
+
+
+def validate(definition):
+    """
+    Raises ValueError if the definition is not a valid control system: trimf bounds out of
+    order or out of their universe, points of an input universe where no membership function
+    is positive, or a rule base which does not have exactly one rule on defined terms for
+    every pair of arrivals and queue terms. Otherwise no rule fires for some inputs, and the
+    extension is silently 0 there.
+    """
+    for name, (size, terms) in zip(VARIABLES, definition[:3]):
+        for term, (a, b, c) in terms:
+            if not 0 <= a <= b <= c <= size - 1:
+                raise ValueError('{}.{}: bounds {} out of order or out of [0, {}]'.format(name, term, (a, b, c),
+                                                                                      size - 1))
+        if name != 'extension':
+            # the inputs are counts of vehicles, the membership functions are linear in between
+            for x in range(size):
+                if all(trimf(x, bounds) == 0 for term, bounds in terms):
+                    raise ValueError('{}: no membership function covers {}'.format(name, x))
+    arrivals, queue, extension = ([term for term, bounds in terms] for size, terms in definition[:3])
+    rules = definition[3]
+    for a, q, e in rules:
+        if a not in arrivals or q not in queue or e not in extension:
+            raise ValueError('rule {}: unknown term'.format((a, q, e)))
+    if len(rules) != len(arrivals) * len(queue) or len(set((a, q) for a, q, e in rules)) != len(rules):
+        raise ValueError('the rules do not cover every pair of arrivals and queue terms once')
+
+
+def candidate_key(definition, seeds, options):
+    """
+    Returns the hash identifying the score of a definition over the given seeds and simulation options.
+    """
+    return hashlib.sha1(repr((definition, tuple(seeds), sorted(options.items()))).encode()).hexdigest()
+
+
+def evaluate(task):
+    """
+    Simulates the fuzzy controller of a definition over the given seeds and returns its
+    score: mean wait time of the vehicles plus tail_weight times the 95th percentile, or
+    inf if the definition is not valid (see validate) or if a simulation was truncated:
+    it reached the step limit (a lane starves), or the extensions of the definition
+    desynchronized the lights of the controller (see models.LightsDesynchronized).
+    The controllers answer from the control surface of the definition, computed once and
+    shared by the simulations of the process.
+    """
+    definition, seeds, options, tail_weight = task
+    try:
+        validate(definition)
+    except ValueError:
+        return math.inf
+    stats = WaitStats()
+    truncated = False
+    try:
+        for seed in seeds:
+            record = simulate(True, seed, lookup=True, definition=definition, **options)
+            truncated = truncated or record['truncated']
+            stats.merge(WaitStats.from_dict(record['wait_stats']))
+    finally:
+        # the candidates are rarely simulated again in this process, free their surfaces
+        tlfc.clear_cache(definition)
+    if truncated or stats.count == 0:
+        return math.inf
+    return stats.moments.mean + tail_weight * stats.sketch.quantile(0.95)
+
+
+class Tuner(object):
+    """
+    Searches the definitions of the fuzzy control system minimizing the score of evaluate,
+    over the same seeded replicas for every candidate. Candidates are evaluated in parallel
+    and their scores cached by their hash (and saved to the cache file if given), so that a
+    candidate is never simulated twice.
+    Constructor parameters:
+        replicas    (int): number of simulations of a candidate
+        seed    (int): master seed of the simulations and of the search
+        jobs    (int): number of worker processes
+        tail_weight (float): weight of the 95th percentile wait time in the score
+        cache   (String): JSON file of the scores, loaded and updated
+        options (dict): options of simulation.simulate (events, array_lanes, arrivals)
+    """
+    def __init__(self, replicas=20, seed=0, jobs=1, tail_weight=1., cache=None, options=None):
+        self.seeds = list(replica_seeds(seed, replicas))
+        self.rng = random.Random(seed)
+        self.jobs = jobs
+        self.tail_weight = tail_weight
+        self.cache = cache
+        self.options = options or {}
+        self.pool = None
+        self.scores = {}
+        if cache is not None and os.path.exists(cache):
+            with open(cache) as f:
+                self.scores = json.load(f)
+        # best definition and score so far
+        self.best = None
+        self.best_score = math.inf
+
+    def score(self, definitions):
+        """
+        Returns the scores of the definitions, simulating only those not in the cache.
+        """
+        keys = [candidate_key(d, self.seeds, self.options) for d in definitions]
+        todo = {}
+        for key, definition in zip(keys, definitions):
+            if key not in self.scores:
+                todo[key] = definition
+        if todo:
+            tasks = [(d, self.seeds, self.options, self.tail_weight) for d in todo.values()]
+            if self.jobs > 1:
+                if self.pool is None:
+                    self.pool = Pool(self.jobs)
+                scores = self.pool.map(evaluate, tasks)
+            else:
+                scores = list(map(evaluate, tasks))
+            self.scores.update(zip(todo, scores))
+            if self.cache is not None:
+                with open(self.cache, 'w') as f:
+                    json.dump(self.scores, f)
+        scores = [self.scores[key] for key in keys]
+        for definition, score in zip(definitions, scores):
+            if score < self.best_score:
+                self.best, self.best_score = definition, score
+        return scores
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def grid(self, space, base=tlfc.DEFINITION):
+        """
+        Scores every combination of the parameter values of space ('parameter' -> list of
+        values, see to_params) applied to base.
+        """
+        names = list(space)
+        combinations = [{}]
+        for name in names:
+            combinations = [dict(c, **{name: value}) for c in combinations for value in space[name]]
+        return self.score([to_definition(c, base) for c in combinations])
+
+    def random_search(self, candidates, base=tlfc.DEFINITION, scale=2, rate=0.2):
+        """
+        Scores the given number of random neighbours of base (see mutate).
+        """
+        return self.score([base] + [mutate(base, self.rng, scale, rate) for i in range(candidates)])
+
+    def evolve(self, generations, population=8, offspring=16, base=tlfc.DEFINITION, scale=2, rate=0.2):
+        """
+        (population + offspring) evolution strategy: at each generation, offspring mutants
+        of the best population candidates are scored, and the best population candidates
+        among parents and mutants are kept. The best score of each generation is logged
+        (info level).
+        """
+        parents = [base]
+        scores = self.score(parents)
+        for generation in range(generations):
+            children = [mutate(self.rng.choice(parents), self.rng, scale, rate) for i in range(offspring)]
+            ranked = sorted(zip(scores + self.score(children), range(len(parents) + offspring),
+                                parents + children))[:population]
+            scores = [score for score, i, d in ranked]
+            parents = [d for score, i, d in ranked]
+            logger.info('generation %s: best score %.3f', generation, scores[0])
+        return scores
+
+
+def usage():
+    s = "usage: tuning.py [OPTIONS]\n"
+    s+= "Searches the membership functions and rule consequents of the fuzzy controller minimizing\n"
+    s+= "the mean plus the weighted 95th percentile of the vehicle wait times.\n"
+    s+= "The following options may be provided:\n"
+    s+= "-h\n\t print this help\n"
+    s+= "-m 'grid', 'random' or 'evolve'\n\t search method (default evolve)\n"
+    s+= "-n INT\n\t number of random candidates, or of generations (default 10)\n"
+    s+= "-r INT\n\t number of simulations of a candidate (default 20)\n"
+    s+= "-w FLOAT\n\t weight of the 95th percentile wait time in the score (default 1)\n"
+    s+= "-j INT\n\t number of worker processes\n"
+    s+= "-c FILE\n\t JSON cache of the scores, reused by later runs\n"
+    s+= "-e\n\t next-event time advance in the simulations\n"
+    s+= "--seed INT\n\t master seed of the simulations and of the search\n"
+    s+= "--log-level LEVEL\n\t enables the logs of LEVEL and above (default: warning, and info for the\n\t progress of the search)\n"
+    print(s)
+
+
+if __name__ == '__main__':
+    method = 'evolve'
+    n = 10
+    options = {}
+    tuner_options = {}
+    level = None
+    try:
+        opt_arg, args = gnu_getopt(sys.argv[1:], 'hm:n:r:w:j:c:e', ['seed=', 'log-level='])
+        for opt, arg in opt_arg:
+            if opt == '-h':
+                usage()
+                sys.exit(0)
+            elif opt == '-m':
+                if arg not in ('grid', 'random', 'evolve'):
+                    raise GetoptError('unknown method')
+                method = arg
+            elif opt == '-n':
+                n = int(arg)
+            elif opt == '-r':
+                tuner_options['replicas'] = int(arg)
+            elif opt == '-w':
+                tuner_options['tail_weight'] = float(arg)
+            elif opt == '-j':
+                tuner_options['jobs'] = int(arg)
+            elif opt == '-c':
+                tuner_options['cache'] = arg
+            elif opt == '-e':
+                options['events'] = True
+            elif opt == '--seed':
+                tuner_options['seed'] = int(arg)
+            elif opt == '--log-level':
+                level = arg.upper()
+                if not isinstance(logging.getLevelName(level), int):
+                    raise GetoptError('unknown log level')
+    except (GetoptError, ValueError):
+        usage()
+        sys.exit(-1)
+
+    configure_logging(level if level is not None else logging.WARNING)
+    if level is None:
+        # the progress of the search is shown, not the logs of every simulation
+        logger.setLevel(logging.INFO)
+
+    tuner = Tuner(options=options, **tuner_options)
+    base_score = tuner.score([tlfc.DEFINITION])[0]
+    if method == 'grid':
+        # peaks of the middle terms of the inputs
+        tuner.grid({'arrivals.F': [(1, 3, 7), (1, 4, 7), (1, 5, 7)],
+                    'arrivals.MY': [(5, 8, 13), (5, 9, 13), (5, 10, 13)],
+                    'queue.S': [(1, 3, 7), (1, 4, 7), (1, 5, 7)]})
+    elif method == 'random':
+        tuner.random_search(n)
+    else:
+        tuner.evolve(n)
+    tuner.close()
+    print('score of the default definition: {:.3f}'.format(base_score))
+    print('best score: {:.3f}'.format(tuner.best_score))
+    base = to_params()
+    for name, value in to_params(tuner.best).items():
+        if value != base[name]:
+            print('{:<16} {} -> {}'.format(name, base[name], value))
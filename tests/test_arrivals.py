@@ -0,0 +1,79 @@
+import math
+import numpy as np
+import pytest
+from arrivals import ArrivalProcess, Bernoulli, Poisson, TimeVarying, Trace, sinusoidal, save_trace
+
+
+def reference(process, steps):
+    return [process.take(step) for step in range(steps)]
+
+
+@pytest.mark.parametrize('make', [
+    lambda: Bernoulli(0.3, seed=1, block=8),
+    lambda: Poisson(0.4, seed=2, block=8),
+    lambda: TimeVarying(sinusoidal(0.3, period=20), seed=3, block=8),
+])
+def test_take_unchanged_by_next_arrival(make):
+    expected = reference(make(), 200)
+    process = make()
+    taken = []
+    step = 0
+    while step < 100:
+        taken.append(process.take(step))
+        # look ahead, possibly several blocks past the current one
+        arrival = process.next_arrival(step + 1)
+        assert arrival >= 200 or expected[arrival] > 0
+        assert all(expected[s] == 0 for s in range(step + 1, min(arrival, 200)))
+        step += 1
+    assert taken == expected[:100]
+
+
+def test_next_arrival_matches_counts():
+    expected = reference(Bernoulli(0.1, seed=4, block=8), 200)
+    process = Bernoulli(0.1, seed=4, block=8)
+    arrivals = []
+    step = process.next_arrival(0)
+    while step < 200:
+        arrivals.append(step)
+        step = process.next_arrival(step + 1)
+    assert arrivals == [s for s in range(200) if expected[s] > 0]
+
+
+def test_blocks_are_dropped():
+    process = Bernoulli(0.5, seed=0, block=8)
+    for step in range(100):
+        process.take(step)
+    assert len(process.blocks) == 1
+
+
+def test_earlier_step_rejected():
+    process = Bernoulli(0.5, seed=0, block=8)
+    process.take(20)
+    with pytest.raises(ValueError):
+        process.take(3)
+
+
+def test_trace_end_and_loop(tmp_path):
+    counts = np.array([[1, 0], [0, 2], [3, 0]])
+    path = str(tmp_path / 'trace.npy')
+    save_trace(path, counts)
+    trace = Trace(path, column=0, block=2)
+    assert [trace.take(s) for s in range(5)] == [1, 0, 3, 0, 0]
+    assert Trace(path, column=1, block=2).next_arrival(2) == math.inf
+    looped = Trace(path, column=0, loop=True, block=2)
+    assert [looped.take(s) for s in range(7)] == [1, 0, 3, 1, 0, 3, 1]
+
+
+def test_raw_trace_needs_columns(tmp_path):
+    path = str(tmp_path / 'trace.bin')
+    np.array([[1, 0], [0, 2]], dtype=np.int32).tofile(path)
+    with pytest.raises(ValueError):
+        Trace(path)
+    assert [Trace(path, column=1, columns=2).take(s) for s in range(2)] == [0, 2]
+
+
+def test_incomplete_process_rejected():
+    class Incomplete(ArrivalProcess):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
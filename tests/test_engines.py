@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from engines import Engine, MamdaniEngine, SugenoEngine
+
+
+def test_mamdani_matches_skfuzzy():
+    from trafficLightFuzzyController import traficLightFuzzyController
+    queue, arrivals = np.meshgrid(np.arange(-1, 17, 0.5), np.arange(-1, 17, 0.5))
+    expected = traficLightFuzzyController().get_extension_batch(queue, arrivals)
+    assert np.allclose(MamdaniEngine().get_extension_batch(queue, arrivals), expected, atol=1e-9)
+
+
+def test_sugeno_batch_matches_scalar():
+    engine = SugenoEngine()
+    queue, arrivals = np.meshgrid(np.arange(-1, 17, 0.3), np.arange(-1, 17, 0.3))
+    scalar = np.vectorize(engine.compute)(queue, arrivals)
+    assert np.allclose(engine.get_extension_batch(queue, arrivals), scalar)
+
+
+def test_incomplete_engine_rejected():
+    class Incomplete(Engine):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_sugeno_simulations_record_desynchronized_lights():
+    from simulation import simulate
+    records = [simulate(True, seed, backend='sugeno') for seed in range(300)]
+    desynchronized = [r for r in records if r['desynchronized']]
+    # the Sugeno extensions desynchronize the lights of some replicas, which end truncated
+    assert desynchronized and all(r['truncated'] for r in desynchronized)
+    assert all(not r['truncated'] for r in records if r not in desynchronized)
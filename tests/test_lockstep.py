@@ -0,0 +1,49 @@
+import numpy as np
+from engines import SugenoEngine
+from lockstep import LockstepSimulation
+from models import LightsDesynchronized
+from road import Vehicle
+from simulation import build
+
+
+def replay(arrivals, max_steps):
+    """
+    Scalar simulation of simulate() driven by the given arrivals, returns the steps, the
+    truncated and desynchronized flags and the total wait of each lane.
+    """
+    control, north2south, west2east = build(True, backend='sugeno')
+    step = 0
+    truncated = desynchronized = False
+    while north2south.car_out < 50 and west2east.car_out < 50:
+        if step > max_steps:
+            truncated = True
+            break
+        for lane, arrival in zip((north2south, west2east), arrivals[step]):
+            if arrival:
+                lane.append(Vehicle())
+        try:
+            control.step()
+            north2south.step()
+            west2east.step()
+        except LightsDesynchronized:
+            truncated = desynchronized = True
+            break
+        step += 1
+    return step, truncated, desynchronized, [north2south.total_wait, west2east.total_wait]
+
+
+def test_desynchronized_replicas_match_scalar_controller():
+    replicas, seed, max_steps = 100, 3, 2000
+    sim = LockstepSimulation(replicas, fuzzy=True, seed=seed, max_steps=max_steps + 1)
+    sim.fuzzy = SugenoEngine()
+    results = sim.run()
+    # the Sugeno extensions desynchronize the lights of some replicas, which end truncated
+    assert results['desynchronized'].any()
+    assert not (results['desynchronized'] & ~results['truncated']).any()
+    for i in range(replicas):
+        # same arrivals as replica i (drawn by blocks from its own stream)
+        arrivals = np.random.default_rng((seed, i)).random((max_steps + 64, 2)) >= sim.thresholds
+        expected = replay(arrivals, max_steps)
+        got = (results['steps'][i], results['truncated'][i], results['desynchronized'][i],
+               results['total_wait'][i].tolist())
+        assert got == expected, i
@@ -0,0 +1,40 @@
+import random
+import pytest
+from recorder import TraceReader, TraceWriter
+from road import Vehicle
+from simulation import build
+
+
+def record(path, steps, chunk, ring=None):
+    rng = random.Random(3)
+    control, *lanes = build(False)
+    writer = TraceWriter(path, control, lanes, chunk=chunk, ring=ring)
+    for step in range(steps):
+        for lane, p in zip(lanes, (0.5, 0.2)):
+            if rng.uniform(0, 1) >= 1 - p:
+                lane.append(Vehicle())
+        control.step()
+        for lane in lanes:
+            lane.step()
+        writer.record(step)
+    writer.close()
+    return TraceReader(path)
+
+
+@pytest.mark.parametrize('chunk', [16, 64])
+@pytest.mark.parametrize('ring', [1, 37, 100, 500])
+def test_ring_keeps_exactly_the_last_steps(tmp_path, ring, chunk):
+    full = record(str(tmp_path / 'full'), 300, 16)
+    reader = record(str(tmp_path / 'ring'), 300, chunk, ring)
+    assert len(reader) == min(ring, 300) and reader.last == 299
+    assert reader.first == max(300 - ring, 0)
+    for step in range(reader.first, 300):
+        assert reader[step]['clocks'] == full[step]['clocks']
+        assert all((a == b).all() for a, b in zip(reader[step]['occupancy'], full[step]['occupancy']))
+
+
+def test_small_ring_written_by_chunks(tmp_path):
+    reader = record(str(tmp_path), 300, 64, ring=5)
+    # one file per chunk of 64 steps (the last one at close), not one per step
+    assert [c[0] for c in reader.chunks] == [4] and len(reader) == 5
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['chunk-000004.npz', 'trace.json']
@@ -0,0 +1,62 @@
+import asyncio
+import json
+from models import LightsDesynchronized
+from service import ControllerService
+
+
+class Writer(object):
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        self.messages.append(json.loads(data))
+
+
+def register(service, writer, i):
+    service.register({'intersection': i, 'lanes': [[1, 'green'], [2, 'red']]}, writer)
+    return service.intersections[(writer, i)].control
+
+
+def test_failed_intersection_does_not_stop_the_others():
+    service = ControllerService(lookup=True)
+    writer = Writer()
+    controls = [register(service, writer, i) for i in range(3)]
+
+    def fail(extension=None):
+        raise LightsDesynchronized('no red light')
+    controls[1].complete = fail
+    for tick in range(20):
+        service.tick(writer)
+    first = writer.messages[0]
+    assert first['failed'] == [[1, 'LightsDesynchronized: no red light']]
+    assert all(m['failed'] == [] for m in writer.messages[1:])
+    assert sorted(i for w, i in service.intersections) == [0, 2]
+    # the other intersections went through every step, like an intersection stepped alone
+    reference = ControllerService(lookup=True)
+    alone = register(reference, Writer(), 0)
+    for tick in range(20):
+        reference.tick()
+    for control in (controls[0], controls[2]):
+        assert [(l.state, l.clocks) for l in control.lights.values()] == \
+            [(l.state, l.clocks) for l in alone.lights.values()]
+        assert control.dump_state() == alone.dump_state()
+
+
+def test_clock_survives_a_failed_tick():
+    service = ControllerService(period=0.001)
+    calls = []
+
+    def tick(writer=None):
+        calls.append(writer)
+        if len(calls) == 1:
+            raise RuntimeError('tick failed')
+
+    service.tick = tick
+
+    async def run():
+        clock = asyncio.ensure_future(service.clock())
+        await asyncio.sleep(0.05)
+        assert not clock.done()
+        clock.cancel()
+    asyncio.run(run())
+    assert len(calls) > 1
@@ -0,0 +1,45 @@
+import pickle
+import random
+import zlib
+import pytest
+from road import Vehicle
+from simulation import build
+from snapshot import capture, restore
+
+
+def run(rng, control, lanes, steps):
+    for step in range(steps):
+        for lane, p in zip(lanes, (0.5, 0.2)):
+            if rng.uniform(0, 1) >= 1 - p:
+                lane.append(Vehicle())
+        control.step()
+        for lane in lanes:
+            lane.step()
+
+
+def state(control, lanes):
+    return control.dump_state(), [lane.dump_state() for lane in lanes]
+
+
+@pytest.mark.parametrize('fuzzy, array_lanes', [(False, False), (True, False), (True, True)])
+def test_round_trip(fuzzy, array_lanes):
+    rng = random.Random(7)
+    control, *lanes = build(fuzzy, array_lanes=array_lanes)
+    run(rng, control, lanes, 150)
+    snapshot = capture(150, rng, control, lanes)
+    run(rng, control, lanes, 100)
+
+    restored_rng = random.Random()
+    restored, *restored_lanes = build(fuzzy, array_lanes=array_lanes)
+    assert restore(snapshot, restored_rng, restored, restored_lanes) == 150
+    run(restored_rng, restored, restored_lanes, 100)
+    assert state(restored, restored_lanes) == state(control, lanes)
+    assert restored_rng.getstate() == rng.getstate()
+
+
+def test_rejects_other_payloads():
+    control, *lanes = build(False)
+    for payload in (b'not a snapshot', zlib.compress(pickle.dumps({'version': 3})),
+                    zlib.compress(b'{"version": 2}')):
+        with pytest.raises(ValueError):
+            restore(payload, random.Random(), control, lanes)
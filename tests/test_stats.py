@@ -0,0 +1,183 @@
+import json
+import math
+import random
+from statistics import NormalDist
+import pytest
+from stats import Histogram, PairedDifference, QuantileSketch, WaitStats, Welford, WindowSeries
+
+
+def test_interval_of_the_mean_difference():
+    difference = PairedDifference()
+    assert difference.half_width() == math.inf and difference.sequence_half_width() == math.inf
+    for x, y in ((3, 1), (5, 2), (4, 4), (6, 1)):
+        difference.add(x, y)
+    assert difference.count == 4
+    low, high = difference.interval()
+    assert math.isclose((low + high) / 2, 2.5)
+    assert math.isclose(high - low, 2 * NormalDist().inv_cdf(0.975) * difference.difference.std() / 2)
+
+
+def test_sequence_wider_than_interval():
+    rng = random.Random(1)
+    difference = PairedDifference()
+    for n in range(1000):
+        difference.add(rng.gauss(0, 1), rng.gauss(0, 1))
+        if difference.count >= 2:
+            assert difference.sequence_half_width() > difference.half_width()
+
+
+def stops_early(rng, sequential, pairs=200):
+    # optional stopping under the null hypothesis: checked after every pair
+    difference = PairedDifference()
+    for n in range(pairs):
+        difference.add(rng.gauss(0, 1), rng.gauss(0, 1))
+        if n >= 4 and difference.significant(0.05, sequential):
+            return True
+    return False
+
+
+def test_sequence_valid_under_optional_stopping():
+    rng = random.Random(2)
+    runs = 300
+    fixed = sum(stops_early(rng, False) for run in range(runs)) / runs
+    sequence = sum(stops_early(rng, True) for run in range(runs)) / runs
+    # repeatedly testing the fixed interval inflates the error well beyond alpha
+    assert fixed > 0.15
+    assert sequence <= 0.05
+
+
+def test_sequence_detects_a_shift():
+    rng = random.Random(3)
+    difference = PairedDifference()
+    while not difference.significant(0.05, sequential=True):
+        difference.add(rng.gauss(1, 1), rng.gauss(0, 1))
+    assert difference.count < 200 and difference.interval(0.05, True)[0] > 0
+
+
+def test_window_series_merges_in_pairs():
+    series = WindowSeries(('a', 'b'), window=2, points=4)
+    for step in range(21):
+        series.add(step, 1)
+    d = series.to_dict()
+    # 4 windows of 2 steps, merged into 2 of 4, then 4 of 4, merged into 2 of 8
+    assert d['window'] == 8 and d['last'] == 5
+    assert d['a'] == [sum(range(8)), sum(range(8, 16)), sum(range(16, 21))]
+    assert d['b'] == [8, 8, 5]
+    assert sum(d['a']) == sum(range(21))
+
+
+def test_window_series_points():
+    for points in (0, 1, 3):
+        with pytest.raises(ValueError):
+            WindowSeries(('a',), points=points)
+    series = WindowSeries(('a',), window=1, points=2)
+    for step in range(100):
+        series.add(1)
+    assert len(series.sums[0]) < 2 and sum(series.to_dict()['a']) == 100
+
+
+def waits(seed, n=2000):
+    # waiting times in steps: many zeros and a long tail
+    rng = random.Random(seed)
+    return [int(rng.expovariate(0.05)) if rng.random() < 0.8 else 0 for i in range(n)]
+
+
+def test_merge_equals_single_stream():
+    # one summary per lane and replica, merged, against all the values added to one
+    parts = [waits(seed) for seed in range(6)]
+    merged = WaitStats()
+    for values in parts:
+        stats = WaitStats()
+        for x in values:
+            stats.add(x)
+        merged.merge(stats)
+    single = WaitStats()
+    for values in parts:
+        for x in values:
+            single.add(x)
+    assert merged.count == single.count == 6 * 2000
+    assert math.isclose(merged.moments.mean, single.moments.mean)
+    assert math.isclose(merged.moments.variance(), single.moments.variance())
+    assert (merged.moments.min, merged.moments.max) == (single.moments.min, single.moments.max)
+    assert merged.histogram.counts == single.histogram.counts
+    assert merged.sketch.zero == single.sketch.zero and merged.sketch.buckets == single.sketch.buckets
+    for q in (0, 0.5, 0.95, 0.99, 1):
+        assert merged.sketch.quantile(q) == single.sketch.quantile(q)
+
+
+def test_welford_merge_empty():
+    moments = Welford()
+    for x in (1, 2, 4):
+        moments.add(x)
+    moments.merge(Welford())
+    empty = Welford()
+    empty.merge(moments)
+    assert (empty.count, empty.mean, empty.m2, empty.min, empty.max) == \
+        (moments.count, moments.mean, moments.m2, moments.min, moments.max)
+
+
+def test_histogram_overflow_and_compatibility():
+    histogram = Histogram(width=2, bins=4)
+    for x in (0, 1.5, 2, 7.9, 8, 100):
+        histogram.add(x)
+    assert histogram.counts == [2, 1, 0, 1, 2]
+    assert histogram.edges() == [0, 2, 4, 6, 8]
+    with pytest.raises(AssertionError):
+        histogram.merge(Histogram(width=1, bins=4))
+
+
+@pytest.mark.parametrize('alpha', [0.01, 0.05])
+def test_quantiles_within_relative_error(alpha):
+    rng = random.Random(4)
+    values = [rng.lognormvariate(3, 1.5) for i in range(20000)]
+    sketch = QuantileSketch(alpha=alpha)
+    for x in values:
+        sketch.add(x)
+    values.sort()
+    for q in (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 0.999, 1):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= alpha * exact * (1 + 1e-9)
+
+
+def test_quantiles_of_zero_waits():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+    for x in (0, 0, 0, 10):
+        sketch.add(x)
+    assert sketch.quantile(0.5) == 0 and math.isclose(sketch.quantile(1), 10, rel_tol=sketch.alpha)
+
+
+def test_collapse_bounds_memory():
+    rng = random.Random(5)
+    # values over many orders of magnitude need far more than max_buckets buckets
+    values = [math.exp(rng.uniform(-20, 20)) for i in range(20000)]
+    sketch = QuantileSketch(alpha=0.01, max_buckets=100)
+    other = QuantileSketch(alpha=0.01, max_buckets=100)
+    for i, x in enumerate(values):
+        (sketch if i % 2 else other).add(x)
+        assert len(sketch.buckets) <= 100 and len(other.buckets) <= 100
+    sketch.merge(other)
+    assert len(sketch.buckets) <= 100 and sketch.count == len(values)
+    # only the lowest buckets are collapsed: the high quantiles keep their accuracy
+    values.sort()
+    for q in (0.99, 0.999, 1):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= sketch.alpha * exact * (1 + 1e-9)
+
+
+def test_wait_stats_round_trip():
+    stats = WaitStats()
+    for x in waits(6):
+        stats.add(x)
+    for original in (stats, WaitStats()):
+        # through JSON, as in the results files
+        copy = WaitStats.from_dict(json.loads(json.dumps(original.to_dict())))
+        assert copy.to_dict() == original.to_dict()
+        assert copy.summary(100) == original.summary(100)
+        assert copy.histogram.counts == original.histogram.counts
+        assert copy.sketch.count == original.sketch.count
+        assert (copy.moments.min, copy.moments.max) == (original.moments.min, original.moments.max)
+    # a restored summary merges like the original
+    merged = WaitStats.from_dict(stats.to_dict()).merge(WaitStats.from_dict(stats.to_dict()))
+    twice = WaitStats().merge(stats).merge(stats)
+    assert merged.to_dict() == twice.to_dict()
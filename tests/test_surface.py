@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from trafficLightFuzzyController import traficLightFuzzyController as TLFC
+
+
+def integer_inputs(controller):
+    # the grid points and the out of range integers clipped to the universe bounds
+    return [(q, a) for q in range(-2, len(controller.queue.universe) + 2)
+            for a in range(-2, len(controller.arrivals.universe) + 2)]
+
+
+def test_lookup_within_tolerance():
+    controller = TLFC(lookup=True)
+    # the half-integer inputs, midway between the grid points, are the farthest from the table
+    # (resolution 2 keeps the number of live inferences, about 20 ms each, reasonable)
+    assert controller.check_surface(tolerance=0.75, resolution=2) <= 0.75
+
+
+def test_lookup_exact_at_integer_inputs():
+    controller = TLFC(lookup=True)
+    for q, a in integer_inputs(controller):
+        # the table entry itself, and the live inference up to the rounding of the operations
+        assert controller.lookup(q, a) == float(controller.get_extension_batch(q, a))
+        assert controller.lookup(q, a) == pytest.approx(controller.compute(q, a), abs=1e-9)
+
+
+def test_check_surface_detects_a_wrong_table():
+    controller = TLFC(lookup=True)
+    controller.surface = controller.surface.copy()
+    controller.surface[3, 5] += 1
+    with pytest.raises(AssertionError):
+        controller.check_surface(resolution=1)
+
+
+def test_check_surface_detects_a_shifted_table():
+    controller = TLFC(lookup=True)
+    # off by one grid cell, as a wrong index in compute_surface or lookup would be
+    controller.surface = np.roll(controller.surface, 1, axis=0)
+    with pytest.raises(AssertionError):
+        controller.check_surface(resolution=1)
@@ -0,0 +1,46 @@
+import math
+import random
+import pytest
+import trafficLightFuzzyController as tlfc
+from tuning import evaluate, mutate, to_definition, validate
+
+
+def test_default_definition_valid():
+    validate(tlfc.DEFINITION)
+
+
+@pytest.mark.parametrize('params', [
+    # no membership function covers 0, or 3
+    {'arrivals.AN': (0, 1, 2)},
+    {'queue.VS': (0, 0, 2), 'queue.S': (3, 4, 7)},
+    # bounds out of order, or out of the universe
+    {'extension.SO': (2, 0, 4)},
+    {'queue.L': (10, 15, 16)},
+    # unknown consequent
+    {'rule.AN.VS': 'XL'},
+])
+def test_invalid_definitions(params):
+    definition = to_definition(params)
+    with pytest.raises(ValueError):
+        validate(definition)
+    assert evaluate((definition, [0], {}, 1.)) == math.inf
+
+
+def test_rules_cover_every_pair():
+    definition = tlfc.DEFINITION[:3] + (tlfc.DEFINITION[3][1:],)
+    with pytest.raises(ValueError):
+        validate(definition)
+
+
+def test_mutants_cover_the_universe_ends():
+    rng = random.Random(0)
+    for i in range(100):
+        for size, terms in mutate(tlfc.DEFINITION, rng, scale=4)[:2]:
+            assert terms[0][1][:2] == (0, 0) and terms[-1][1][1:] == (size - 1, size - 1)
+
+
+def test_clear_cache():
+    system = tlfc.compile_system(tlfc.DEFINITION)
+    assert tlfc.compile_system(tlfc.DEFINITION) is system
+    tlfc.clear_cache(tlfc.DEFINITION)
+    assert tlfc.compile_system(tlfc.DEFINITION) is not system
@@ -0,0 +1,86 @@
+import random
+import pytest
+from arraylane import ArrayLane
+from models import Controller, FuzzyLogicController, PhaseController, State
+from road import Lane, Vehicle
+
+
+class PerEventFuzzyController(FuzzyLogicController):
+    """
+    FuzzyLogicController updating its metrics vehicle by vehicle, as before update_batch.
+    """
+    def update(self, lane_id, position):
+        state = self.lights[lane_id].state
+        if position == 0:
+            assert state == State.green
+            self.green_out += 1
+        elif state == State.green:
+            self.green_in += 1
+        elif state == State.red:
+            self.red_in += 1
+        else:
+            self.amber_in += 1
+
+    def update_batch(self, id, n_in, n_out, position):
+        Controller.update_batch(self, id, n_in, n_out, position)
+
+
+class PerEventPhaseController(PhaseController):
+    def update_batch(self, id, n_in, n_out, position):
+        Controller.update_batch(self, id, n_in, n_out, position)
+
+
+def trajectory(control, lane_type, seed, steps=600, phases=None):
+    rng = random.Random(seed)
+    if phases is None:
+        lanes = [lane_type(control, S=15, D=7, name='North to South', init_state=State.green),
+                 lane_type(control, S=15, D=7, name='West to East', init_state=State.red)]
+    else:
+        lanes = [Lane(control, S=15, D=7, name='lane {}'.format(i), phase=phase) for i, phase in enumerate(phases)]
+    for step in range(steps):
+        for lane, p in zip(lanes, (0.5, 0.2, 0.3, 0.4)):
+            if rng.uniform(0, 1) >= 1 - p:
+                lane.append(Vehicle())
+        control.step()
+        for lane in lanes:
+            lane.step()
+        yield ([(lane.light.state, lane.light.clocks[lane.light.state], lane.car_in, lane.car_out, lane.total_wait)
+                for lane in lanes], getattr(control, 'last_extension', None))
+
+
+@pytest.mark.parametrize('lane_type', [Lane, ArrayLane])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_fuzzy_controller_batch_matches_events(lane_type, seed):
+    batched = FuzzyLogicController(lookup=True, backend='mamdani')
+    per_event = PerEventFuzzyController(lookup=True, backend='mamdani')
+    for a, b in zip(trajectory(batched, lane_type, seed), trajectory(per_event, lane_type, seed)):
+        assert a == b
+        assert (batched.green_in, batched.green_out, batched.amber_in, batched.red_in) == \
+            (per_event.green_in, per_event.green_out, per_event.amber_in, per_event.red_in)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_phase_controller_batch_matches_events(seed):
+    phases = (0, 0, 1, 1)
+    batched = PhaseController(fuzzy=True, lookup=True, backend='mamdani')
+    per_event = PerEventPhaseController(fuzzy=True, lookup=True, backend='mamdani')
+    for a, b in zip(trajectory(batched, Lane, seed, phases=phases), trajectory(per_event, Lane, seed, phases=phases)):
+        assert a == b
+        assert batched.metrics == per_event.metrics
+
+
+def test_fuzzy_controller_counters_with_many_vehicles():
+    rng = random.Random(0)
+    controllers = [FuzzyLogicController(backend='sugeno'), PerEventFuzzyController(backend='sugeno')]
+    lanes = [[Lane(control, S=15, D=7, name='North to South', init_state=State.green),
+              Lane(control, S=15, D=7, name='West to East', init_state=State.red)] for control in controllers]
+    for step in range(300):
+        # the lights are set by hand, only the counters are compared
+        states = [rng.choice(list(State)) for k in range(2)]
+        batches = [(rng.randint(0, 3), rng.randint(0, 2) if state == State.green else 0) for state in states]
+        for control, pair in zip(controllers, lanes):
+            for lane, state, (n_in, n_out) in zip(pair, states, batches):
+                lane.light.state = state
+                control.update_batch(lane.id, n_in, n_out, lane.D)
+        a, b = controllers
+        assert (a.green_in, a.green_out, a.amber_in, a.red_in) == (b.green_in, b.green_out, b.amber_in, b.red_in)